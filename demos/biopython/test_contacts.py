@@ -0,0 +1,123 @@
+import glob
+import os
+import sys
+import time
+from io import StringIO
+
+import pytest
+from Bio.PDB import PDBParser, NeighborSearch
+from Bio.PDB.Polypeptide import three_to_index, is_aa, index_to_one
+
+# Regression test of the vectorized ligand contact engine used by the Foldseek post-processor.
+# The NeighborSearch implementation below is the original `extract_binding_sites_for_chain`,
+# results of `extract_binding_sites` must be identical to it.
+#
+# Run with pytest (all demo structures) or as a script: python test_contacts.py [structure.pdb ...]
+
+DEMO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CONTAINERS = os.path.join(DEMO_DIRECTORY, "..", "..", "src", "containers")
+sys.path.insert(0, os.path.join(CONTAINERS, "shared"))
+sys.path.insert(0, os.path.join(CONTAINERS, "data-source-executors"))
+sys.path.insert(0, os.path.join(CONTAINERS, "data-source-executors", "executor-foldseek"))
+os.environ.setdefault("LOGGING_TZ", "UTC")
+os.environ.setdefault("FOLDSEEK_STRUCTURE_CACHE_DIR", os.path.join("cache", "structures"))
+
+from data_format.builder import BindingSite, Residue
+from post_processor import extract_binding_sites
+
+
+def reference_extract_binding_sites_for_chain(pdb_id, pdb_file_text, input_chain):
+    file = StringIO(pdb_file_text)
+    pdb = PDBParser().get_structure(pdb_id, file)
+    file.close()
+
+    binding_sites = []
+    dist_thresh = 5  # Distance threshold for neighbor search
+    atoms = list(pdb.get_atoms())
+    ns = NeighborSearch(atom_list=atoms)
+    chain_seq = ""
+    seq_to_str_mapping = {}
+
+    for model in pdb:
+        for chain in model:
+            chain_id = chain.id
+            if chain_id != input_chain:
+                continue
+            residue_dict = {}
+            sequence_index = 0
+            ligand_binding_sites = {}
+
+            for residue in chain:
+                if residue.id[0] == " " and is_aa(residue, standard=True):  # Exclude heteroatoms and non-amino acids
+                    residue_index = residue.id[1]  # Get residue structure index
+                    residue_dict[residue_index] = sequence_index
+                    seq_to_str_mapping[sequence_index] = residue_index
+                    chain_seq += index_to_one(three_to_index(residue.get_resname()))
+                    sequence_index += 1
+
+            for residue in chain:
+                if residue.id[0].startswith("H_"):  # Identify ligand residues
+                    ligand_id = residue.id
+
+                    binding_residues = set()
+                    ligand_atoms = residue.get_atoms()
+
+                    for atom in ligand_atoms:
+                        nearby_atoms = ns.search(atom.coord, dist_thresh)
+
+                        for nearby_atom in nearby_atoms:
+                            nearby_residue = nearby_atom.get_parent()
+                            if nearby_residue not in binding_residues and nearby_residue.id[0] != "W":  # Exclude water and non-amino acids
+                                binding_residues.add(nearby_residue)
+                                nearby_residue_index = nearby_residue.id[1]
+
+                                if ligand_id not in ligand_binding_sites:
+                                    ligand_binding_sites[ligand_id] = []
+                                if residue_dict.get(nearby_residue_index, None) != None:
+                                    ligand_binding_sites[ligand_id].append(
+                                        Residue(
+                                            sequenceIndex=residue_dict[nearby_residue_index],
+                                            structureIndex=nearby_residue_index
+                                            )
+                                        )
+
+            for ligand_id, residues in ligand_binding_sites.items():
+                binding_sites.append(
+                    BindingSite(
+                        id=ligand_id[0], # Get ligand name from tuple e.g. ('H_ADP', 704, ' ')
+                        confidence=1,
+                        residues=sorted(residues, key=lambda r: r.sequenceIndex)
+                    )
+                )
+
+    return binding_sites, chain_seq, seq_to_str_mapping
+
+
+def compare_with_reference(structure):
+    with open(structure, "r") as f:
+        pdb_file_text = f.read()
+    chains = {chain.id for chain in PDBParser(QUIET=True).get_structure("query", StringIO(pdb_file_text)).get_chains()}
+
+    start = time.perf_counter()
+    expected = {chain: reference_extract_binding_sites_for_chain("query", pdb_file_text, chain) for chain in chains}
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = extract_binding_sites("query", pdb_file_text, chains)
+    vectorized_time = time.perf_counter() - start
+
+    for chain in sorted(chains):
+        assert actual[chain] == expected[chain], f"{structure} chain {chain}: results differ"
+        print(f"{structure} chain {chain}: {len(actual[chain][0])} binding sites OK")
+
+    print(f"{structure}: reference {reference_time:.3f} s, vectorized {vectorized_time:.3f} s")
+
+
+@pytest.mark.parametrize("structure", sorted(glob.glob(os.path.join(DEMO_DIRECTORY, "*.pdb"))), ids=os.path.basename)
+def test_extract_binding_sites_matches_reference(structure):
+    compare_with_reference(structure)
+
+
+if __name__ == "__main__":
+    for structure in sys.argv[1:] or [os.path.join(DEMO_DIRECTORY, "2src.pdb")]:
+        compare_with_reference(structure)
@@ -25,6 +25,11 @@ volumes=(
     conservation
     grafana
     tmp
+    plank-cache
+    foldseek-cache
+    foldseek-index
+    remote-cache
+    conservation-cache
 )
 
 for volume in "${volumes[@]}";
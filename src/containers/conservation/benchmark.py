@@ -0,0 +1,214 @@
+"""
+Compares the conservation engines (`CONSERVATION_ENGINE`) on the same sampled alignments:
+the time of computing the weights and information content and the difference of the scores.
+
+With `--max-hits` it also compares the bounded search (`CONSERVATION_MAX_HITS`) with the full search.
+The bounded search changes only which homologs are sampled. The current output already depends on the sample
+(`MAX_SEQS` random hits, `SAMPLING_SEED`), so the tolerance of each input is measured, not fixed: the full search
+is repeated with `--seeds` other sampling seeds and the worst deviation from the output of `SAMPLING_SEED` is
+the tolerance. The bounded search is accepted when its
+    - mean absolute difference of the information content is not higher,
+    - Pearson correlation of the information content is not lower,
+    - maximum absolute difference of the gap frequency is not higher
+than that of the resampled full search (up to `ROUNDING_TOLERANCE`, the scores are stored with 8 decimals).
+The script exits with status 1 if any of the inputs is out of the tolerance. The worst deviations over all
+inputs are printed at the end.
+
+Measured deviations: none recorded yet, the benchmark has not been run against Swiss-Prot.
+Before CONSERVATION_MAX_HITS is enabled in production, run it on a representative set of chains
+(short and long, single domain and multi-domain, with few and with thousands of hits) and record
+the worst deviations and tolerances here.
+
+The bounded search does not make the search itself cheaper: its first stage (phmmer --noali) still
+scans the whole Swiss-Prot. Only the alignment of the hits, the MSA output and its reading are bounded
+by the number of the sampled hits, so the `bounded [s]` time is lower mainly for queries with many hits.
+
+Run it in the conservation container, e.g.:
+    docker compose exec conservation python benchmark.py --max-hits 500 /app/benchmark/*.fasta
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import conservation
+from conservation import DATABASE, MAX_SEQS
+
+ROUNDING_TOLERANCE = 1e-6
+
+
+def _scores(values) -> np.ndarray:
+    return np.array([float(value) for value in values])
+
+
+def _correlation(expected: np.ndarray, actual: np.ndarray) -> float:
+    # constant scores (e.g. of very short or fully conserved sequences) have no correlation coefficient
+    if expected.std() == 0 or actual.std() == 0:
+        return 1.0 if np.allclose(expected, actual) else 0.0
+    return np.corrcoef(expected, actual)[0, 1]
+
+
+def _differences(expected: tuple, actual: tuple) -> dict:
+    expected_ic, expected_freqgap = (_scores(values) for values in expected)
+    actual_ic, actual_freqgap = (_scores(values) for values in actual)
+    ic_difference = np.abs(expected_ic - actual_ic)
+    return {
+        "ic_max": ic_difference.max(),
+        "ic_mean": ic_difference.mean(),
+        "ic_correlation": _correlation(expected_ic, actual_ic),
+        "freqgap_max": np.abs(expected_freqgap - actual_freqgap).max(),
+    }
+
+
+def _search(fasta_file: str, database_file: str, working_directory: str, max_hits: int):
+    conservation.MAX_HITS = max_hits
+    start = time.perf_counter()
+    alignment = conservation._generate_msa_sample(fasta_file, database_file, working_directory, MAX_SEQS)
+    return alignment, time.perf_counter() - start
+
+
+def _score(alignment, fasta_file: str, working_directory: str):
+    if conservation.ENGINE == "numpy":
+        return conservation._score_msa(alignment)
+    return conservation._score_msa_esl(alignment, fasta_file, working_directory)
+
+
+def benchmark_engines(fasta_file: str, database_file: str, repeats: int) -> dict | None:
+    working_directory = tempfile.mkdtemp()
+    try:
+        alignment, search_seconds = _search(fasta_file, database_file, working_directory, 0)
+        if alignment is None:
+            return None
+        esl_seconds, numpy_seconds = [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            esl_scores = conservation._score_msa_esl(alignment, fasta_file, working_directory)
+            esl_seconds.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            numpy_scores = conservation._score_msa(alignment)
+            numpy_seconds.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(working_directory)
+
+    return {
+        "sequences": len(alignment.sequences),
+        "columns": len(esl_scores[0]),
+        "search": search_seconds,
+        "esl": statistics.median(esl_seconds),
+        "numpy": statistics.median(numpy_seconds),
+        **_differences(esl_scores, numpy_scores),
+    }
+
+
+def _worst(deviations: list[dict]) -> dict:
+    return {
+        "ic_mean": max(deviation["ic_mean"] for deviation in deviations),
+        "ic_correlation": min(deviation["ic_correlation"] for deviation in deviations),
+        "freqgap_max": max(deviation["freqgap_max"] for deviation in deviations),
+    }
+
+
+def _sampling_tolerance(fasta_file: str, database_file: str, working_directory: str, full_scores: tuple, seeds: int) -> dict:
+    """Worst deviation of the full search sampled with other seeds from the full search sampled with `SAMPLING_SEED`."""
+    seed = conservation.SAMPLING_SEED
+    deviations = []
+    try:
+        for other_seed in range(seed + 1, seed + 1 + seeds):
+            conservation.SAMPLING_SEED = other_seed
+            alignment, _ = _search(fasta_file, database_file, working_directory, 0)
+            deviations.append(_differences(full_scores, _score(alignment, fasta_file, working_directory)))
+    finally:
+        conservation.SAMPLING_SEED = seed
+    return _worst(deviations)
+
+
+def benchmark_bounded_search(fasta_file: str, database_file: str, max_hits: int, seeds: int) -> dict | None:
+    working_directory = tempfile.mkdtemp()
+    try:
+        full_alignment, full_seconds = _search(fasta_file, database_file, working_directory, 0)
+        bounded_alignment, bounded_seconds = _search(fasta_file, database_file, working_directory, max_hits)
+        if full_alignment is None or bounded_alignment is None:
+            return None
+        full_scores = _score(full_alignment, fasta_file, working_directory)
+        bounded_scores = _score(bounded_alignment, fasta_file, working_directory)
+        tolerance = _sampling_tolerance(fasta_file, database_file, working_directory, full_scores, seeds)
+    finally:
+        shutil.rmtree(working_directory)
+
+    result = {
+        "hits": full_alignment.total,
+        "full": full_seconds,
+        "bounded": bounded_seconds,
+        **_differences(full_scores, bounded_scores),
+        "tolerance": tolerance,
+    }
+    result["accepted"] = bool(
+        result["ic_mean"] <= tolerance["ic_mean"] + ROUNDING_TOLERANCE
+        and result["ic_correlation"] >= tolerance["ic_correlation"] - ROUNDING_TOLERANCE
+        and result["freqgap_max"] <= tolerance["freqgap_max"] + ROUNDING_TOLERANCE
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the conservation engines and of the bounded search.")
+    parser.add_argument("fasta", nargs="+", help="FASTA files with a single sequence each")
+    parser.add_argument("--database", default=DATABASE, help=f"Sequence database (default {DATABASE})")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each engine, the median time is reported")
+    parser.add_argument("--max-hits", type=int, default=0, help="Compare the bounded search with this many hits to the full search")
+    parser.add_argument("--seeds", type=int, default=3, help="Other sampling seeds of the full search, which measure the tolerance")
+    args = parser.parse_args()
+    if args.max_hits > 0 and args.seeds < 1:
+        parser.error("--seeds must be at least 1, the tolerance is measured with other seeds")
+
+    print(f"{'file':<24} {'seqs':>5} {'cols':>6} {'phmmer [s]':>10} {'esl [s]':>8} {'numpy [s]':>9} "
+          f"{'IC max':>7} {'IC mean':>7} {'IC r':>6} {'gap max':>7}")
+    for fasta_file in args.fasta:
+        name = os.path.basename(fasta_file)
+        r = benchmark_engines(fasta_file, args.database, args.repeats)
+        if r is None:
+            print(f"{name:<24} no alignment")
+            continue
+        print(f"{name:<24} {r['sequences']:>5} {r['columns']:>6} {r['search']:>10.2f} {r['esl']:>8.3f} "
+              f"{r['numpy']:>9.4f} {r['ic_max']:>7.3f} {r['ic_mean']:>7.3f} {r['ic_correlation']:>6.3f} "
+              f"{r['freqgap_max']:>7.3f}")
+
+    if args.max_hits <= 0:
+        return
+
+    print(f"\nBounded search, {args.max_hits} hits, {conservation.ENGINE} engine")
+    print(f"{'file':<24} {'hits':>6} {'full [s]':>9} {'bounded [s]':>11} "
+          f"{'IC max':>7} {'IC mean':>7} {'IC r':>6} {'gap max':>7} "
+          f"{'tol mean':>8} {'tol r':>6} {'tol gap':>7} {'accepted':>8}")
+    all_accepted = True
+    results = []
+    for fasta_file in args.fasta:
+        name = os.path.basename(fasta_file)
+        r = benchmark_bounded_search(fasta_file, args.database, args.max_hits, args.seeds)
+        if r is None:
+            print(f"{name:<24} no alignment")
+            continue
+        all_accepted &= r["accepted"]
+        results.append(r)
+        t = r["tolerance"]
+        print(f"{name:<24} {r['hits']:>6} {r['full']:>9.2f} {r['bounded']:>11.2f} "
+              f"{r['ic_max']:>7.3f} {r['ic_mean']:>7.3f} {r['ic_correlation']:>6.3f} {r['freqgap_max']:>7.3f} "
+              f"{t['ic_mean']:>8.3f} {t['ic_correlation']:>6.3f} {t['freqgap_max']:>7.3f} "
+              f"{'yes' if r['accepted'] else 'no':>8}")
+    if results:
+        worst, tolerance = _worst(results), _worst([r["tolerance"] for r in results])
+        print(f"\nWorst deviations: IC mean {worst['ic_mean']:.3f} (resampling {tolerance['ic_mean']:.3f}), "
+              f"IC r {worst['ic_correlation']:.3f} (resampling {tolerance['ic_correlation']:.3f}), "
+              f"gap max {worst['freqgap_max']:.3f} (resampling {tolerance['freqgap_max']:.3f})")
+    if not all_accepted:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
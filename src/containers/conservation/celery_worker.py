@@ -2,13 +2,19 @@
 
 import os
 from celery import Celery
-from conservation import compute_conservation
+from conservation import compute_conservation, WORKER_CONCURRENCY
 
 celery = Celery(
     os.getenv('CELERY_NAME'),
     broker=os.getenv('CELERY_BROKER_URL'),
     backend=os.getenv('CELERY_BACKEND_URL')
 )
+# Same queue declaration as the other services, callbacks keep the priority of the finished task
+celery.conf.update({
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True,
+    'worker_concurrency': WORKER_CONCURRENCY
+})
 
 @celery.task(name='conservation')
 def conservation(id):
@@ -1,35 +1,73 @@
 import os
 import subprocess
-import random
 import typing
-import requests
 import shutil
-from requests.exceptions import HTTPError
 import json
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
+from functools import lru_cache
 
 from tasks_logger import create_logger
 from status_manager import update_status, StatusType
+from storage import fetch_inputs, publish_result, StorageError
+from disk_cache import DiskCache
+from stockholm import Alignment, read_stockholm, write_stockholm
+from scoring import score_alignment
 
 PHMMER_DIR = "./hmmer-3.4/src/"
 ESL_DIR = "./hmmer-3.4/easel/miniapps/"
+# Flat FASTA, every phmmer run reads and parses it again (there is no persistent, in-memory search database)
 DATABASE = "./uniprot_sprot.fasta"
 TEMP = "./tmp_conservation_{id}"
 RESULT_FOLDER = "./results/{id}/"
 MAX_SEQS = 100
-INPUTS_URL = os.getenv('INPUTS_URL')
+SAMPLING_SEED = 420
+RESULT_EXTENSIONS = [".hom", ".json", ".freqgap"]
+# How weights and information content of the sampled alignment are computed:
+#   esl   - esl-weight (Gerstein/Sonnhammer/Chothia weights) and esl-alistat, the scores P2Rank models were trained with
+#   numpy - in-process, Henikoff position-based weights (see scoring.py), no tool runs and temporary files
+ENGINE = os.getenv('CONSERVATION_ENGINE', 'esl')
+# Bounded search (enabled when CONSERVATION_MAX_HITS is set): phmmer first only lists the hits (no alignment),
+# a random sample of at most MAX_HITS of the included ones is fetched from the database and only these are aligned.
+# Scores differ from the full search by the sample of homologs only. Experimental: the deviation has not been
+# measured against Swiss-Prot yet, run benchmark.py and record its results before enabling it in production.
+# The first phmmer run still scans the whole database, only the cost of the alignment of the hits is bounded.
+MAX_HITS = int(os.getenv('CONSERVATION_MAX_HITS', 0))
+# E-value threshold of reported and included hits (phmmer -E and --incE), phmmer defaults when not set
+MAX_EVALUE = os.getenv('CONSERVATION_MAX_EVALUE')
+WORKER_CONCURRENCY = int(os.getenv('CONSERVATION_WORKER_CONCURRENCY', 4))
+# Worker threads of each phmmer run (phmmer --cpu), the search of a chain takes about one CPU.
+# Set it to an empty value to use the phmmer default.
+PHMMER_CPU = os.getenv('CONSERVATION_PHMMER_CPU', '1')
+# Unique sequences of a job processed in parallel, the HMMER tools run as separate processes.
+# Every worker process may run a job at the same time, together they should not run more searches than there are CPUs.
+CHAIN_WORKERS = int(os.getenv('CONSERVATION_CHAIN_WORKERS', max(1, (os.cpu_count() or 1) // WORKER_CONCURRENCY)))
+
+# Content-addressed store of computed results, shared by all jobs (disabled when not set)
+CACHE_DIR = os.getenv('CONSERVATION_CACHE_DIR')
+CACHE_MAX_MB = int(os.getenv('CONSERVATION_CACHE_MAX_MB', 4096))
+# Identifies the search database in cache keys, derived from the database file when not set
+DATABASE_VERSION = os.getenv('CONSERVATION_DB_VERSION')
 
 
 logger = create_logger('conservation')
 
+# hits and misses (per worker process) are counted and logged by the cache
+cache = DiskCache('conservation', CACHE_DIR, CACHE_MAX_MB * 1024 * 1024) if CACHE_DIR else None
+
 
 def compute_conservation(id):
     """
     Computes conservation scores for each residue in the input protein.  
-    The `chains.json` file is downloaded from the shared volume, which contains the mapping of chains to sequences.  
+    The `chains.json` file, which contains the mapping of chains to sequences, and all FASTA files are fetched from the shared storage at once.  
     The conservation scores are computed using HMMER tools and saved in the result folder.
 
-    Conservation is computed for each chain separately.
+    Conservation is computed for each unique sequence separately, the sequences are processed in parallel
+    (at most `CHAIN_WORKERS` at once). Progress is reported in `status.json` as number of finished chains,
+    a failure of one sequence does not stop the others and is reported with its chains.
 
     Args:
         id (str): Generated ID for the input protein.
@@ -42,12 +80,10 @@ def compute_conservation(id):
     update_status(status_file_path, id, StatusType.STARTED, infoMessage="Conservation computation started")
 
     try:
-        json_url = os.path.join(INPUTS_URL, f"{id}/chains.json")
-        logger.info(f'{id} Downloading chains file from: {json_url}')
-        response = requests.get(json_url, timeout=(10,20))
-        response.raise_for_status()
-        logger.info(f'{id} Chains file downloaded successfully')
-        files_metadata = response.json()
+        logger.info(f'{id} Fetching input files')
+        input_files = fetch_inputs(id)
+        logger.info(f'{id} Input files fetched successfully')
+        files_metadata = json.loads(input_files["chains.json"])
 
         os.makedirs(id, exist_ok=True)
         logger.info(f'{id} Input folder prepared: {id}')
@@ -56,45 +92,44 @@ def compute_conservation(id):
         os.makedirs(temp_folder, exist_ok=True)
         logger.info(f'{id} Temporary folder prepared: {temp_folder}')
 
-        for file, chains in files_metadata["fasta"].items():
-            file_url = os.path.join(INPUTS_URL, f"{id}/{file}")
-            logger.info(f'{id} Downloading FASTA file from: {file_url}')
-            response = requests.get(file_url, stream=True, timeout=(10,20))
-            response.raise_for_status()
-            logger.info(f'{id} FASTA file downloaded successfully')
-
-            hom_file_name = file.split('.')[0]
-            result_file = os.path.join(result_folder, hom_file_name)
-            input_file_path = f"./{id}/{file}"
-
-            with open(input_file_path, "wb") as seq_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    seq_file.write(chunk)
-            logger.info(f'{id} Downloaded file saved to: {input_file_path}')
-
-            logger.info(f'{id} Computing conservation...')
-            compute_conservation_for_chain(input_file_path, result_file, temp_folder)
-            logger.info(f'{id} Conservation computed')
-
-            for chain in chains:
-                result_file_name = os.path.join(result_folder, f'input{chain}')
-                os.symlink(hom_file_name + ".hom", result_file_name + ".hom")
-                logger.info(f'{id} Symlink created: {hom_file_name + ".hom"} -> {result_file_name + ".hom"}')
-                os.symlink(hom_file_name + ".json", result_file_name + ".json")
-                logger.info(f'{id} Symlink created: {hom_file_name + ".json"} -> {result_file_name + ".json"}')
-
-            # cleanup
-            os.remove(input_file_path)
-            logger.info(f'{id} Input file {input_file_path} removed (it was no longer needed)')
+        fasta_files = files_metadata["fasta"]
+        total_chains = sum(len(chains) for chains in fasta_files.values())
+        done_chains = 0
+        errors = []
+        status_lock = threading.Lock()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(CHAIN_WORKERS, len(fasta_files)))) as executor:
+            futures = {
+                executor.submit(_compute_conservation_for_file, id, file, chains, input_files[file], result_folder, temp_folder): (file, chains)
+                for file, chains in fasta_files.items()
+            }
+            for future in as_completed(futures):
+                file, chains = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'{id} Error computing conservation of chains {", ".join(chains)} ({file}): {str(e)}')
+                    errors.append(f'Chains {", ".join(chains)}: {str(e)}')
+                    continue
+                with status_lock:
+                    done_chains += len(chains)
+                    update_status(status_file_path, id, StatusType.STARTED, infoMessage=f"Conservation computed for {done_chains} of {total_chains} chains")
 
         shutil.rmtree(temp_folder)
         logger.info(f'{id} Temporary folder removed: {temp_folder}')
 
-        update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Conservation computation completed successfully")
+        if errors:
+            update_status(
+                status_file_path, id, StatusType.FAILED,
+                infoMessage=f"Conservation computed for {done_chains} of {total_chains} chains",
+                errorMessage="; ".join(errors)
+            )
+        else:
+            update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Conservation computation completed successfully")
 
-    except HTTPError as e:
+    except StorageError as e:
         update_status(status_file_path, id, StatusType.FAILED, errorMessage=str(e))
-        logger.error(f'{id} HTTP error occurred: {str(e)}')
+        logger.error(f'{id} Input files could not be fetched: {str(e)}')
     except Exception as e:
         update_status(status_file_path, id, StatusType.FAILED, errorMessage=str(e))
         logger.error(f'{id} Error computing conservation: {str(e)}')
@@ -102,6 +137,77 @@ def compute_conservation(id):
     logger.info(f'{id} conservation finished')
 
 
+def _compute_conservation_for_file(id: str, file: str, chains: list, fasta: bytes, result_folder: str, temp_folder: str):
+    """Computes (or takes from the cache) conservation of one unique sequence and links it to all its chains."""
+    hom_file_name = file.split('.')[0]
+    result_file = os.path.join(result_folder, hom_file_name)
+    input_file_path = f"./{id}/{file}"
+    # each sequence has its own working directory, the tools run concurrently
+    working_directory = os.path.join(temp_folder, hom_file_name)
+    os.makedirs(working_directory, exist_ok=True)
+
+    with open(input_file_path, "wb") as seq_file:
+        seq_file.write(fasta)
+    logger.info(f'{id} Input file saved to: {input_file_path}')
+
+    cache_key = _cache_key(_read_fasta_file(input_file_path))
+    if _load_cached_result(cache_key, result_file):
+        logger.info(f'{id} Conservation of {file} taken from the cache')
+    else:
+        logger.info(f'{id} Computing conservation of {file}...')
+        msa_generated = compute_conservation_for_chain(input_file_path, result_file, working_directory)
+        logger.info(f'{id} Conservation of {file} computed')
+        # results without any MSA (filler values) are not cached, they may be caused by a failed tool run
+        if msa_generated:
+            _store_cached_result(id, cache_key, result_file)
+
+    for chain in chains:
+        result_file_name = os.path.join(result_folder, f'input{chain}')
+        for extension in (".hom", ".json"):
+            _symlink_atomic(hom_file_name + extension, result_file_name + extension)
+            logger.info(f'{id} Symlink created: {hom_file_name + extension} -> {result_file_name + extension}')
+            publish_result(result_file_name + extension)
+
+    # cleanup
+    os.remove(input_file_path)
+    logger.info(f'{id} Input file {input_file_path} removed (it was no longer needed)')
+
+
+def _symlink_atomic(target: str, link_name: str) -> None:
+    # readers (P2Rank) see either no link or a complete one, an existing link of a previous run is replaced
+    tmp_link = f"{link_name}.{uuid.uuid4().hex}.tmp"
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link_name)
+
+
+@lru_cache(maxsize=1)
+def _database_version() -> str:
+    if DATABASE_VERSION:
+        return DATABASE_VERSION
+    stat = os.stat(DATABASE)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def _cache_key(sequence: str) -> str:
+    """Results depend only on the sequence, the database, the search bounds, the sampling of the MSA and the scoring engine."""
+    return DiskCache.make_key(sequence, _database_version(), MAX_HITS, MAX_EVALUE, MAX_SEQS, SAMPLING_SEED, ENGINE)
+
+
+def _load_cached_result(cache_key: str, result_file: str) -> bool:
+    if not cache:
+        return False
+    return all(
+        cache.get_file(cache_key, result_file + extension, suffix=extension)
+        for extension in RESULT_EXTENSIONS
+    )
+
+
+def _store_cached_result(id: str, cache_key: str, result_file: str) -> None:
+    for extension in RESULT_EXTENSIONS:
+        cache.put_file(cache_key, result_file + extension, suffix=extension)
+    logger.info(f'{id} Conservation stored in the cache: {cache_key}')
+
+
 def _default_execute_command(command: str):
     # We do not check return code here.
     subprocess.run(command, shell=True, env=os.environ.copy())
@@ -111,29 +217,17 @@ def compute_conservation_for_chain(
         fasta_file: str,
         result_file: str,
         temp_folder: str,
-):
-    
-    execute_command = _default_execute_command
-
-    unweighted_msa_file = _generate_msa(
-        fasta_file, DATABASE, temp_folder, execute_command)
+) -> bool:
+    """Returns False if no MSA was generated and the results contain filler values."""
+    # Only the sampled sequences are kept, the full alignment of all hits is never written.
+    alignment = _generate_msa_sample(fasta_file, DATABASE, temp_folder, MAX_SEQS)
 
-    sample_file = _select_sequences(unweighted_msa_file, MAX_SEQS)
-    if sample_file:
-        # We have more sequences than we need, so we got file with selected
-        # ones, but only names, so we need to prepare the file.
-        unweighted_msa_file = _generate_msa_sample(
-            unweighted_msa_file, sample_file, execute_command)
-
-    # No matter what we calculate the weights.
-    weighted_msa_file = _calculate_sequence_weights(
-        unweighted_msa_file, execute_command)
+    if ENGINE == "numpy":
+        information_content, freqgap = _score_msa(alignment)
+    else:
+        information_content, freqgap = _score_msa_esl(alignment, fasta_file, temp_folder)
 
-    ic_file, r_file = _calculate_information_content(
-        weighted_msa_file, execute_command)
     fasta_file_sequence = _read_fasta_file(fasta_file)
-    information_content, freqgap = _read_information_content(ic_file, r_file)
-
     if information_content:
         assert len(fasta_file_sequence) == \
                len(information_content) == \
@@ -141,54 +235,144 @@ def compute_conservation_for_chain(
         _write_tsv(result_file + ".hom", fasta_file_sequence, information_content)
         _write_json(result_file + ".json", fasta_file_sequence, information_content)
         _write_tsv(result_file + ".freqgap", fasta_file_sequence, freqgap)
+        return True
     else:  # `information_content` is `None` if no MSA was generated
         filler_values = ["-1000.0" for _ in fasta_file_sequence]
         _write_tsv(result_file+ ".hom", fasta_file_sequence, filler_values)
         _write_json(result_file + ".json", fasta_file_sequence, filler_values)
         _write_tsv(result_file + ".freqgap", fasta_file_sequence, filler_values)
-
-    return weighted_msa_file
+        return False
 
 
-def _generate_msa(
+def _generate_msa_sample(
         fasta_file: str, database_file: str, working_directory: str,
-        execute_command: typing.Callable[[str], None]
-):
-    unweighted_msa_file = os.path.join(
-        working_directory, os.path.basename(fasta_file)) + ".sto"
-    cmd = "{}phmmer -o /dev/null -A {} {} {}".format(
-        PHMMER_DIR, unweighted_msa_file, fasta_file, database_file)
-    execute_command(cmd)
-    return unweighted_msa_file
+        max_seqs: int
+) -> Alignment | None:
+    """
+    Runs phmmer and samples at most `max_seqs` sequences from the alignment of its hits while it is
+    being produced (the alignment is read from a pipe). Returns None if phmmer produced no alignment.
+    """
+    options = _search_options()
+    if MAX_HITS > 0:
+        hits_file = _select_hits(fasta_file, database_file, working_directory)
+        if hits_file is None:
+            logger.info(f'No hits found for {fasta_file}')
+            return None
+        # E-values as if the whole database was searched, the inclusion of the hits does not change
+        options += ["-Z", str(_database_size(database_file))]
+        database_file = hits_file
+
+    cmd = [f"{PHMMER_DIR}phmmer", "-o", "/dev/null", "-A", "/dev/stdout",
+           *_phmmer_options(), *options, fasta_file, database_file]
+    # We do not check return code here.
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, env=os.environ.copy()) as process:
+        alignment = read_stockholm(process.stdout, max_seqs, SAMPLING_SEED)
+        process.stdout.read()
+    if alignment is None or not alignment.sequences:
+        logger.info(f'No alignment generated for {fasta_file}')
+        return None
+    logger.info(f'Alignment of {fasta_file}: {len(alignment.sequences)} of {alignment.total} sequences sampled')
+    return alignment
 
 
-def _select_sequences(unweighted_msa_file: str, max_seqs: int):
-    """Return path to file with sequences, may select only some sequences."""
-    sequence_names = []
-    with open(unweighted_msa_file) as stream:
-        for line in stream:
-            if line.startswith("#=GS"):
-                sequence_names.append(line.split()[1])
-    if len(sequence_names) <= max_seqs:
+def _phmmer_options() -> list[str]:
+    # the target database is always FASTA, phmmer does not have to guess the format
+    options = ["--tformat", "fasta"]
+    if PHMMER_CPU:
+        options += ["--cpu", PHMMER_CPU]
+    return options
+
+
+def _search_options() -> list[str]:
+    if not MAX_EVALUE:
+        return []
+    return ["-E", MAX_EVALUE, "--incE", MAX_EVALUE]
+
+
+def _select_hits(fasta_file: str, database_file: str, working_directory: str) -> str | None:
+    """
+    Searches the database without aligning the hits and fetches at most `MAX_HITS` of the included ones
+    (a random sample) from the database. Returns path to a FASTA file with the selected sequences,
+    or None if there is no included hit.
+    """
+    search_file = os.path.join(working_directory, os.path.basename(fasta_file))
+    hits_table_file = search_file + ".tbl"
+    cmd = [f"{PHMMER_DIR}phmmer", "-o", "/dev/null", "--noali", "--tblout", hits_table_file,
+           *_phmmer_options(), *_search_options(), fasta_file, database_file]
+    subprocess.run(cmd, env=os.environ.copy())
+
+    hits = _read_included_hits(hits_table_file)
+    if not hits:
         return None
-    selected_sequences_file = unweighted_msa_file + ".ss"
-    with open(selected_sequences_file, mode="w") as stream:
-        random.seed(420)
-        for index in random.sample(sequence_names, k=max_seqs):
-            stream.write(index + "\n")
-    return selected_sequences_file
+    if len(hits) > MAX_HITS:
+        hits = random.Random(SAMPLING_SEED).sample(hits, k=MAX_HITS)
+    logger.info(f'Search of {fasta_file}: {len(hits)} hits selected')
+
+    names_file = search_file + ".hits"
+    with open(names_file, mode="w") as stream:
+        stream.writelines(name + "\n" for name in hits)
+    hits_file = search_file + ".hits.fasta"
+    # the database is indexed by `esl-sfetch --index` when the image is built
+    with open(hits_file, mode="w") as stream:
+        subprocess.run([f"{ESL_DIR}esl-sfetch", "-f", database_file, names_file],
+                       stdout=stream, env=os.environ.copy())
+    return hits_file
+
+
+def _read_included_hits(hits_table_file: str) -> list[str]:
+    """Names of the targets with at least one included domain (the `inc` column) in a phmmer `--tblout` table."""
+    try:
+        with open(hits_table_file) as stream:
+            return [
+                fields[0]
+                for fields in (line.split() for line in stream if not line.startswith("#"))
+                if len(fields) > 17 and int(fields[17]) > 0
+            ]
+    except FileNotFoundError:
+        return []
 
 
-def _generate_msa_sample(
-        unweighted_msa_file: str, ss_file: str,
-        execute_command: typing.Callable[[str], None]
-):
-    unweighted_msa_sample_file = unweighted_msa_file + ".sample"
-    cmd = "{}esl-alimanip -o {} --seq-k {} {}".format(
-        ESL_DIR, unweighted_msa_sample_file, ss_file,
-        unweighted_msa_file)
-    execute_command(cmd)
-    return unweighted_msa_sample_file
+@lru_cache(maxsize=None)
+def _database_size(database_file: str) -> int:
+    # the number of sequences is stored next to the database when the image is built
+    try:
+        with open(database_file + ".size") as stream:
+            return int(stream.read())
+    except (FileNotFoundError, ValueError):
+        pass
+    count = 0
+    with open(database_file, "rb") as stream:
+        for line in stream:
+            count += line.startswith(b">")
+    return count
+
+
+def _score_msa(alignment: Alignment | None):
+    if alignment is None:
+        return None, None
+    information_content, freqgap = score_alignment(alignment)
+    return _format_values(information_content), _format_values(freqgap)
+
+
+def _format_values(values) -> list[str]:
+    return [f"{value:.8f}" for value in values.tolist()]
+
+
+def _score_msa_esl(alignment: Alignment | None, fasta_file: str, working_directory: str):
+    if alignment is None:
+        return None, None
+    execute_command = _default_execute_command
+    unweighted_msa_file = os.path.join(
+        working_directory, os.path.basename(fasta_file)) + ".sto"
+    write_stockholm(alignment, unweighted_msa_file)
+
+    # No matter what we calculate the weights.
+    weighted_msa_file = _calculate_sequence_weights(
+        unweighted_msa_file, execute_command)
+
+    ic_file, r_file = _calculate_information_content(
+        weighted_msa_file, execute_command)
+    return _read_information_content(ic_file, r_file)
 
 
 def _calculate_sequence_weights(
@@ -258,8 +442,10 @@ def _write_tsv(target_file: str, fasta_file_sequence: str, feature):
     ```
     """
     with open(target_file, mode="w", newline="") as stream:
-        for (i, j), value in zip(enumerate(fasta_file_sequence), feature):
-            stream.write("\t".join((str(i), value, j)) + "\n")
+        stream.writelines(
+            f"{i}\t{value}\t{j}\n"
+            for (i, j), value in zip(enumerate(fasta_file_sequence), feature)
+        )
 
 
 def _write_json(target_file: str, fasta_file_sequence: str, feature):
@@ -275,12 +461,11 @@ def _write_json(target_file: str, fasta_file_sequence: str, feature):
         ...
     ```
     """
+    # Written directly, the output is the same as of `json.dump(..., indent=4)` of a list of dicts.
+    items = [
+        f'    {{\n        "index": {i},\n        "value": {json.dumps(float(value))}\n    }}'
+        for i, (_, value) in enumerate(zip(fasta_file_sequence, feature))
+    ]
     with open(target_file, mode="w", newline="") as stream:
-        result = []
-        for (i, j), value in zip(enumerate(fasta_file_sequence), feature):
-            result.append({
-                "index": i,
-                "value": float(value)
-            })
-        json.dump(result, stream, indent=4)
+        stream.write("[\n" + ",\n".join(items) + "\n]" if items else "[]")
 
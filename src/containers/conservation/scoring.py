@@ -0,0 +1,102 @@
+import numpy as np
+
+from stockholm import Alignment
+
+# Canonical residues in the order of the Easel amino acid alphabet, codes 0-19 of the alignment matrix
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+GAP = len(AMINO_ACIDS)
+# Degenerate residues split their weight among the residues they stand for (as Easel counts them),
+# everything else not listed here (e.g. `X`, `*`) is any residue
+DEGENERATE = {"B": "DN", "J": "IL", "Z": "QE", "O": "K", "U": "C"}
+GAP_CHARACTERS = "-._~"
+
+_CODES = np.full(256, GAP + 1, dtype=np.uint8)
+_DISTRIBUTIONS = [np.eye(GAP + 1)[i, :GAP] for i in range(GAP)] + [np.zeros(GAP), np.full(GAP, 1 / GAP)]
+for _i, _residue in enumerate(AMINO_ACIDS):
+    _CODES[ord(_residue)] = _CODES[ord(_residue.lower())] = _i
+for _character in GAP_CHARACTERS:
+    _CODES[ord(_character)] = GAP
+for _residue, _meaning in DEGENERATE.items():
+    _CODES[ord(_residue)] = _CODES[ord(_residue.lower())] = len(_DISTRIBUTIONS)
+    _DISTRIBUTIONS.append(np.array([_meaning.count(r) / len(_meaning) for r in AMINO_ACIDS]))
+# Fraction of each code assigned to each residue, the `GAP` row is zero
+_DISTRIBUTIONS = np.array(_DISTRIBUTIONS)
+
+
+def alignment_matrix(alignment: Alignment) -> np.ndarray:
+    """
+    Encodes the aligned sequences as a uint8 matrix (sequence x column) of residue codes:
+    0-19 are `AMINO_ACIDS`, `GAP` is a gap and higher codes are degenerate residues.
+    """
+    sequences = list(alignment.sequences.values())
+    if not sequences:
+        return np.zeros((0, 0), dtype=np.uint8)
+    raw = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8)
+    return _CODES[raw].reshape(len(sequences), -1)
+
+
+def consensus_columns(alignment: Alignment, length: int) -> np.ndarray:
+    """Indices of the columns of the query residues (marked in `#=GC RF`), all columns without the annotation."""
+    reference = alignment.gc.get("RF")
+    if reference is None:
+        return np.arange(length)
+    raw = np.frombuffer(reference.encode("ascii"), dtype=np.uint8)
+    return np.flatnonzero(_CODES[raw] != GAP)
+
+
+def _residue_counts(matrix: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted counts of `AMINO_ACIDS` in each column, shape (20, columns)."""
+    counts = np.zeros((GAP, matrix.shape[1]))
+    for code in np.unique(matrix):
+        if code == GAP:
+            continue
+        counts += np.outer(_DISTRIBUTIONS[code], weights @ (matrix == code))
+    return counts
+
+
+def henikoff_weights(matrix: np.ndarray) -> np.ndarray:
+    """
+    Position-based sequence weights (Henikoff & Henikoff, 1994) as computed by Easel:
+    each residue adds 1 / (r * n) to the weight of its sequence, where r is the number of distinct residues
+    in the column and n the number of their occurrences. Gaps and degenerate residues are not counted.
+    Weights are divided by the number of the counted residues of the sequence and normalized to sum
+    to the number of sequences.
+    """
+    nseq, length = matrix.shape
+    canonical = matrix < GAP
+    counts = np.zeros((GAP + 1, length))
+    for code in range(GAP):
+        counts[code] = (matrix == code).sum(axis=0)
+    distinct = (counts[:GAP] > 0).sum(axis=0)
+    with np.errstate(divide="ignore"):
+        contributions = np.where(counts > 0, 1 / (counts * distinct), 0.0)
+    contributions[GAP] = 0.0
+    weights = np.take_along_axis(contributions, np.where(canonical, matrix, GAP), axis=0).sum(axis=1)
+    residues = canonical.sum(axis=1)
+    weights = np.divide(weights, residues, out=np.zeros(nseq), where=residues > 0)
+    total = weights.sum()
+    return weights * nseq / total if total > 0 else np.ones(nseq)
+
+
+def information_content(matrix: np.ndarray, weights: np.ndarray, columns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Information content (bits, log2(20) minus the entropy of the weighted residue frequencies)
+    and weighted gap frequency of the selected columns. Columns without any residue have zero information.
+    """
+    matrix = matrix[:, columns]
+    counts = _residue_counts(matrix, weights)
+    residues = counts.sum(axis=0)
+    frequencies = np.divide(counts, residues, out=np.full_like(counts, 1 / GAP), where=residues > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(frequencies > 0, frequencies * np.log2(frequencies), 0.0).sum(axis=0)
+    total = weights.sum()
+    freqgap = (weights @ (matrix == GAP)) / total if total > 0 else np.zeros(matrix.shape[1])
+    # rounding errors of fully variable columns would make tiny negative values
+    return np.maximum(np.log2(GAP) - entropy, 0.0), freqgap
+
+
+def score_alignment(alignment: Alignment) -> tuple[np.ndarray, np.ndarray]:
+    """Information content and gap frequency of the query residues, Henikoff weighted."""
+    matrix = alignment_matrix(alignment)
+    columns = consensus_columns(alignment, matrix.shape[1])
+    return information_content(matrix, henikoff_weights(matrix), columns)
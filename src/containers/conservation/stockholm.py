@@ -0,0 +1,120 @@
+import random
+from dataclasses import dataclass, field
+from typing import Iterable
+
+
+@dataclass
+class Alignment:
+    """Multiple sequence alignment in Stockholm format, sequences and annotations spread over blocks are joined."""
+    header: list[str] = field(default_factory=list)         # `#=GF` and other file annotation lines
+    gs: list[str] = field(default_factory=list)             # `#=GS` lines of the kept sequences
+    sequences: dict[str, str] = field(default_factory=dict)  # aligned sequences by name, in the original order
+    gr: dict[tuple[str, str], str] = field(default_factory=dict)  # residue annotations by (name, feature)
+    gc: dict[str, str] = field(default_factory=dict)        # column annotations (e.g. `RF`) by feature
+    total: int = 0                                          # sequences named in the `#=GS` lines of the input
+
+
+def _sample(names: list[str], max_seqs: int, seed: int) -> set[str] | None:
+    """Names of the sampled sequences, or None when all of them are kept."""
+    if len(names) <= max_seqs:
+        return None
+    # own generator, the module one is shared by all threads of the worker
+    return set(random.Random(seed).sample(names, k=max_seqs))
+
+
+def _join(fragments: dict) -> dict:
+    return {key: "".join(values) for key, values in fragments.items()}
+
+
+def read_stockholm(lines: Iterable[str], max_seqs: int, seed: int) -> Alignment | None:
+    """
+    Reads a Stockholm alignment in a single pass and keeps only a random sample of `max_seqs` sequences.
+    The `#=GS` lines precede the alignment blocks, so the sample is drawn before the first block is read,
+    only the sampled sequences are held in memory. The sample is the same as `random.sample` of the `#=GS`
+    names seeded with `seed`.
+
+    Args:
+        lines (Iterable[str]): Lines of the alignment, e.g. the output of a running phmmer.
+        max_seqs (int): Maximum number of kept sequences.
+        seed (int): Seed of the sampling.
+
+    Returns:
+        Alignment | None: The sampled alignment, or None if there is no alignment in `lines`.
+    """
+    started = False
+    alignment = Alignment()
+    gs_lines, names = [], []
+    selected = None
+    sampled = False
+    sequences, gr, gc = {}, {}, {}
+
+    def keep(name: str) -> bool:
+        return selected is None or name in selected
+
+    for line in lines:
+        if not started:
+            started = line.startswith("# STOCKHOLM")
+            continue
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        if line.startswith("//"):
+            break
+        if line.startswith("#=GS"):
+            gs_lines.append(line)
+            names.append(line.split()[1])
+            continue
+        if line.startswith("#") and not line.startswith(("#=GR", "#=GC")):
+            alignment.header.append(line)
+            continue
+
+        if not sampled:
+            selected = _sample(names, max_seqs, seed)
+            sampled = True
+
+        if line.startswith("#=GC"):
+            _, feature, value = line.split()
+            gc.setdefault(feature, []).append(value)
+        elif line.startswith("#=GR"):
+            _, name, feature, value = line.split()
+            if keep(name):
+                gr.setdefault((name, feature), []).append(value)
+        else:
+            name, value = line.split()
+            if keep(name):
+                sequences.setdefault(name, []).append(value)
+
+    if not started:
+        return None
+
+    alignment.gs = [line for line in gs_lines if keep(line.split()[1])]
+    alignment.sequences = _join(sequences)
+    alignment.gr = _join(gr)
+    alignment.gc = _join(gc)
+    alignment.total = len(names)
+    return alignment
+
+
+def write_stockholm(alignment: Alignment, target_file: str) -> None:
+    """Writes the alignment in the single block (Pfam) variant of Stockholm format."""
+    width = max(
+        [len(name) for name in alignment.sequences] +
+        [len(f"#=GR {name} {feature}") for name, feature in alignment.gr] +
+        [len(f"#=GC {feature}") for feature in alignment.gc] +
+        [0]
+    )
+    with open(target_file, mode="w") as stream:
+        stream.write("# STOCKHOLM 1.0\n\n")
+        for line in alignment.header:
+            stream.write(line + "\n")
+        for line in alignment.gs:
+            stream.write(line + "\n")
+        stream.write("\n")
+        for name, sequence in alignment.sequences.items():
+            stream.write(f"{name:<{width}} {sequence}\n")
+            for (gr_name, feature), value in alignment.gr.items():
+                if gr_name == name:
+                    stream.write(f"{f'#=GR {name} {feature}':<{width}} {value}\n")
+        for feature, value in alignment.gc.items():
+            stream.write(f"{f'#=GC {feature}':<{width}} {value}\n")
+        stream.write("//\n")
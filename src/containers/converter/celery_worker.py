@@ -9,6 +9,11 @@ celery = Celery(
     broker=os.getenv('CELERY_BROKER_URL'),
     backend=os.getenv('CELERY_BACKEND_URL')
 )
+# Same queue declaration as the other services, callbacks keep the priority of the finished task
+celery.conf.update({
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True
+})
 
 @celery.task(name='converter_str_to_seq')
 def structure_to_sequence(id):
@@ -1,24 +1,21 @@
-import json
 import os
-import requests
-from Bio.PDB import PDBParser, Polypeptide, is_aa
-from Bio.Data.IUPACData import protein_letters_3to1
 import tempfile
 
+import requests
+from Bio.PDB import PDBParser
+
 from tasks_logger import create_logger
+from chain_sequences import extract_chain_sequences
+from storage import get_storage, input_path, StorageError
 
 ESMFOLD_URL = 'https://api.esmatlas.com/foldSequence/v1/pdb/'
-INPUTS_URL = os.getenv('INPUTS_URL')
 MAPPING_FILE = "mapping.json"
 
-def is_standard_aa(code):
-    return code.capitalize() in protein_letters_3to1
-
 logger = create_logger('converter')
 
 def run_structure_to_sequence(id):
     """
-    Downloads a PDB file by ID from shared volume, extracts amino acid sequences for each chain
+    Reads a PDB file by ID from shared storage, extracts amino acid sequences for each chain
     and maps sequence indices to structure residue indices.
 
     Args:
@@ -32,58 +29,29 @@ def run_structure_to_sequence(id):
         }
         ```
         
-        or None if download fails or no sequences are found.
+        or None if reading fails or no sequences are found.
     """
     logger.info(f'{id} converter_str_to_seq started')
 
-    pdb_url = os.path.join(INPUTS_URL, f"{id}/structure.pdb")
+    logger.info(f'{id} Reading PDB file')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # streamed to a local file, the structure is not held in memory as a whole before parsing
+        pdb_file = os.path.join(tmp_dir, "structure.pdb")
+        try:
+            get_storage().save(input_path(id, "structure.pdb"), pdb_file)
+        except StorageError as e:
+            logger.error(f'{id} PDB file could not be read {str(e)}')
+            logger.info(f'{id} converter_str_to_seq finished, returning None')
+            return None
 
-    logger.info(f'{id} Downloading PDB file from: {pdb_url}')
-    try:
-        response = requests.get(pdb_url, stream=True, timeout=(10,20))
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logger.error(f'{id} PDB file download failed {str(e)}')
-        logger.info(f'{id} converter_str_to_seq finished, returning None')
-        return None
-
-    logger.info(f'{id} PDB file downloaded successfully')
+        logger.info(f'{id} PDB file read successfully')
 
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".pdb", delete=True) as struct_file:
-        for chunk in response.iter_content(chunk_size=8192):
-            struct_file.write(chunk.decode())
-        struct_file.seek(0)
         # should be fine, parsing structure was already tried by http-server
-        pdb = PDBParser().get_structure(id, struct_file) 
+        pdb = PDBParser().get_structure(id, pdb_file)
 
     logger.info(f'{id} Starting the extraction of chains')
-    chains = {}
-    seq_to_str_mapping = {}
-    for model in pdb:
-        for chain in model:
-            seq = ""
-            seq_index = 0
-            for residue in chain:
-                if is_aa(residue, standard=False): 
-                    structure_index = residue.id[1]
-                    residue = residue.resname
-                    if not is_standard_aa(residue):
-                        with open(MAPPING_FILE, "r") as infile:
-                            mapping_dict = json.load(infile)
-                        if residue in mapping_dict:
-                            logger.info(f'{id} Residue {residue} found in mapping file, converting to standard residue')
-                            residue = mapping_dict[residue]
-                        else:
-                            raise ValueError(f"Residue {residue} not found in {MAPPING_FILE}")                        
-                    chain_code = chain.id
-                    if chain_code not in seq_to_str_mapping:
-                        seq_to_str_mapping[chain_code] = {}
-                    seq_to_str_mapping[chain_code][seq_index] = structure_index
-                    seq += Polypeptide.index_to_one(Polypeptide.three_to_index(residue))
-                    seq_index += 1
-            
-            if seq != "":
-                chains.setdefault(seq, []).append(chain.id)
+    result = extract_chain_sequences(pdb, MAPPING_FILE, logger)
+    chains = result["chains"]
 
     if len(chains) == 0:
         logger.warning(f'{id} converter_str_to_seq did not find any sequence')
@@ -91,14 +59,11 @@ def run_structure_to_sequence(id):
         return None
     
     logger.info(f'{id} converter_str_to_seq finished, returning {len(chains)} unique sequences')
-    return {
-        "chains": chains,
-        "seqToStrMapping": seq_to_str_mapping
-    }
+    return result
 
 def run_sequence_to_structure(id):
     """
-    Downloads a FASTA sequence by ID from shared volume, sends it to ESMAtlas service for structure prediction
+    Reads a FASTA sequence by ID from shared storage, sends it to ESMAtlas service for structure prediction
     and returns the predicted structure as string.
 
     Args:
@@ -106,26 +71,23 @@ def run_sequence_to_structure(id):
 
     Returns:
         str: Predicted structure as string
-        or None if download or prediction fails.
+        or None if reading or prediction fails.
     """
     logger.info(f'{id} converter_seq_to_str started')
 
     # get input
-    fasta_url = os.path.join(INPUTS_URL, f"{id}/sequence_1.fasta")
-
-    logger.info(f'{id} Downloading FASTA file from: {fasta_url}')
+    logger.info(f'{id} Reading FASTA file')
     try:
-        response = requests.get(fasta_url, timeout=(10,20))
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logger.error(f'{id} FASTA file download failed {str(e)}')
+        fasta_text = get_storage().read_text(input_path(id, "sequence_1.fasta"))
+    except StorageError as e:
+        logger.error(f'{id} FASTA file could not be read {str(e)}')
         logger.info(f'{id} converter_seq_to_str finished, returning None')
         return None
 
-    logger.info(f'{id} FASTA file downloaded successfully')
+    logger.info(f'{id} FASTA file read successfully')
     
     # should be fine, http-server prepared sequence properly
-    sequence = response.text.split('\n')[1]
+    sequence = fasta_text.split('\n')[1]
 
     logger.info(f'{id} Sending POST request to {ESMFOLD_URL} for structure prediction')
     try:
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Builds the binding site index used by `ds_foldseek` (`FOLDSEEK_SITE_INDEX`, the `foldseek-index` volume).
+
+Run it after the Foldseek database of the image is updated, the workers use the index as soon as it exists:
+
+    docker compose --profile tools run --rm foldseek-index-builder                  # new entries and retries
+    docker compose --profile tools run --rm foldseek-index-builder --refresh modified.txt
+    docker compose --profile tools run --rm foldseek-index-builder --rebuild
+
+Entries which could not be indexed (e.g. RCSB was not available) are retried by the next run.
+`--mirror` with a local PDB mirror avoids downloading the structures from RCSB.
+"""
+
+import argparse
+import gzip
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from datetime import datetime
+
+import requests
+
+from post_processor import (
+    PDB_FILE_URL, SITE_INDEX, EXTRACTION_VERSION,
+    extract_binding_sites, serialize_extraction
+)
+from tasks_logger import create_logger
+
+FOLDSEEK_DB_LOOKUP = "foldseek_db/pdb.lookup"
+COMMIT_EVERY = 500
+# Structures submitted to the process pool at once (per worker), the results are written before the next chunk
+CHUNK_PER_WORKER = 16
+
+logger = create_logger('ds-foldseek-index')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (pdb_id TEXT PRIMARY KEY, indexed_at TEXT NOT NULL, error TEXT);
+CREATE TABLE IF NOT EXISTS sites (
+    target TEXT PRIMARY KEY,
+    pdb_id TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sites_pdb_id ON sites (pdb_id);
+"""
+
+
+def read_targets(lookup_file: str) -> dict:
+    """
+    Reads Foldseek target names (e.g. `5d52-assembly1.cif.gz_A`) from the database lookup file
+    and groups them by PDB ID and chain the same way the post-processor interprets them.
+
+    Returns:
+        dict: {pdb_id: {chain: [target, ...]}}
+    """
+    targets = {}
+    with open(lookup_file, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2 or "_" not in fields[1]:
+                continue
+            target = fields[1]
+            pdb_id, chain = target[:4].lower(), target.split("_")[1][0]
+            targets.setdefault(pdb_id, {}).setdefault(chain, []).append(target)
+    return targets
+
+
+def _read_structure(pdb_id: str, mirror: str | None) -> str:
+    if mirror:
+        # flat ({id}.pdb[.gz]) and divided (xy/pdb{id}.ent.gz) mirror layouts
+        candidates = [
+            os.path.join(mirror, f"{pdb_id}.pdb"),
+            os.path.join(mirror, f"{pdb_id}.pdb.gz"),
+            os.path.join(mirror, pdb_id[1:3], f"pdb{pdb_id}.ent.gz"),
+        ]
+        for path in candidates:
+            if os.path.exists(path):
+                opener = gzip.open if path.endswith(".gz") else open
+                with opener(path, "rt") as f:
+                    return f.read()
+
+    response = requests.get(PDB_FILE_URL.format(pdb_id), timeout=(15,30))
+    response.raise_for_status()
+    return response.text
+
+
+def index_structure(pdb_id: str, chain_targets: dict, mirror: str | None):
+    """Computes index rows `(target, pdb_id, chain, payload)` for all requested chains of a structure."""
+    pdb_file_text = _read_structure(pdb_id, mirror)
+    extractions = extract_binding_sites(pdb_id, pdb_file_text, chain_targets.keys())
+    rows = []
+    for chain, targets in chain_targets.items():
+        extraction = extractions.get(chain)
+        if extraction is None or not extraction[2]:
+            continue  # chain without standard amino acids in the .pdb file
+        payload = serialize_extraction(extraction)
+        rows.extend((target, pdb_id, chain, payload) for target in targets)
+    return rows
+
+
+def open_index(index_file: str, rebuild: bool) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+    connection = sqlite3.connect(index_file, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    if rebuild:
+        connection.executescript("DROP TABLE IF EXISTS sites; DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS meta;")
+    connection.executescript(SCHEMA)
+
+    version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if version is not None and int(version[0]) != EXTRACTION_VERSION:
+        logger.info(f'Index was built by extractor version {version[0]}, rebuilding it')
+        connection.executescript("DELETE FROM sites; DELETE FROM entries;")
+    connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(EXTRACTION_VERSION),))
+    connection.commit()
+    return connection
+
+
+def build_index(index_file: str, lookup_file: str, mirror: str | None, refresh: set, rebuild: bool, workers: int):
+    """
+    Builds or incrementally updates the binding site index.
+
+    In the incremental mode only PDB entries which are not indexed yet (new in the Foldseek database
+    or failed in a previous run) or listed in `refresh` (modified in the PDB release) are processed,
+    entries no longer present in the Foldseek database are removed.
+    """
+    connection = open_index(index_file, rebuild)
+    targets = read_targets(lookup_file)
+    known = {row[0] for row in connection.execute("SELECT pdb_id FROM entries")}
+    indexed = {row[0] for row in connection.execute("SELECT pdb_id FROM entries WHERE error IS NULL")}
+
+    obsolete = known - targets.keys()
+    for pdb_id in obsolete:
+        connection.execute("DELETE FROM sites WHERE pdb_id = ?", (pdb_id,))
+        connection.execute("DELETE FROM entries WHERE pdb_id = ?", (pdb_id,))
+    connection.commit()
+
+    pending = sorted((targets.keys() - indexed) | (refresh & targets.keys()))
+    logger.info(f'{len(targets)} PDB entries in Foldseek database, {len(obsolete)} removed, {len(pending)} to index')
+
+    processed = 0
+    remaining = iter(pending)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while chunk := list(islice(remaining, workers * CHUNK_PER_WORKER)):
+            futures = {executor.submit(index_structure, pdb_id, targets[pdb_id], mirror): pdb_id for pdb_id in chunk}
+            for future in as_completed(futures):
+                pdb_id = futures[future]
+                error = None
+                connection.execute("DELETE FROM sites WHERE pdb_id = ?", (pdb_id,))
+                try:
+                    connection.executemany("INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?)", future.result())
+                except Exception as e:
+                    error = str(e)
+                    logger.warning(f'{pdb_id} could not be indexed: {error}')
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                    (pdb_id, datetime.now().isoformat(), error)
+                )
+
+                processed += 1
+                if processed % COMMIT_EVERY == 0:
+                    connection.commit()
+                    logger.info(f'{processed}/{len(pending)} PDB entries indexed')
+
+    connection.commit()
+    connection.close()
+    logger.info(f'Binding site index {index_file} updated, {processed} PDB entries indexed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Precomputes ligand binding sites of all structures in the Foldseek PDB database."
+    )
+    parser.add_argument("--index", default=SITE_INDEX, help="Path to the SQLite index file.")
+    parser.add_argument("--lookup", default=FOLDSEEK_DB_LOOKUP, help="Foldseek database lookup file.")
+    parser.add_argument("--mirror", default=None, help="Local PDB mirror directory, RCSB is used for missing files.")
+    parser.add_argument("--refresh", default=None, help="File with PDB IDs modified in the release (one per line).")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the index and build it from scratch.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parsing processes.")
+    args = parser.parse_args()
+
+    refresh = set()
+    if args.refresh:
+        with open(args.refresh) as f:
+            refresh = {line.strip().lower() for line in f if line.strip()}
+
+    build_index(args.index, args.lookup, args.mirror, refresh, args.rebuild, args.workers)
@@ -8,6 +8,11 @@ celery = Celery(
     os.getenv('CELERY_NAME'),
     broker=os.getenv('CELERY_BROKER_URL')
 )
+# Same queue declaration as the other services, callbacks keep the priority of the finished task
+celery.conf.update({
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True
+})
 
 @celery.task(name='ds_foldseek')
 def ds_foldseek(id):
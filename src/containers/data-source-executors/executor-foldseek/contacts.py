@@ -0,0 +1,73 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Dict, List
+
+
+class ContactIndex:
+    """
+    Coordinate-array view of a parsed structure for ligand contact detection.
+
+    All atoms of the structure are stored in one array together with the index of the residue
+    they belong to, water molecules are left out. Contacts of all ligands are computed at once
+    with a single k-d tree query instead of one `NeighborSearch.search` call per ligand atom.
+    """
+
+    def __init__(self, structure):
+        self.residues = []
+        self._residue_index = {}
+        self._atom_slices = {}
+        coords = []
+        atom_residues = []
+
+        for residue in structure.get_residues():
+            atoms = [atom.coord for atom in residue]
+            index = len(self.residues)
+            self.residues.append(residue)
+            self._residue_index[id(residue)] = index
+            self._atom_slices[index] = (len(coords), len(coords) + len(atoms))
+            coords.extend(atoms)
+            atom_residues.extend([index] * len(atoms))
+
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.atom_residues = np.asarray(atom_residues, dtype=np.int64)
+
+        is_water = np.array([residue.id[0] == "W" for residue in self.residues], dtype=bool)
+        self._searchable = np.flatnonzero(~is_water[self.atom_residues]) if len(self.residues) else np.empty(0, dtype=np.int64)
+        self._tree = cKDTree(self.coords[self._searchable])
+
+    def ligand_contacts(self, ligands: list, dist_thresh: float) -> Dict[int, List]:
+        """
+        Finds residues (excluding water) with at least one atom within `dist_thresh` Angstroms
+        of any atom of each ligand. The ligand itself is included, same as with `NeighborSearch`.
+
+        Args:
+            ligands (list): Ligand residues of the structure.
+            dist_thresh (float): Distance threshold in Angstroms.
+
+        Returns:
+            Dict[int, List]: Contacting residues (in structure order) for `id()` of each ligand residue.
+        """
+        if not ligands or len(self._searchable) == 0:
+            return {id(ligand): [] for ligand in ligands}
+
+        ligand_indices = [self._residue_index[id(ligand)] for ligand in ligands]
+        atom_ranges = [np.arange(*self._atom_slices[index]) for index in ligand_indices]
+        ligand_atoms = np.concatenate(atom_ranges)
+        ligand_of_atom = np.repeat(np.arange(len(ligands)), [len(atoms) for atoms in atom_ranges])
+
+        ligand_tree = cKDTree(self.coords[ligand_atoms])
+        hits = ligand_tree.query_ball_tree(self._tree, dist_thresh)
+
+        hit_counts = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+        hit_atoms = np.fromiter((a for h in hits for a in h), dtype=np.int64, count=int(hit_counts.sum()))
+        hit_ligands = np.repeat(ligand_of_atom, hit_counts)
+        hit_residues = self.atom_residues[self._searchable[hit_atoms]]
+
+        # Unique (ligand, residue) pairs, sorted by ligand and then by residue order in the structure
+        pairs = np.unique(hit_ligands * len(self.residues) + hit_residues)
+        pair_ligands, pair_residues = np.divmod(pairs, len(self.residues))
+
+        contacts = {id(ligand): [] for ligand in ligands}
+        for ligand_index, residue_index in zip(pair_ligands.tolist(), pair_residues.tolist()):
+            contacts[id(ligands[ligand_index])].append(self.residues[residue_index])
+        return contacts
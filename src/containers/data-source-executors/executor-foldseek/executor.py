@@ -1,16 +1,15 @@
 import os
 import subprocess
 import json
-import requests
 from enum import Enum
 import post_processor
 
 from tasks_logger import create_logger
 from status_manager import update_status, StatusType
+from storage import get_storage, input_path, StorageError
 
 RESULTS_FOLDER = "results"
 FOLDSEEK_DB = "foldseek_db/pdb"
-INPUTS_URL = os.getenv('INPUTS_URL')
 PLANKWEB_BASE_URL = os.getenv('PLANKWEB_BASE_URL')
 FOLDSEEK_SIM_PROTS = os.getenv('FOLDSEEK_SIM_PROTS')
 
@@ -24,7 +23,7 @@ def run_foldseek(id):
     """
     Runs Foldseek to find up to 1000 structurally similar proteins for a given protein structure.
 
-    The function downloads the input PDB file based on the provided ID from shared volume, then runs Foldseek against
+    The function fetches the input PDB file and chains file based on the provided ID from shared storage, then runs Foldseek against
     a local database. It tracks progress using a status file and stores the results in a shared format
     for each chain.
 
@@ -40,18 +39,16 @@ def run_foldseek(id):
     update_status(status_file_path, id, StatusType.STARTED, infoMessage="Execution started")
 
     try:
-        pdb_url = os.path.join(INPUTS_URL, id, "structure.pdb")
         query_structure_file = os.path.join(eval_folder, "input.pdb")
 
-        logger.info(f'{id} Downloading PDB file from: {pdb_url}')
-        response = requests.get(pdb_url, stream=True, timeout=(10,20))
-        response.raise_for_status()
-        logger.info(f'{id} PDB file downloaded successfully')
+        logger.info(f'{id} Fetching PDB file and chains file')
+        input_files = get_storage().fetch_all([input_path(id, "structure.pdb"), input_path(id, "chains.json")])
+        logger.info(f'{id} Input files fetched successfully')
+        chains = json.loads(input_files[input_path(id, "chains.json")])["chains"]
 
         with open(query_structure_file, "wb") as struct_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                struct_file.write(chunk)
-        logger.info(f'{id} Downloaded file saved to: {query_structure_file}')
+            struct_file.write(input_files[input_path(id, "structure.pdb")])
+        logger.info(f'{id} PDB file saved to: {query_structure_file}')
 
         foldseek_result_file = os.path.join(eval_folder, f"aln_res_{id}")
 
@@ -81,14 +78,15 @@ def run_foldseek(id):
             id,
             query_structure_file,
             query_structure_url,
+            chains,
             status_file_path
         )
 
         update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Execution completed successfully")
 
-    except requests.RequestException as e:
-        logger.error(f'{id} PDB file download failed: {str(e)}')
-        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to download PDB file: {str(e)}")
+    except StorageError as e:
+        logger.error(f'{id} Input files could not be fetched: {str(e)}')
+        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to fetch input files: {str(e)}")
     except subprocess.CalledProcessError as e:
         err_msg = e.stderr.decode() # error message is from subprocess, needs different treatment
         logger.error(f'{id} Foldseek subprocess crashed: {err_msg}')
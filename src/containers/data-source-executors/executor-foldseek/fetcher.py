@@ -0,0 +1,117 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable
+
+import httpx
+
+from tasks_logger import create_logger
+
+PDB_FILE_URL = "https://files.rcsb.org/download/{}.pdb"
+PDB_GZ_FILE_URL = "https://files.rcsb.org/download/{}.pdb.gz"
+DOWNLOAD_CONCURRENCY = int(os.getenv('FOLDSEEK_DOWNLOAD_CONCURRENCY', 16))
+DOWNLOAD_GZIP = os.getenv('FOLDSEEK_DOWNLOAD_GZIP', 'true').lower() == 'true'
+PARSE_WORKERS = int(os.getenv('FOLDSEEK_PARSE_WORKERS', os.cpu_count() or 1))
+
+logger = create_logger('ds-foldseek')
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class StageStats:
+    """Throughput counters of a single post-processing stage (download or parse)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, failures: int, size: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.failures += failures
+            self.bytes += size
+            self.seconds += seconds
+
+    def log(self, id: str, items: int, size: int, seconds: float):
+        rate = items / seconds if seconds else 0.0
+        logger.info(
+            f'{id} {self.name} stage: {items} structures, {size} bytes in {seconds:.2f} s ({rate:.1f} structures/s); '
+            f'total: {self.items} structures, {self.failures} failures, {self.bytes} bytes in {self.seconds:.2f} s'
+        )
+
+
+download_stats = StageStats("download")
+parse_stats = StageStats("parse")
+
+
+async def _fetch(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, pdb_id: str):
+    url = (PDB_GZ_FILE_URL if DOWNLOAD_GZIP else PDB_FILE_URL).format(pdb_id)
+    async with semaphore:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            chunks = [chunk async for chunk in response.aiter_bytes()]
+    return b"".join(chunks)
+
+
+async def _fetch_all(pdb_ids: list) -> Dict[str, bytes | Exception]:
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    limits = httpx.Limits(max_connections=DOWNLOAD_CONCURRENCY, max_keepalive_connections=DOWNLOAD_CONCURRENCY)
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=httpx.Timeout(30, connect=15)) as client:
+        results = await asyncio.gather(
+            *(_fetch(client, semaphore, pdb_id) for pdb_id in pdb_ids),
+            return_exceptions=True
+        )
+    return dict(zip(pdb_ids, results))
+
+
+def download_structures(id: str, pdb_ids: Iterable[str]) -> Dict[str, bytes | Exception]:
+    """
+    Downloads PDB files over a shared keep-alive (HTTP/2) connection pool with bounded concurrency.
+    Payloads are gzip-compressed unless `FOLDSEEK_DOWNLOAD_GZIP` is disabled.
+
+    Args:
+        id (str): Generated ID for the input protein (for logging).
+        pdb_ids (Iterable[str]): PDB IDs to download.
+
+    Returns:
+        Dict[str, bytes | Exception]: Payload or the download error for each PDB ID.
+    """
+    pdb_ids = list(pdb_ids)
+    if not pdb_ids:
+        return {}
+
+    start = time.perf_counter()
+    results = asyncio.run(_fetch_all(pdb_ids))
+    seconds = time.perf_counter() - start
+
+    size = sum(len(payload) for payload in results.values() if isinstance(payload, bytes))
+    failures = sum(isinstance(payload, Exception) for payload in results.values())
+    download_stats.add(len(pdb_ids), failures, size, seconds)
+    download_stats.log(id, len(pdb_ids), size, seconds)
+    return results
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Returns the process pool used for parsing structures, shared by all chains and tasks of the worker."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _parse_pool
+
+
+def reset_parse_pool(broken_pool: ProcessPoolExecutor):
+    """Replaces the shared pool after one of its processes died (`BrokenProcessPool`)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is broken_pool:
+            broken_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
@@ -1,17 +1,22 @@
+import gzip
 import json
 import os
-import requests
+import sqlite3
+import time
 from typing import List, Tuple, Dict
-from Bio.PDB import PDBParser, NeighborSearch
+from Bio.PDB import PDBParser
 from Bio.PDB.Polypeptide import three_to_index, index_to_one, is_aa
 from data_format.builder import ProteinDataBuilder, SimilarProteinBuilder, BindingSite, Residue
 from dataclasses import asdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from functools import partial
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
 from io import StringIO
 
 from tasks_logger import create_logger
 from status_manager import update_status, StatusType
+from disk_cache import DiskCache
+from contacts import ContactIndex
+import fetcher
 
 
 #   - OUTPUT FORMAT - columns in result file [MORE](https://github.com/soedinglab/MMseqs2/wiki#custom-alignment-format-with-convertalis)
@@ -28,91 +33,188 @@ from status_manager import update_status, StatusType
 #   - `tend` - 1-indexed alignment end position in target sequence
 #   - `taln` - Aligned target sequence with gaps - Only aligned part
 
-PDB_FILE_URL = "https://files.rcsb.org/download/{}.pdb"
-INPUTS_URL = os.getenv('INPUTS_URL')
+PDB_FILE_URL = fetcher.PDB_FILE_URL
 PLANKWEB_BASE_URL = os.getenv('PLANKWEB_BASE_URL')
 RESULT_FILE = "{}_chain_result.json"
+STRUCTURE_CACHE_DIR = os.getenv('FOLDSEEK_STRUCTURE_CACHE_DIR', 'cache/structures')
+STRUCTURE_CACHE_MAX_MB = int(os.getenv('FOLDSEEK_STRUCTURE_CACHE_MAX_MB', 2048))
+EXTRACTION_VERSION = 1  # bump when the output of `extract_binding_sites` changes, invalidates cache and index
+SITE_INDEX = os.getenv('FOLDSEEK_SITE_INDEX', 'index/binding_sites.sqlite')
 
 logger = create_logger('ds-foldseek')
 
+_structure_cache = None
+_site_index = None
 
-def extract_binding_sites_for_chain(pdb_id, pdb_file_text, input_chain) -> Tuple[List[BindingSite], str, Dict[str, int]]:
+
+def extract_binding_sites(pdb_id, pdb_file_text, input_chains=None) -> Dict[str, Tuple[List[BindingSite], str, Dict[int, int]]]:
     """
-    Extracts experimentally determined binding sites from a PDB file for a specific chain.
+    Extracts experimentally determined binding sites from a PDB file for multiple chains at once.
     Binding sites are defined as residues within 5 Angstroms of any ligand atom.
 
-    Apart from binding sites, the amino acid sequence of the chain is also extracted as well as a mapping from sequence index to residue structure index.
+    The structure is parsed and the contacts of all ligands are computed only once, regardless of the number of chains.
+    Apart from binding sites, the amino acid sequence of each chain is also extracted as well as a mapping from sequence index to residue structure index.
 
     Args:
         pdb_id (str): ID of the protein.
         pdb_file_text (str): Text content of the PDB file.
-        input_chain (str): Chain ID for which to extract binding sites.
-    """ 
+        input_chains (Iterable[str] | None): Chain IDs for which to extract binding sites, all chains if None.
+
+    Returns:
+        Dict[str, Tuple[List[BindingSite], str, Dict[int, int]]]: Binding sites, sequence and sequence to structure mapping for each chain.
+    """
     
     file = StringIO(pdb_file_text)
     pdb = PDBParser().get_structure(pdb_id, file)
     file.close()
 
-    binding_sites = []
     dist_thresh = 5  # Distance threshold for neighbor search
-    atoms = list(pdb.get_atoms())
-    ns = NeighborSearch(atom_list=atoms)
-    chain_seq = ""
-    seq_to_str_mapping = {}
-
-    for model in pdb:
-        for chain in model:
-            chain_id = chain.id
-            if chain_id != input_chain:
-                continue
-            residue_dict = {}
-            sequence_index = 0
-            ligand_binding_sites = {}
-
-            for residue in chain:
-                if residue.id[0] == " " and is_aa(residue, standard=True):  # Exclude heteroatoms and non-amino acids
-                    residue_index = residue.id[1]  # Get residue structure index
-                    residue_dict[residue_index] = sequence_index
-                    seq_to_str_mapping[sequence_index] = residue_index
-                    chain_seq += index_to_one(three_to_index(residue.get_resname()))
-                    sequence_index += 1
-            
-            for residue in chain:
-                if residue.id[0].startswith("H_"):  # Identify ligand residues
-                    ligand_id = residue.id  
-                                        
-                    binding_residues = set()
-                    ligand_atoms = residue.get_atoms()
-                    
-                    for atom in ligand_atoms:
-                        nearby_atoms = ns.search(atom.coord, dist_thresh)
-                        
-                        for nearby_atom in nearby_atoms:
-                            nearby_residue = nearby_atom.get_parent()
-                            if nearby_residue not in binding_residues and nearby_residue.id[0] != "W":  # Exclude water and non-amino acids
-                                binding_residues.add(nearby_residue)
-                                nearby_residue_index = nearby_residue.id[1]
-                                
-                                if ligand_id not in ligand_binding_sites:
-                                    ligand_binding_sites[ligand_id] = []
-                                if residue_dict.get(nearby_residue_index, None) != None:
-                                    ligand_binding_sites[ligand_id].append(
-                                        Residue(
-                                            sequenceIndex=residue_dict[nearby_residue_index],
-                                            structureIndex=nearby_residue_index
-                                            )
-                                        )
-            
-            for ligand_id, residues in ligand_binding_sites.items():
-                binding_sites.append(
-                    BindingSite(
-                        id=ligand_id[0], # Get ligand name from tuple e.g. ('H_ADP', 704, ' ')
-                        confidence=1,
-                        residues=sorted(residues, key=lambda r: r.sequenceIndex)
-                    )
+    wanted_chains = set(input_chains) if input_chains is not None else None
+    chains = [chain for model in pdb for chain in model if wanted_chains is None or chain.id in wanted_chains]
+
+    # Contacts of all ligands in the requested chains are computed at once
+    ligands = [residue for chain in chains for residue in chain if residue.id[0].startswith("H_")]
+    contacts = ContactIndex(pdb).ligand_contacts(ligands, dist_thresh)
+    extractions = {}
+
+    for chain in chains:
+        chain_id = chain.id
+        if chain_id not in extractions:
+            extractions[chain_id] = ([], "", {})
+        binding_sites, chain_seq, seq_to_str_mapping = extractions[chain_id]
+        residue_dict = {}
+        sequence_index = 0
+        ligand_binding_sites = {}
+
+        for residue in chain:
+            if residue.id[0] == " " and is_aa(residue, standard=True):  # Exclude heteroatoms and non-amino acids
+                residue_index = residue.id[1]  # Get residue structure index
+                residue_dict[residue_index] = sequence_index
+                seq_to_str_mapping[sequence_index] = residue_index
+                chain_seq += index_to_one(three_to_index(residue.get_resname()))
+                sequence_index += 1
+        
+        for residue in chain:
+            if residue.id[0].startswith("H_"):  # Identify ligand residues
+                ligand_id = residue.id  
+                ligand_binding_sites[ligand_id] = []
+
+                for nearby_residue in contacts[id(residue)]:  # Water is already excluded
+                    nearby_residue_index = nearby_residue.id[1]
+                    if residue_dict.get(nearby_residue_index, None) != None:
+                        ligand_binding_sites[ligand_id].append(
+                            Residue(
+                                sequenceIndex=residue_dict[nearby_residue_index],
+                                structureIndex=nearby_residue_index
+                                )
+                            )
+        
+        for ligand_id, residues in ligand_binding_sites.items():
+            binding_sites.append(
+                BindingSite(
+                    id=ligand_id[0], # Get ligand name from tuple e.g. ('H_ADP', 704, ' ')
+                    confidence=1,
+                    residues=sorted(residues, key=lambda r: r.sequenceIndex)
                 )
+            )
+        extractions[chain_id] = (binding_sites, chain_seq, seq_to_str_mapping)
+
+    return extractions
+
+def extract_binding_sites_for_chain(pdb_id, pdb_file_text, input_chain) -> Tuple[List[BindingSite], str, Dict[int, int]]:
+    """
+    Extracts experimentally determined binding sites, the sequence and the sequence to structure mapping
+    from a PDB file for a specific chain. See `extract_binding_sites`.
+
+    Args:
+        pdb_id (str): ID of the protein.
+        pdb_file_text (str): Text content of the PDB file.
+        input_chain (str): Chain ID for which to extract binding sites.
+    """
+    return extract_binding_sites(pdb_id, pdb_file_text, [input_chain]).get(input_chain, ([], "", {}))
+
+def _get_structure_cache() -> DiskCache:
+    global _structure_cache
+    if _structure_cache is None:
+        _structure_cache = DiskCache("structures", STRUCTURE_CACHE_DIR, STRUCTURE_CACHE_MAX_MB * 1024 * 1024)
+    return _structure_cache
+
+def serialize_extraction(extraction: Tuple[List[BindingSite], str, Dict[int, int]]) -> str:
+    """Serializes the result of `extract_binding_sites_for_chain` to JSON (used by the cache and the binding site index)."""
+    binding_sites, chain_seq, mapping = extraction
+    return json.dumps({
+        "bindingSites": [asdict(binding_site) for binding_site in binding_sites],
+        "sequence": chain_seq,
+        "seqToStrMapping": mapping
+    })
+
+def deserialize_extraction(payload: str) -> Tuple[List[BindingSite], str, Dict[int, int]]:
+    """Inverse of `serialize_extraction`."""
+    data = json.loads(payload)
+    binding_sites = [
+        BindingSite(
+            id=site["id"],
+            confidence=site["confidence"],
+            residues=[Residue(**residue) for residue in site["residues"]],
+            rank=site.get("rank"),
+            score=site.get("score")
+        )
+        for site in data["bindingSites"]
+    ]
+    mapping = {int(seq_index): str_index for seq_index, str_index in data["seqToStrMapping"].items()}
+    return binding_sites, data["sequence"], mapping
+
+def load_indexed_extraction(target: str) -> Tuple[List[BindingSite], str, Dict[int, int]] | None:
+    """
+    Returns the precomputed extraction for a Foldseek target (e.g. `5d52-assembly1.cif.gz_A`)
+    from the binding site index built by `build_binding_site_index.py`, or None if the index
+    does not exist or does not contain the target.
+    """
+    global _site_index
+    if _site_index is None:
+        if not os.path.exists(SITE_INDEX):
+            return None
+        try:
+            connection = sqlite3.connect(f"file:{SITE_INDEX}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+            version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f'Binding site index {SITE_INDEX} cannot be opened: {str(e)}')
+            return None
+        if version is None or int(version[0]) != EXTRACTION_VERSION:
+            logger.warning(f'Binding site index {SITE_INDEX} was built by a different extractor version, ignoring it')
+            connection.close()
+            return None
+        _site_index = connection
+    try:
+        row = _site_index.execute("SELECT payload FROM sites WHERE target = ?", (target,)).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f'Binding site index lookup for {target} failed: {str(e)}')
+        return None
+    return deserialize_extraction(row[0]) if row else None
+
+def load_cached_extraction(pdb_id: str, chain: str) -> Tuple[List[BindingSite], str, Dict[int, int]] | None:
+    """
+    Returns the cached result of `extract_binding_sites_for_chain` for the given PDB ID and chain,
+    or None if it has not been cached yet.
+    """
+    cache = _get_structure_cache()
+    path = cache.get(DiskCache.make_key(EXTRACTION_VERSION, pdb_id.lower(), chain), ".json")
+    if path is None:
+        return None
+    try:
+        with open(path, "r") as f:
+            return deserialize_extraction(f.read())
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f'Cached extraction {path} cannot be read, ignoring it: {str(e)}')
+        return None
 
-    return binding_sites, chain_seq, seq_to_str_mapping
+def store_cached_extraction(pdb_id: str, chain: str, extraction: Tuple[List[BindingSite], str, Dict[int, int]]):
+    """Stores the result of `extract_binding_sites_for_chain` for the given PDB ID and chain in the cache."""
+    try:
+        cache = _get_structure_cache()
+        cache.put_bytes(DiskCache.make_key(EXTRACTION_VERSION, pdb_id.lower(), chain), serialize_extraction(extraction).encode(), ".json")
+    except OSError as e:
+        logger.warning(f'Extraction for {pdb_id} chain {chain} could not be cached: {str(e)}')
 
 def save_results(result_folder: str, file_name: str, builder: ProteinDataBuilder):
 
@@ -126,7 +228,7 @@ def save_results(result_folder: str, file_name: str, builder: ProteinDataBuilder
 
     logger.info(f'{id} Results saved')
 
-def process_similar_protein(curr_chain: str, id: str, fields: List[str]) -> SimilarProteinBuilder:
+def create_similar_protein_builder(curr_chain: str, id: str, fields: List[str]) -> SimilarProteinBuilder | None:
     """
     Processes a single line from the chain result file, resulting with the `SimilarProteinBuilder` object with the following data: 
     - Similar protein PDB ID
@@ -134,7 +236,8 @@ def process_similar_protein(curr_chain: str, id: str, fields: List[str]) -> Simi
     - Similar protein URL (to RCSB DB)
     - TM-score of the similar and input protein
     - Alignment data
-    - Experimentally determined binding sites for the similar protein
+
+    Experimentally determined binding sites are added later by `add_extraction`.
 
     Args:
         curr_chain (str): Chain ID of the similar protein.
@@ -162,28 +265,83 @@ def process_similar_protein(curr_chain: str, id: str, fields: List[str]) -> Simi
         similar_part=fields[11]
     )
 
-    pdb_filename = None
+    return sim_builder
 
-    try:
-        logger.info(f'{id} Downloading similar protein: {sim_protein_pdb_id}')
-        response = requests.get(PDB_FILE_URL.format(sim_protein_pdb_id), timeout=(15,30))
-        response.raise_for_status()
-        logger.info(f'{id} Similar protein {sim_protein_pdb_id} saved to: {pdb_filename}')
-
-        binding_sites, _, mapping = extract_binding_sites_for_chain(id, response.text, sim_protein_chain)
-        sim_builder.set_seq_to_str_mapping(mapping)
-        for binding_site in binding_sites:
-            sim_builder.add_binding_site(binding_site)
-
-    except Exception as e:
-        logger.error(f"Failed to download or process PDB file for {sim_protein_pdb_id}: {e}")
-        return None
+def add_extraction(sim_builder: SimilarProteinBuilder, extraction: Tuple[List[BindingSite], str, Dict[int, int]]) -> SimilarProteinBuilder:
+    binding_sites, _, mapping = extraction
+    sim_builder.set_seq_to_str_mapping(mapping)
+    for binding_site in binding_sites:
+        sim_builder.add_binding_site(binding_site)
+    return sim_builder
 
-    finally:
-        if pdb_filename is not None and os.path.exists(pdb_filename):
-            os.remove(pdb_filename)
+def parse_similar_structure(id: str, pdb_id: str, payload: bytes, chains: List[str]) -> Dict[str, Tuple[List[BindingSite], str, Dict[int, int]]]:
+    """
+    Parses a downloaded similar protein (runs in the shared parse pool) and extracts
+    binding sites for each requested chain.
 
-    return sim_builder
+    Args:
+        id (str): Generated ID for the input protein.
+        pdb_id (str): PDB ID of the similar protein.
+        payload (bytes): Downloaded PDB file, possibly gzip-compressed.
+        chains (List[str]): Chains of the similar protein hit by Foldseek.
+    """
+    if payload[:2] == b"\x1f\x8b":
+        payload = gzip.decompress(payload)
+    extractions = extract_binding_sites(pdb_id, payload.decode(), chains)
+    return {chain: extractions.get(chain, ([], "", {})) for chain in chains}
+
+def _collect_extractions(id: str, hits: List[Tuple[List[str], SimilarProteinBuilder]]) -> Dict[Tuple[str, str], Tuple[List[BindingSite], str, Dict[int, int]]]:
+    """
+    Collects binding site extractions for all similar proteins of a chain. Extractions are looked up
+    in the binding site index and the cache first, the remaining structures are downloaded in one
+    bounded-concurrency download stage and then parsed in the shared parse pool.
+    """
+    extractions = {}
+    missing = {}
+    for fields, sim_builder in hits:
+        key = (fields[1][:4], fields[1].split("_")[1][0])
+        if key in extractions or key[1] in missing.get(key[0], set()):
+            continue
+        extraction = load_indexed_extraction(fields[1]) or load_cached_extraction(*key)
+        if extraction is not None:
+            extractions[key] = extraction
+        else:
+            missing.setdefault(key[0], set()).add(key[1])
+    logger.info(f'{id} {len(extractions)} similar proteins found in index or cache, {len(missing)} structures to download')
+
+    payloads = fetcher.download_structures(id, missing.keys())
+
+    start = time.perf_counter()
+    pool = fetcher.get_parse_pool()
+    futures = {}
+    for pdb_id, payload in payloads.items():
+        if isinstance(payload, Exception):
+            logger.error(f"Failed to download PDB file for {pdb_id}: {payload}")
+            continue
+        futures[pool.submit(parse_similar_structure, id, pdb_id, payload, sorted(missing[pdb_id]))] = pdb_id
+
+    parsed = 0
+    for future in as_completed(futures):
+        pdb_id = futures[future]
+        try:
+            chain_extractions = future.result()
+        except BrokenProcessPool as e:
+            fetcher.reset_parse_pool(pool)
+            logger.error(f"Parse pool broken while processing PDB file for {pdb_id}: {e}")
+            continue
+        except Exception as e:
+            logger.error(f"Failed to process PDB file for {pdb_id}: {e}")
+            continue
+        parsed += 1
+        for chain, extraction in chain_extractions.items():
+            extractions[(pdb_id, chain)] = extraction
+            store_cached_extraction(pdb_id, chain, extraction)
+
+    seconds = time.perf_counter() - start
+    size = sum(len(payload) for payload in payloads.values() if isinstance(payload, bytes))
+    fetcher.parse_stats.add(parsed, len(futures) - parsed, size, seconds)
+    fetcher.parse_stats.log(id, parsed, size, seconds)
+    return extractions
 
 def split_foldseek_result_file(result_folder, filepath):
     """
@@ -221,20 +379,20 @@ def split_foldseek_result_file(result_folder, filepath):
     
     return result_file_base
 
-def process_chain_result(id, chain_result_file_path, result_folder, query_structure_file, query_structure_file_url, max_workers=16):
+def process_chain_result(id, chain_result_file_path, result_folder, query_extraction, query_structure_file_url):
     """
-    Parallel processing of a single chain result file created from the Foldseek output.
+    Processing of a single chain result file created from the Foldseek output.
+    Similar proteins are downloaded concurrently and parsed in the shared parse pool.
 
     Args:
         id (str): Generated ID for the input protein.
         chain_result_file_path (str): Path to the chain result file.
         result_folder (str): Path to the folder where results will be saved.
-        query_structure_file (str): Path to the input protein PDB file.
+        query_extraction (Tuple[List[BindingSite], str, Dict[int, int]]): Binding sites extracted from the input protein chain.
         query_structure_file_url (str): URL to the input protein PDB file.
-        max_workers (int): Maximum number of worker processes to use for parallel processing.
     """
     builder = None
-    futures = []
+    hits = []
 
     with open(chain_result_file_path, 'r') as file:
         for line in file:
@@ -246,26 +404,24 @@ def process_chain_result(id, chain_result_file_path, result_folder, query_struct
                 chain = input_name.split("_")[1] if "_" in input_name else "A"
                 builder = ProteinDataBuilder(id, chain, query_seq, query_structure_file_url)
                 
-                with open(query_structure_file, "r") as q_file:
-                    binding_sites = extract_binding_sites_for_chain(id, q_file.read(), chain)[0]
-                    for binding_site in binding_sites:
-                        builder.add_binding_site(binding_site)
+                for binding_site in query_extraction[0]:
+                    builder.add_binding_site(binding_site)
 
-            futures.append(fields)
+            sim_builder = create_similar_protein_builder(chain, id, fields)
+            if sim_builder is not None:
+                hits.append((fields, sim_builder))
 
-    wrapped_fn = partial(process_similar_protein, chain, id)
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        submitted = [executor.submit(wrapped_fn, fields) for fields in futures]
+    extractions = _collect_extractions(id, hits)
 
-        for future in as_completed(submitted):
-            sim_builder = future.result()
-            if sim_builder is not None:
-                builder.add_similar_protein(sim_builder.build())
+    for fields, sim_builder in hits:
+        extraction = extractions.get((fields[1][:4], fields[1].split("_")[1][0]))
+        if extraction is not None:
+            builder.add_similar_protein(add_extraction(sim_builder, extraction).build())
 
     if builder is not None:
         save_results(result_folder, RESULT_FILE.format(chain), builder)
 
-def process_foldseek_output(result_folder, foldseek_result_file, id, query_structure_file, query_structure_file_url, status_file_path):
+def process_foldseek_output(result_folder, foldseek_result_file, id, query_structure_file, query_structure_file_url, chains, status_file_path):
     """
     Processes the Foldseek output file, for each chain in the input protein.  
     Results are stored in the shared format in the specified result folder.
@@ -276,26 +432,20 @@ def process_foldseek_output(result_folder, foldseek_result_file, id, query_struc
         id (str): Generated ID for the input protein.
         query_structure_file (str): Path to the input protein PDB file.
         query_structure_file_url (str): URL to the input protein PDB file.
+        chains (List[str]): Chains of the input protein (from `chains.json`).
         status_file_path (str): Path to the status file for tracking progress.
     """
 
     result_file_base = split_foldseek_result_file(result_folder, foldseek_result_file)
 
-    chains_json = os.path.join(INPUTS_URL, id, "chains.json")
-    logger.info(f'{id} Downloading chains file from: {chains_json}') 
-    try:
-        response = requests.get(chains_json, stream=True, timeout=(10,20))
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logger.critical(f'{id} Failed to download chains file')
-        raise RuntimeError(f'Failed to download chains file for {id}: {e}')
-    
-    logger.info(f'{id} Chains file downloaded successfully')
-    metadata = response.json()
-    remaining_chains = metadata["chains"]
+    remaining_chains = list(chains)
     total_chains_count = len(remaining_chains)
     processed_chains_count = 0
     
+    # The input protein is parsed only once for all chains
+    with open(query_structure_file, "r") as q_file:
+        query_extractions = extract_binding_sites(id, q_file.read(), remaining_chains)
+
     logger.info(f'{id} Starting processing result file: {foldseek_result_file}')
     
     for chain in remaining_chains:
@@ -306,15 +456,15 @@ def process_foldseek_output(result_folder, foldseek_result_file, id, query_struc
         if os.path.exists(result_file_path):
             # Process similar proteins
             logger.info(f'{id} Processing chain {chain} from Foldseek result file: {result_file_path}')
-            process_chain_result(id, result_file_path, result_folder, query_structure_file, query_structure_file_url)
+            query_extraction = query_extractions.get(chain, ([], "", {}))
+            process_chain_result(id, result_file_path, result_folder, query_extraction, query_structure_file_url)
         else:
             # No similar proteins found for this chain, extract binding sites only
             logger.info(f'{id} No similar proteins found for chain {chain}, extracting binding sites only')
-            with open(query_structure_file, "r") as q_file:
-                binding_sites, chain_seq, _ = extract_binding_sites_for_chain(id, q_file.read(), chain)
-                builder = ProteinDataBuilder(id, chain, chain_seq, query_structure_file_url)
-                for binding_site in binding_sites:
-                    builder.add_binding_site(binding_site)
+            binding_sites, chain_seq, _ = query_extractions.get(chain, ([], "", {}))
+            builder = ProteinDataBuilder(id, chain, chain_seq, query_structure_file_url)
+            for binding_site in binding_sites:
+                builder.add_binding_site(binding_site)
             save_results(result_folder, RESULT_FILE.format(chain), builder)
         processed_chains_count += 1
     logger.info(f'{id} Finished processing Foldseek output')
@@ -2,13 +2,58 @@
 
 import os
 from celery import Celery
+from celery_batches import Batches
 import executor
 
+BATCH_SIZE = int(os.getenv('P2RANK_BATCH_SIZE', 1))
+BATCH_INTERVAL_MS = int(os.getenv('P2RANK_BATCH_INTERVAL_MS', 500))
+BATCH_IDLE_MS = int(os.getenv('P2RANK_BATCH_IDLE_MS', 20))
+
 celery = Celery(
     os.getenv('CELERY_NAME'),
     broker=os.getenv('CELERY_BROKER_URL')
 )
+# Same queue declaration as the other services, callbacks keep the priority of the finished task
+celery.conf.update({
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True,
+    'worker_concurrency': executor.WORKER_CONCURRENCY
+})
+
+
+class DrainingBatches(Batches):
+    """
+    Batches which are also flushed once no message arrived for `idle_interval` seconds, i.e. when the queue is drained.
+    Messages delivered together still form one batch, but a lone job does not wait the whole `flush_interval`.
+    """
+    abstract = True
+    idle_interval = 0.02
+
+    def Strategy(self, task, app, consumer):
+        handler = super().Strategy(task, app, consumer)
+        timer = consumer.timer
+        idle_flush = None
+
+        def task_message_handler(*args, **kwargs):
+            nonlocal idle_flush
+            handler(*args, **kwargs)
+            if idle_flush is not None:
+                idle_flush.cancel()
+            idle_flush = timer.call_after(self.idle_interval, self._do_flush)
+
+        return task_message_handler
+
+
+if BATCH_SIZE > 1:
+    # Batches need the worker to prefetch more tasks than it is executing, a batch per process is enough
+    # (unlimited prefetch would also take all bulk tasks out of the queue before interactive ones arrive)
+    celery.conf.worker_prefetch_multiplier = BATCH_SIZE
 
-@celery.task(name='ds_p2rank')
-def ds_p2rank(id, params):
-    executor.run_p2rank(id, params)
+    @celery.task(name='ds_p2rank', base=DrainingBatches, flush_every=BATCH_SIZE, flush_interval=BATCH_INTERVAL_MS / 1000,
+                 idle_interval=BATCH_IDLE_MS / 1000)
+    def ds_p2rank(requests):
+        executor.run_p2rank_batch([tuple(request.args) for request in requests])
+else:
+    @celery.task(name='ds_p2rank')
+    def ds_p2rank(id, params):
+        executor.run_p2rank(id, params)
@@ -0,0 +1,258 @@
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.lang.reflect.Field;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Modifier;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.security.Permission;
+import java.util.Arrays;
+import java.util.Comparator;
+import java.util.List;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.TimeoutException;
+
+/**
+ * Long-running P2Rank process serving predictions of a single model over a Unix socket.
+ *
+ * P2Rank is invoked in-process (cz.siret.prank.program.Main), so JVM startup, class loading,
+ * JIT compilation and model loading are paid once instead of once per job. P2Rank keeps its
+ * configuration in global state, which is why one daemon serves exactly one model (-c) and
+ * requests are processed one at a time (p2rank_daemon.py runs several daemons per model).
+ * The global parameters are reset to their defaults before each request, so parameters of one
+ * request (e.g. -threads) do not leak into the next one.
+ *
+ * A request running longer than P2RANK_DAEMON_REQUEST_TIMEOUT seconds halts the JVM,
+ * p2rank_daemon.py then starts a new daemon.
+ *
+ * Protocol: the client sends P2Rank arguments separated by '\0' and closes its output,
+ * the daemon replies with the exit status on the first line followed by the captured output.
+ *
+ * Usage: java P2RankDaemon SOCKET_PATH MODEL [WARMUP_STRUCTURE]
+ */
+public class P2RankDaemon {
+
+    private static final String PRANK_MAIN = "cz.siret.prank.program.Main";
+    private static final String PRANK_PARAMS = "cz.siret.prank.program.params.Params";
+    private static final long REQUEST_TIMEOUT_SECONDS = Long.parseLong(
+        System.getenv().getOrDefault("P2RANK_DAEMON_REQUEST_TIMEOUT", "1800"));
+
+    private static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    private static class Result {
+        final int status;
+        final String output;
+
+        Result(int status, String output) {
+            this.status = status;
+            this.output = output;
+        }
+    }
+
+    // Set by the watchdog, the exit trap lets only this exit through
+    private static volatile boolean halting = false;
+
+    private final Method prankMain;
+    private final String model;
+    private final ExecutorService requestExecutor = Executors.newSingleThreadExecutor();
+
+    private P2RankDaemon(String model) throws ReflectiveOperationException {
+        this.prankMain = Class.forName(PRANK_MAIN).getMethod("main", String[].class);
+        this.model = model;
+    }
+
+    /**
+     * Copies the fields of a freshly constructed Params into the global instance,
+     * which P2Rank then configures from -c and the command line as in a new process.
+     */
+    private static void resetParams() {
+        try {
+            Class<?> paramsClass = Class.forName(PRANK_PARAMS);
+            Object fresh = paramsClass.getDeclaredConstructor().newInstance();
+            for (Field holder : paramsClass.getDeclaredFields()) {
+                if (!Modifier.isStatic(holder.getModifiers()) || holder.getType() != paramsClass) {
+                    continue;
+                }
+                holder.setAccessible(true);
+                Object global = holder.get(null);
+                if (global == null) {
+                    continue;
+                }
+                for (Class<?> c = paramsClass; c != null && c != Object.class; c = c.getSuperclass()) {
+                    for (Field field : c.getDeclaredFields()) {
+                        if (Modifier.isStatic(field.getModifiers())) {
+                            continue;
+                        }
+                        field.setAccessible(true);
+                        field.set(global, field.get(fresh));
+                    }
+                }
+            }
+        } catch (ReflectiveOperationException | RuntimeException e) {
+            System.out.printf("P2Rank parameters could not be reset: %s%n", e);
+        }
+    }
+
+    @SuppressWarnings("removal")
+    private static void trapExit() {
+        // P2Rank terminates the JVM with System.exit, which must end the request, not the daemon
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkExit(int status) {
+                if (halting) {
+                    return;
+                }
+                throw new ExitTrappedException(status);
+            }
+
+            @Override
+            public void checkPermission(Permission perm) {
+            }
+
+            @Override
+            public void checkPermission(Permission perm, Object context) {
+            }
+        });
+    }
+
+    private Result run(String[] args) {
+        List<String> argList = Arrays.asList(args);
+        int modelIndex = argList.indexOf("-c");
+        if (modelIndex < 0 || modelIndex + 1 >= args.length || !args[modelIndex + 1].equals(model)) {
+            return new Result(2, "Daemon serves model '" + model + "' only, got: " + String.join(" ", args));
+        }
+
+        ByteArrayOutputStream captured = new ByteArrayOutputStream();
+        PrintStream originalOut = System.out;
+        PrintStream originalErr = System.err;
+        PrintStream capture = new PrintStream(captured, true, StandardCharsets.UTF_8);
+        System.setOut(capture);
+        System.setErr(capture);
+
+        int status = 0;
+        try {
+            resetParams();
+            prankMain.invoke(null, (Object) args);
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ExitTrappedException) {
+                status = ((ExitTrappedException) cause).status;
+            } else {
+                status = 1;
+                cause.printStackTrace(capture);
+            }
+        } catch (ExitTrappedException e) {
+            status = e.status;
+        } catch (Throwable e) {
+            status = 1;
+            e.printStackTrace(capture);
+        } finally {
+            System.setOut(originalOut);
+            System.setErr(originalErr);
+        }
+        return new Result(status, captured.toString(StandardCharsets.UTF_8));
+    }
+
+    private void warmUp(String structure) throws IOException {
+        Path outputFolder = Files.createTempDirectory("p2rank-warmup-");
+        long start = System.nanoTime();
+        Result result = run(new String[] {
+            "predict", "-f", structure, "-o", outputFolder.toString(), "-c", model, "-visualizations", "0"
+        });
+        System.out.printf("P2Rank daemon (%s) warm-up finished with status %d in %.1f s%n",
+            model, result.status, (System.nanoTime() - start) / 1e9);
+        if (result.status != 0) {
+            System.out.println(result.output);
+        }
+        try (var paths = Files.walk(outputFolder)) {
+            paths.sorted(Comparator.reverseOrder()).forEach(path -> path.toFile().delete());
+        }
+    }
+
+    private Result runWithTimeout(String[] args) {
+        Future<Result> future = requestExecutor.submit(() -> run(args));
+        try {
+            return future.get(REQUEST_TIMEOUT_SECONDS, TimeUnit.SECONDS);
+        } catch (TimeoutException e) {
+            // P2Rank cannot be interrupted and its global state is unknown, the daemon is replaced
+            System.out.printf("P2Rank daemon (%s) request exceeded %d s, halting: %s%n",
+                model, REQUEST_TIMEOUT_SECONDS, String.join(" ", args));
+            halting = true;
+            Runtime.getRuntime().halt(3);
+            return null;
+        } catch (InterruptedException | ExecutionException e) {
+            return new Result(1, e.toString());
+        }
+    }
+
+    private void handle(SocketChannel client) throws IOException {
+        InputStream in = Channels.newInputStream(client);
+        String request = new String(in.readAllBytes(), StandardCharsets.UTF_8);
+        String[] args = request.split("\0");
+
+        long start = System.nanoTime();
+        Result result = runWithTimeout(args);
+        System.out.printf("P2Rank daemon (%s) request finished with status %d in %.1f s: %s%n",
+            model, result.status, (System.nanoTime() - start) / 1e9, String.join(" ", args));
+
+        OutputStream out = Channels.newOutputStream(client);
+        out.write((result.status + "\n" + result.output).getBytes(StandardCharsets.UTF_8));
+        out.flush();
+    }
+
+    private void serve(Path socketPath) throws IOException {
+        Files.deleteIfExists(socketPath);
+        try (ServerSocketChannel server = ServerSocketChannel.open(StandardProtocolFamily.UNIX)) {
+            server.bind(UnixDomainSocketAddress.of(socketPath));
+            System.out.printf("P2Rank daemon (%s) listening on %s%n", model, socketPath);
+            while (true) {
+                try (SocketChannel client = server.accept()) {
+                    handle(client);
+                } catch (IOException e) {
+                    StringWriter trace = new StringWriter();
+                    e.printStackTrace(new PrintWriter(trace));
+                    System.out.printf("P2Rank daemon (%s) client failed: %s%n", model, trace);
+                }
+            }
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        if (args.length < 2) {
+            System.err.println("Usage: java P2RankDaemon SOCKET_PATH MODEL [WARMUP_STRUCTURE]");
+            System.exit(2);
+        }
+
+        P2RankDaemon daemon = new P2RankDaemon(args[1]);
+        trapExit();
+        if (args.length > 2) {
+            daemon.warmUp(args[2]);
+        }
+        // Socket is created only after the warm-up, clients fall back to `prank` until then
+        daemon.serve(Paths.get(args[0]));
+    }
+}
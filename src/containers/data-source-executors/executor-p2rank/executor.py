@@ -1,82 +1,166 @@
 import os
 import subprocess
 import json
-import requests
 from enum import Enum
 import post_processor
+import p2rank_daemon
 import glob
+import shutil
+import uuid
+import time
 
 from tasks_logger import create_logger
 from status_manager import update_status, StatusType
+from storage import get_storage, input_path, StorageError
 
 RESULTS_FOLDER = "results"
-INPUTS_URL = os.getenv('INPUTS_URL')
-CONSERVATION_FILES_URL = os.getenv('CONSERVATION_URL')
 PLANKWEB_BASE_URL = os.getenv('PLANKWEB_BASE_URL')
+STAGED_STRUCTURE_FILE = "structure.pdb"
+# Staged structures of proteins whose conservation variant never ran (e.g. conservation failed) are removed after this time
+STAGED_STRUCTURE_MAX_AGE = int(os.getenv('P2RANK_STAGED_STRUCTURE_MAX_AGE', 24 * 3600))
+STAGED_STRUCTURE_SWEEP_INTERVAL = 3600
+WORKER_CONCURRENCY = int(os.getenv('P2RANK_WORKER_CONCURRENCY', 4))
+# Every worker process may run a batch at the same time, together they should not use more threads than there are CPUs
+P2RANK_THREADS = int(os.getenv('P2RANK_THREADS', max(1, (os.cpu_count() or 1) // WORKER_CONCURRENCY)))
 
 logger = create_logger('ds-p2rank')
+_last_sweep = 0.0
 
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 logger.info(f'{id} Results folder prepared: {RESULTS_FOLDER}')
 
 def prepare_hom_files(id, eval_folder):
     """
-    Downloads conservation files (.hom) for each protein chain to improve P2Rank prediction of binding sites.
+    Fetches conservation files (.hom) for each protein chain to improve P2Rank prediction of binding sites.
 
-    First it fetches a `chains.json` file from shared volume to determine the chain IDs, then downloads
-    a corresponding `.hom` file for each chain. Files need to be saved in the same folder where P2Rank will be executed.
+    First it reads a `chains.json` file from the shared storage to determine the chain IDs, then fetches
+    the `.hom` files of all chains at once. Files need to be saved in the same folder where P2Rank will be executed.
 
     Args:
         id (str): Generated ID for the input protein.
         eval_folder (str): Path to the folder where prediction results and hom files are stored.
     """
-    chains_json = os.path.join(INPUTS_URL, id, "chains.json")
+    storage = get_storage()
 
-    logger.info(f'{id} Downloading chains file from: {chains_json}')
+    logger.info(f'{id} Reading chains file')
     try:
-        response = requests.get(chains_json, stream=True, timeout=(10,20))
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logger.critical(f'{id} Failed to download chains file')
+        metadata = storage.read_json(input_path(id, "chains.json"))
+    except StorageError as e:
+        logger.critical(f'{id} Failed to read chains file: {str(e)}')
         return
         
-    logger.info(f'{id} Chains file downloaded successfully')
+    logger.info(f'{id} Chains file read successfully')
 
-    metadata = response.json()
-
-    for chain in metadata["chains"]:
-        filename = f"input{chain}.hom"
-        chain_hom_file = os.path.join(CONSERVATION_FILES_URL, id, filename)
+    filenames = [f"input{chain}.hom" for chain in metadata["chains"]]
+    logger.info(f'{id} Fetching hom files: {filenames}')
+    try:
+        hom_files = storage.fetch_all(os.path.join("conservation", id, filename) for filename in filenames)
+    except StorageError as e:
+        logger.error(f'{id} Failed to fetch hom files: {str(e)}')
+        return
 
-        logger.info(f'{id} Downloading hom file from: {chain_hom_file}')
-        try:
-            response = requests.get(chain_hom_file, stream=True, timeout=(10,20))
-            response.raise_for_status()
-        except requests.RequestException as e:
-            logger.error(f'{id} Failed to download hom file')
-            break
-        
-        logger.info(f'{id} Hom file downloaded successfully')
+    for filename in filenames:
         hom_file_path = os.path.join(eval_folder, filename)
         with open(hom_file_path, "wb") as hom_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                hom_file.write(chunk)
-        
+            hom_file.write(hom_files[os.path.join("conservation", id, filename)])
         logger.info(f'{id} Hom file saved to: {hom_file_path}')
 
 
-def run_p2rank(id, params):
+def run_prank(id, command, input_model):
     """
-    Runs P2Rank to predict binding sites in a protein structure.
+    Runs the P2Rank command in the P2Rank daemon serving the model (see `p2rank_daemon.py`), which avoids
+    JVM startup and model loading for every job. Falls back to the `prank` subprocess if the daemon is not configured or not available.
 
-    Downloads the input PDB file using the provided ID from shared volume and runs P2Rank using the specified model.
-    If conservation is enabled, additional .hom files are downloaded from shared volume and used during prediction.
+    Args:
+        id (str): Generated ID for the input protein.
+        command (list): P2Rank command, starting with `prank`, with absolute paths.
+        input_model (str): P2Rank model used by the command.
+    """
+    if p2rank_daemon.SOCKET_DIR:
+        try:
+            logger.info(f'{id} Running P2Rank in daemon: {" ".join(command)}')
+            p2rank_daemon.predict(command[1:], input_model)
+            logger.info(f'{id} P2Rank daemon finished')
+            return
+        except ConnectionError as e:
+            logger.warning(f'{id} P2Rank daemon not available, falling back to subprocess: {str(e)}')
+
+    logger.info(f'{id} Running P2Rank subprocess: {" ".join(command)}')
+    subprocess.run(command, check=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    logger.info(f'{id} P2Rank subprocess finished')
+
+
+def get_eval_folder(id, use_conservation):
+    eval_folder = os.path.join(RESULTS_FOLDER, f"{id}")
+    if use_conservation:
+        eval_folder = os.path.join(eval_folder, "conservation")
+    return eval_folder
+
+
+def _report_failure(id, status_file_path, e):
+    if isinstance(e, StorageError):
+        logger.error(f'{id} Failed to fetch PDB file: {str(e)}')
+        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to fetch PDB file: {str(e)}")
+    elif isinstance(e, subprocess.CalledProcessError):
+        err_msg = e.stderr.decode() # error message is from subprocess, needs different treatment
+        logger.error(f'{id} P2rank crashed: {err_msg}')
+        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"P2rank crashed: {err_msg}")
+    else:
+        logger.error(f'{id} An unexpected error occurred: {str(e)}')
+        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"An unexpected error occurred: {e}")
 
-    Progress is tracked using a status file and the results are processed and stored in a shared output format.
+
+def stage_structure(id):
+    """
+    Fetches the input PDB file once per protein, so both P2Rank variants (without and with conservation) use the same copy.
+    The staged file is kept until the conservation variant finishes, which usually runs much later than the first one.
+
+    Args:
+        id (str): Generated ID for the input protein.
+
+    Returns:
+        str: Path to the staged PDB file.
+    """
+    _sweep_staged_structures()
+    staged_structure_file = os.path.join(RESULTS_FOLDER, f"{id}", STAGED_STRUCTURE_FILE)
+    if os.path.exists(staged_structure_file):
+        logger.info(f'{id} Using staged PDB file: {staged_structure_file}')
+        return staged_structure_file
+
+    logger.info(f'{id} Fetching PDB file')
+    get_storage().save(input_path(id, "structure.pdb"), staged_structure_file)
+    logger.info(f'{id} PDB file saved to: {staged_structure_file}')
+    return staged_structure_file
+
+
+def _sweep_staged_structures():
+    """Removes staged structures older than `STAGED_STRUCTURE_MAX_AGE`, at most once per `STAGED_STRUCTURE_SWEEP_INTERVAL`."""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < STAGED_STRUCTURE_SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    for staged_structure_file in glob.glob(os.path.join(RESULTS_FOLDER, "*", STAGED_STRUCTURE_FILE)):
+        try:
+            if now - os.path.getmtime(staged_structure_file) > STAGED_STRUCTURE_MAX_AGE:
+                os.remove(staged_structure_file)
+                logger.info(f'Stale staged PDB file removed: {staged_structure_file}')
+        except FileNotFoundError:
+            # released by another worker in the meantime
+            pass
+
+
+def prepare_p2rank(id, params):
+    """
+    Prepares the evaluation folder of a P2Rank job, downloads the input PDB file and, if conservation
+    is enabled, the .hom files.
 
     Args:
         id (str): Generated ID for the input protein.
         params (dict): Dictionary containing `use_conservation` (bool) and `input_model` (str).
+
+    Returns:
+        tuple: Evaluation folder, status file path and input structure file path.
     """
     logger.info(f'{id} ds_p2rank started')
     
@@ -84,78 +168,218 @@ def run_p2rank(id, params):
     input_model = params['input_model']
     logger.info(f'{id} Params> use_conservation: {use_conservation}, input_model: {input_model}')
 
-    eval_folder = os.path.join(RESULTS_FOLDER, f"{id}")
-    if use_conservation:
-        eval_folder = os.path.join(eval_folder, "conservation")
+    eval_folder = get_eval_folder(id, use_conservation)
     os.makedirs(eval_folder, exist_ok=True)
     logger.info(f'{id} Evaluation folder prepared: {eval_folder}')
     status_file_path = os.path.join(eval_folder, "status.json")
     update_status(status_file_path, id, StatusType.STARTED, infoMessage="Execution started")
 
+    query_structure_file = os.path.join(eval_folder, "input.pdb")
+    staged_structure_file = stage_structure(id)
+    if os.path.exists(query_structure_file):
+        os.remove(query_structure_file)
     try:
-        pdb_url = os.path.join(INPUTS_URL, id, "structure.pdb")
-        query_structure_file = os.path.join(eval_folder, "input.pdb")
-        logger.info(f'{id} Downloading PDB file from: {pdb_url}')
-        response = requests.get(pdb_url, stream=True, timeout=(10,20))
-        response.raise_for_status()
-        logger.info(f'{id} PDB file downloaded successfully')
+        os.link(staged_structure_file, query_structure_file)
+    except OSError:
+        shutil.copyfile(staged_structure_file, query_structure_file)
+    logger.info(f'{id} Input structure prepared: {query_structure_file}')
 
-        with open(query_structure_file, "wb") as struct_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                struct_file.write(chunk)
-        logger.info(f'{id} Downloaded file saved to: {query_structure_file}')
+    if use_conservation:
+        prepare_hom_files(id, eval_folder)
 
-        if use_conservation:
-            prepare_hom_files(id, eval_folder)
+    return eval_folder, status_file_path, query_structure_file
+
+
+def finish_p2rank(id, eval_folder, status_file_path, query_structure_file):
+    """
+    Processes P2Rank output of a job into the shared output format and removes the input files.
+
+    Args:
+        id (str): Generated ID for the input protein.
+        eval_folder (str): Path to the folder with P2Rank results.
+        status_file_path (str): Path to the status file of the job.
+        query_structure_file (str): Path to the input PDB file, P2Rank results are prefixed with it.
+    """
+    query_structure_url = os.path.join(
+        PLANKWEB_BASE_URL,
+        "data",
+        "inputs",
+        f"{id}",
+        "structure.pdb"
+    )
+
+    update_status(status_file_path, id, StatusType.STARTED, infoMessage="Processing P2Rank output")
+
+    post_processor.process_p2rank_output(
+        id,
+        eval_folder,
+        query_structure_file,
+        query_structure_url
+    )
+
+    update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Execution completed successfully")
+    
+    logger.info(f'{id} Cleanup started')
+    os.remove(query_structure_file)
+    logger.info(f'{id} {query_structure_file} removed')
+    for file in glob.glob(os.path.join(eval_folder, "*.hom")):
+        os.remove(file)
+        logger.info(f'{id} {file} removed')
+
+
+def run_p2rank(id, params):
+    """
+    Runs P2Rank to predict binding sites in a protein structure.
+
+    Downloads the input PDB file using the provided ID from shared volume and runs P2Rank using the specified model.
+    If conservation is enabled, additional .hom files are downloaded from shared volume and used during prediction.
+
+    Progress is tracked using a status file and the results are processed and stored in a shared output format.
+
+    In the combined mode (`conservation_model` in params, sent when conservation is already available), the conservation
+    variant runs right after the first one in the same task, with the same staged input structure and the same warm P2Rank.
+
+    Args:
+        id (str): Generated ID for the input protein.
+        params (dict): Dictionary containing `use_conservation` (bool), `input_model` (str) and optionally `conservation_model` (str).
+    """
+    status_file_path = os.path.join(get_eval_folder(id, params['use_conservation']), "status.json")
+
+    try:
+        eval_folder, status_file_path, query_structure_file = prepare_p2rank(id, params)
 
         command = [
             "prank", "predict", 
-            "-f", query_structure_file, 
-            "-o", eval_folder, 
-            "-c", input_model,
+            "-f", os.path.abspath(query_structure_file), 
+            "-o", os.path.abspath(eval_folder), 
+            "-c", params['input_model'],
             "-visualizations", "0"
         ]
 
-        logger.info(f'{id} Running P2Rank subprocess: {" ".join(command)}')
-        subprocess.run(command, check=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        logger.info(f'{id} P2Rank subprocess finished')
+        run_prank(id, command, params['input_model'])
 
-        query_structure_url = os.path.join(
-            PLANKWEB_BASE_URL,
-            "data",
-            "inputs",
-            f"{id}",
-            "structure.pdb"
-        )
+        finish_p2rank(id, eval_folder, status_file_path, query_structure_file)
+    except Exception as e:
+        _report_failure(id, status_file_path, e)
 
-        update_status(status_file_path, id, StatusType.STARTED, infoMessage="Processing P2Rank output")
+    logger.info(f'{id} P2Rank finished')
 
-        post_processor.process_p2rank_output(
-            id,
-            eval_folder,
-            query_structure_file,
-            query_structure_url
-        )
+    if params.get('conservation_model'):
+        run_p2rank(id, conservation_params(params))
+    elif params['use_conservation'] or _conservation_variant_finished(id):
+        release_structure(id)
 
-        update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Execution completed successfully")
-        
-        logger.info(f'{id} Cleanup started')
-        os.remove(query_structure_file)
-        logger.info(f'{id} {query_structure_file} removed')
-        for file in glob.glob(os.path.join(eval_folder, "*.hom")):
-            os.remove(file)
-            logger.info(f'{id} {file} removed')
-
-    except requests.RequestException as e:
-        logger.error(f'{id} Failed to download PDB file: {str(e)}')
-        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to download PDB file: {str(e)}")
-    except subprocess.CalledProcessError as e:
-        err_msg = e.stderr.decode() # error message is from subprocess, needs different treatment
-        logger.error(f'{id} P2rank crashed: {err_msg}')
-        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"P2rank crashed: {err_msg}")
-    except Exception as e:
-        logger.error(f'{id} An unexpected error occurred: {str(e)}')
-        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"An unexpected error occurred: {e}")
 
-    logger.info(f'{id} P2Rank finished')
+def conservation_params(params):
+    """Params of the conservation variant of a combined job."""
+    return {'input_model': params['conservation_model'], 'use_conservation': True}
+
+
+def _conservation_variant_finished(id):
+    status_file_path = os.path.join(get_eval_folder(id, True), "status.json")
+    try:
+        with open(status_file_path, "r") as f:
+            return json.load(f).get("status") != StatusType.STARTED.value
+    except (OSError, ValueError):
+        return False
+
+
+def release_structure(id):
+    """Removes the staged input structure once the last P2Rank variant of the protein finished."""
+    staged_structure_file = os.path.join(RESULTS_FOLDER, f"{id}", STAGED_STRUCTURE_FILE)
+    if os.path.exists(staged_structure_file):
+        os.remove(staged_structure_file)
+        logger.info(f'{id} {staged_structure_file} removed')
+
+
+def run_p2rank_batch(jobs):
+    """
+    Runs a batch of P2Rank jobs collected from the queue.
+
+    Jobs without conservation which use the same model are predicted by a single P2Rank run over a dataset file,
+    so the fixed P2Rank overhead is paid once per batch. Conservation jobs (P2Rank looks up their .hom files by the
+    input file name), including conservation variants of combined jobs, and single jobs run separately. If a dataset run fails, its jobs are retried one by one so that
+    one broken structure does not fail the whole batch.
+
+    Args:
+        jobs (List[Tuple[str, dict]]): ID and params of each job.
+    """
+    groups = {}
+    conservation_jobs = []
+    for id, params in jobs:
+        if params['use_conservation']:
+            conservation_jobs.append((id, params))
+            continue
+        if params.get('conservation_model'):
+            # Combined job, the conservation variant runs after the dataset run
+            conservation_jobs.append((id, conservation_params(params)))
+            params = {key: value for key, value in params.items() if key != 'conservation_model'}
+        groups.setdefault(params['input_model'], []).append((id, params))
+
+    for input_model, group in groups.items():
+        if len(group) == 1:
+            run_p2rank(*group[0])
+        else:
+            _run_dataset(input_model, group)
+
+    for id, params in conservation_jobs:
+        run_p2rank(id, params)
+
+
+def _run_dataset(input_model, jobs):
+    batch_folder = os.path.abspath(os.path.join(RESULTS_FOLDER, ".batches", uuid.uuid4().hex))
+    output_folder = os.path.join(batch_folder, "output")
+    os.makedirs(output_folder)
+    batch_id = os.path.basename(batch_folder)
+    logger.info(f'{batch_id} P2Rank batch of {len(jobs)} jobs ({input_model}): {", ".join(id for id, _ in jobs)}')
+
+    prepared = []
+    for id, params in jobs:
+        status_file_path = os.path.join(get_eval_folder(id, params['use_conservation']), "status.json")
+        try:
+            eval_folder, status_file_path, query_structure_file = prepare_p2rank(id, params)
+            # P2Rank names the results after the input file, so every job gets a unique name
+            # (an id queued twice in the batch fails here)
+            os.symlink(os.path.abspath(query_structure_file), os.path.join(batch_folder, f"{id}.pdb"))
+        except Exception as e:
+            _report_failure(id, status_file_path, e)
+            logger.info(f'{id} P2Rank finished')
+            continue
+        prepared.append((id, params, eval_folder, status_file_path, query_structure_file))
+
+    try:
+        if prepared:
+            dataset_file = os.path.join(batch_folder, "batch.ds")
+            with open(dataset_file, "w") as f:
+                f.writelines(f"{id}.pdb\n" for id, *_ in prepared)
+
+            command = [
+                "prank", "predict", dataset_file,
+                "-o", output_folder,
+                "-c", input_model,
+                "-threads", str(P2RANK_THREADS),
+                "-visualizations", "0"
+            ]
+            try:
+                run_prank(batch_id, command, input_model)
+            except Exception as e:
+                # any failure of the batch run (not only of P2Rank itself, e.g. an unexpected daemon response)
+                # must not leave the jobs started forever, each of them reports its own result
+                error = e.stderr.decode() if isinstance(e, subprocess.CalledProcessError) else repr(e)
+                logger.warning(f'{batch_id} P2Rank batch failed, running jobs separately: {error}')
+                for id, params, *_ in prepared:
+                    run_p2rank(id, params)
+                return
 
+        for id, params, eval_folder, status_file_path, query_structure_file in prepared:
+            try:
+                for suffix in ("_residues.csv", "_predictions.csv"):
+                    shutil.move(os.path.join(output_folder, f"{id}.pdb{suffix}"), query_structure_file + suffix)
+                finish_p2rank(id, eval_folder, status_file_path, query_structure_file)
+            except Exception as e:
+                _report_failure(id, status_file_path, e)
+            logger.info(f'{id} P2Rank finished')
+            if _conservation_variant_finished(id):
+                release_structure(id)
+    finally:
+        shutil.rmtree(batch_folder, ignore_errors=True)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import socket
+import subprocess
+import time
+from typing import List
+
+from tasks_logger import create_logger
+
+SOCKET_DIR = os.getenv('P2RANK_DAEMON_SOCKET_DIR')
+MODELS = os.getenv('P2RANK_DAEMON_MODELS', 'default,conservation_hmm,alphafold,alphafold_conservation_hmm').split(',')
+P2RANK_HOME = os.getenv('P2RANK_HOME', 'p2rank_2.5')
+JAVA_XMX = os.getenv('P2RANK_DAEMON_XMX', '2g')
+WARMUP_STRUCTURE = os.getenv('P2RANK_WARMUP_STRUCTURE', os.path.join(P2RANK_HOME, 'test_data', '1fbl.pdb.gz'))
+# Daemons (JVMs with `JAVA_XMX` heap each) per model. Each one serves a single request at a time,
+# a request which finds all of them busy runs `prank` instead.
+INSTANCES = int(os.getenv('P2RANK_DAEMON_INSTANCES', 1))
+# A daemon halts itself after this many seconds of a request (see P2RankDaemon.java), clients wait a little longer
+REQUEST_TIMEOUT = int(os.getenv('P2RANK_DAEMON_REQUEST_TIMEOUT', 1800))
+DAEMON_CLASSES = 'daemon'
+RESTART_DELAY = 5
+
+logger = create_logger('ds-p2rank')
+
+
+def socket_path(model: str, instance: int, socket_dir: str = SOCKET_DIR) -> str:
+    return os.path.join(socket_dir, f"{model}-{instance}.sock")
+
+
+def _daemon_command(model: str, instance: int, socket_dir: str) -> List[str]:
+    classpath = os.pathsep.join([
+        DAEMON_CLASSES,
+        os.path.join(P2RANK_HOME, "bin", "p2rank.jar"),
+        os.path.join(P2RANK_HOME, "bin", "lib", "*"),
+    ])
+    command = [
+        "java", f"-Xmx{JAVA_XMX}", "-Djava.security.manager=allow",
+        "-cp", classpath,
+        "P2RankDaemon", socket_path(model, instance, socket_dir), model
+    ]
+    if os.path.exists(WARMUP_STRUCTURE):
+        command.append(os.path.abspath(WARMUP_STRUCTURE))
+    return command
+
+
+def serve(socket_dir: str = SOCKET_DIR):
+    """
+    Starts `P2RANK_DAEMON_INSTANCES` P2Rank daemons (JVMs) per model listed in `P2RANK_DAEMON_MODELS`
+    and restarts daemons which exited. Each daemon warms up on `P2RANK_WARMUP_STRUCTURE` before it starts
+    listening, so the first jobs are not slowed down by JIT compilation and model loading.
+
+    Args:
+        socket_dir (str): Directory for the daemon sockets (`{model}-{instance}.sock`).
+    """
+    os.makedirs(socket_dir, exist_ok=True)
+    daemons = {}
+    while True:
+        for model in MODELS:
+            for instance in range(INSTANCES):
+                process = daemons.get((model, instance))
+                if process is not None and process.poll() is None:
+                    continue
+                path = socket_path(model, instance, socket_dir)
+                if process is not None:
+                    logger.warning(f'P2Rank daemon {model}-{instance} exited with code {process.returncode}, restarting it')
+                    if os.path.exists(path):
+                        os.remove(path)
+                command = _daemon_command(model, instance, socket_dir)
+                logger.info(f'Starting P2Rank daemon: {" ".join(command)}')
+                daemons[(model, instance)] = subprocess.Popen(command)
+        time.sleep(RESTART_DELAY)
+
+
+def _acquire_daemon(model: str, socket_dir: str):
+    """Locks an idle daemon of the model (across all worker processes), returns its instance and the lock file."""
+    for instance in range(INSTANCES):
+        if not os.path.exists(socket_path(model, instance, socket_dir)):
+            continue
+        lock_file = open(os.path.join(socket_dir, f"{model}-{instance}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return instance, lock_file
+        except BlockingIOError:
+            lock_file.close()
+    return None, None
+
+
+def predict(args: List[str], model: str, socket_dir: str = SOCKET_DIR) -> str:
+    """
+    Runs `prank` with the given arguments in the P2Rank daemon serving the model.
+    Paths in the arguments must be absolute, the daemon runs in its own working directory.
+
+    Args:
+        args (List[str]): P2Rank arguments, e.g. `["predict", "-f", ..., "-c", model]`.
+        model (str): P2Rank model (config) passed with `-c`.
+        socket_dir (str): Directory with the daemon sockets.
+
+    Returns:
+        str: Output of P2Rank.
+
+    Raises:
+        ConnectionError: No daemon of the model is running and idle, or the daemon died or did not
+            respond (validly) within `P2RANK_DAEMON_REQUEST_TIMEOUT`.
+        subprocess.CalledProcessError: P2Rank failed, same as with the `prank` subprocess.
+    """
+    instance, lock_file = _acquire_daemon(model, socket_dir)
+    if lock_file is None:
+        raise ConnectionError(f'No idle P2Rank daemon for model {model}')
+
+    path = socket_path(model, instance, socket_dir)
+    with lock_file, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(REQUEST_TIMEOUT + 60)
+        try:
+            client.connect(path)
+            client.sendall("\0".join(args).encode())
+            client.shutdown(socket.SHUT_WR)
+            response = b"".join(iter(lambda: client.recv(65536), b""))
+        except OSError as e:  # missing or refused socket, permissions, timeout
+            raise ConnectionError(f'P2Rank daemon {model}-{instance} not available at {path}: {e}')
+
+    status, _, output = response.decode(errors="replace").partition("\n")
+    try:
+        return_code = int(status)
+    except ValueError:
+        raise ConnectionError(f'P2Rank daemon for model {model} sent an invalid response: {status[:100]!r}')
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, ["prank"] + args, output=b"", stderr=output.encode())
+    return output
+
+
+if __name__ == '__main__':
+    serve()
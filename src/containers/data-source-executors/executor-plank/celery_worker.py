@@ -2,14 +2,31 @@
 
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 import executor
+import model_registry
 
 celery = Celery(
     os.getenv('CELERY_NAME'),
     broker=os.getenv('CELERY_BROKER_URL')
 )
+# Same queue declaration as the other services, callbacks keep the priority of the finished task
+celery.conf.update({
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True
+})
+
+@worker_init.connect
+def preload_models(**kwargs):
+    if os.getenv('PLANK_INFERENCE_SOCKET'):
+        return  # models are owned by the inference server
+    # Loaded in the main process, so the prefork children share the weights
+    model_registry.load_models()
+
+@worker_process_init.connect
+def report_child_memory(**kwargs):
+    model_registry.log_metrics()
 
 @celery.task(name='ds_plank')
 def ds_plank(id):
     executor.run_plank(id)
-    
\ No newline at end of file
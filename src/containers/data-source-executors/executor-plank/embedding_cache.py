@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import torch
+
+from disk_cache import DiskCache
+from model_registry import ESM_MODEL_NAME
+from tasks_logger import create_logger
+
+EMBEDDING_CACHE_DIR = os.getenv('PLANK_EMBEDDING_CACHE_DIR', 'cache/embeddings')
+EMBEDDING_CACHE_MAX_MB = int(os.getenv('PLANK_EMBEDDING_CACHE_MAX_MB', 4096))
+EMBEDDING_CACHE_DTYPE = np.dtype(os.getenv('PLANK_EMBEDDING_CACHE_DTYPE', 'float16'))
+
+logger = create_logger('ds-plank')
+
+_cache = None
+
+
+def _get_cache() -> DiskCache:
+    global _cache
+    if _cache is None:
+        _cache = DiskCache("embeddings", EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+    return _cache
+
+
+def _key(sequence: str, repr_layer: int) -> str:
+    return DiskCache.make_key(ESM_MODEL_NAME, repr_layer, EMBEDDING_CACHE_DTYPE.name, sequence)
+
+
+def load(sequence: str, repr_layer: int) -> torch.Tensor | None:
+    """
+    Returns the cached per-residue representation of the sequence or None on a cache miss.
+    The cached array is memory-mapped and converted to float32 only once it is read.
+    """
+    path = _get_cache().get(_key(sequence, repr_layer), ".npy")
+    if path is None:
+        return None
+    try:
+        embedding = np.load(path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.warning(f'Cached embedding {path} cannot be read, ignoring it: {str(e)}')
+        return None
+    if embedding.shape[0] != len(sequence):
+        return None
+    return torch.from_numpy(embedding.astype(np.float32))
+
+
+def store(sequence: str, repr_layer: int, embedding: torch.Tensor):
+    """Stores the per-residue representation of the sequence in the cache."""
+    try:
+        with _get_cache().writer(_key(sequence, repr_layer), ".npy") as tmp_path:
+            with open(tmp_path, "wb") as f:
+                np.save(f, embedding.numpy().astype(EMBEDDING_CACHE_DTYPE))
+    except OSError as e:
+        logger.warning(f'Embedding could not be cached: {str(e)}')
@@ -1,17 +1,18 @@
 import os
 import json
-import requests
 from enum import Enum
 from tasks_logger import create_logger
 from status_manager import update_status, StatusType
+from storage import fetch_inputs, StorageError
 
 
-from predict import embed_sequences, predict_bindings
+from predict import embed_sequences, predict_binding_values, save_bindings
 from post_processor import process_plank_output
+import inference_server
 
 RESULTS_FOLDER = "results"
-INPUTS_URL = os.getenv('INPUTS_URL')
 PLANKWEB_BASE_URL = os.getenv('PLANKWEB_BASE_URL')
+INFERENCE_SOCKET = os.getenv('PLANK_INFERENCE_SOCKET')
 
 logger = create_logger('ds-plank')
 
@@ -22,7 +23,7 @@ def run_plank(id):
     """
     Runs the Plank - pLM and neural network model to predict for each residue in protein if it belongs to a binding site.
 
-    The function downloads input sequence data based on the provided ID from shared volume,
+    The function fetches input sequence data based on the provided ID from shared storage,
     embeds the sequences using a pLM and performs binding site prediction using the NN.
     It tracks progress using a status file and stores the results in a shared format
     for each chain.
@@ -39,24 +40,16 @@ def run_plank(id):
     update_status(status_file_path, id, StatusType.STARTED, infoMessage="Execution started")
 
     try:
-        chain_map_file = os.path.join(INPUTS_URL, id, 'chains.json')
-        logger.info(f'{id} Downloading chains file from: {chain_map_file}')
-        response = requests.get(chain_map_file, timeout=(10,20))
-        response.raise_for_status()
-        logger.info(f'{id} Chains file downloaded successfully')
-        chain_map = response.json()
+        logger.info(f'{id} Fetching input files')
+        input_files = fetch_inputs(id)
+        logger.info(f'{id} Input files fetched successfully')
+        chain_map = json.loads(input_files['chains.json'])
         
         seq = []
         seq_chains = []
         files = chain_map.get('fasta', {}).keys()
         for file in files:
-            file_url = os.path.join(INPUTS_URL, id, file)
-            logger.info(f'{id} Downloading FASTA file from: {file_url}')
-            response = requests.get(file_url, stream=True, timeout=(10,20))
-            response.raise_for_status()
-            logger.info(f'{id} FASTA file downloaded successfully')
-
-            lines = response.text.splitlines()
+            lines = input_files[file].decode().splitlines()
             for line in lines:
                 if line.startswith('>'):
                     continue
@@ -66,18 +59,28 @@ def run_plank(id):
             seq_chains.append(chains)
         
         logger.info(f'{id} Parsed all FASTA files')
-        update_status(status_file_path, id, StatusType.STARTED, infoMessage="Embedding sequences")
 
+        bindings = None
+        if INFERENCE_SOCKET:
+            update_status(status_file_path, id, StatusType.STARTED, infoMessage="Waiting for inference server")
+            try:
+                bindings = inference_server.request_predictions(seq, INFERENCE_SOCKET)
+                logger.info(f'{id} Predictions received from inference server')
+            except (ConnectionError, EOFError, TimeoutError, RuntimeError) as e:
+                # a failure reported by the server (e.g. out of GPU memory) may not repeat in the worker process
+                logger.warning(f'{id} Inference server unavailable or failed ({str(e)}), predicting in the worker process')
 
-        embeddings = embed_sequences(seq)
+        if bindings is None:
+            update_status(status_file_path, id, StatusType.STARTED, infoMessage="Embedding sequences")
+            embeddings = embed_sequences(seq)
 
-        logger.info(f'{id} Successfully embedded sequences')
-        update_status(status_file_path, id, StatusType.STARTED, infoMessage="Predicting bindings")
+            logger.info(f'{id} Successfully embedded sequences')
+            update_status(status_file_path, id, StatusType.STARTED, infoMessage="Predicting bindings")
+
+            bindings = predict_binding_values(embeddings)
 
-        lenghts = [len(s) for s in seq]
-        
         result_file_path = os.path.join(eval_folder, "result.json")
-        result_data = predict_bindings(embeddings, lenghts, result_file_path, seq_chains, seq)
+        result_data = save_bindings(bindings, result_file_path, seq_chains, seq)
 
         logger.info(f'{id} NN prediction finished')
 
@@ -101,9 +104,9 @@ def run_plank(id):
 
         update_status(status_file_path, id, StatusType.COMPLETED, infoMessage="Execution completed successfully")
         
-    except requests.RequestException as e:
-        logger.error(f'{id} Failed to download PDB file: {str(e)}')
-        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to download Fasta file: {str(e)}")
+    except StorageError as e:
+        logger.error(f'{id} Failed to fetch input files: {str(e)}')
+        update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"Failed to fetch Fasta file: {str(e)}")
     except Exception as e:
         logger.error(f'{id} An unexpected error occurred: {str(e)}')
         update_status(status_file_path, id, StatusType.FAILED, errorMessage = f"An unexpected error occurred: {e}")
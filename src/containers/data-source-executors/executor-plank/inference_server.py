@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import queue
+import threading
+from dataclasses import dataclass, field
+from multiprocessing.connection import Listener, Client
+from typing import List
+
+from tasks_logger import create_logger
+
+SOCKET_PATH = os.getenv('PLANK_INFERENCE_SOCKET')
+BATCH_WINDOW_MS = int(os.getenv('PLANK_BATCH_WINDOW_MS', 50))
+MAX_BATCH_SEQUENCES = int(os.getenv('PLANK_MAX_BATCH_SEQUENCES', 64))
+CONNECT_TIMEOUT = int(os.getenv('PLANK_INFERENCE_CONNECT_TIMEOUT', 60))
+# Longest wait for predictions of a connected server (queueing included), a stalled server does not block tasks
+RESPONSE_TIMEOUT = int(os.getenv('PLANK_INFERENCE_RESPONSE_TIMEOUT', 600))
+# After the server was not reachable, tasks do not wait for it again during this interval
+RETRY_INTERVAL = int(os.getenv('PLANK_INFERENCE_RETRY_INTERVAL', 30))
+METRICS_EVERY_BATCHES = 10
+
+logger = create_logger('ds-plank')
+
+# Time (monotonic) until which the server is considered down in this worker process
+_unavailable_until = 0.0
+
+
+@dataclass
+class _InferenceRequest:
+    sequences: List[str]
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    done: threading.Event = field(default_factory=threading.Event)
+    result: list | None = None
+    error: str | None = None
+
+
+class _Counters:
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.sequences = 0
+        self.unique_sequences = 0
+        self.residues = 0
+        self.queue_wait_seconds = 0.0
+        self.inference_seconds = 0.0
+
+    def log(self):
+        if self.batches == 0:
+            return
+        throughput = self.residues / self.inference_seconds if self.inference_seconds else 0.0
+        logger.info(
+            f'Inference server metrics: batches={self.batches}, requests={self.requests}, '
+            f'avg_batch_requests={self.requests / self.batches:.2f}, '
+            f'avg_batch_sequences={self.unique_sequences / self.batches:.2f}, '
+            f'avg_queue_wait_ms={1000 * self.queue_wait_seconds / self.requests:.1f}, '
+            f'throughput_residues_per_s={throughput:.1f}'
+        )
+
+
+def _collect_batch(requests_queue: queue.Queue) -> List[_InferenceRequest]:
+    # Block for the first request, then coalesce whatever arrives within the batching window
+    batch = [requests_queue.get()]
+    deadline = time.perf_counter() + BATCH_WINDOW_MS / 1000
+    sequence_count = len(batch[0].sequences)
+    while sequence_count < MAX_BATCH_SEQUENCES:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            request = requests_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        batch.append(request)
+        sequence_count += len(request.sequences)
+    return batch
+
+
+def _run_batches(requests_queue: queue.Queue, counters: _Counters):
+    from predict import embed_sequences, predict_binding_values
+
+    while True:
+        batch = _collect_batch(requests_queue)
+        started = time.perf_counter()
+
+        # Identical sequences submitted by different jobs are predicted only once
+        unique_sequences = list(dict.fromkeys(s for request in batch for s in request.sequences))
+        try:
+            bindings = predict_binding_values(embed_sequences(unique_sequences))
+            by_sequence = dict(zip(unique_sequences, bindings))
+            for request in batch:
+                request.result = [by_sequence[s] for s in request.sequences]
+        except Exception as e:
+            logger.error(f'Batched inference failed: {str(e)}')
+            for request in batch:
+                request.error = str(e)
+
+        counters.batches += 1
+        counters.requests += len(batch)
+        counters.sequences += sum(len(request.sequences) for request in batch)
+        counters.unique_sequences += len(unique_sequences)
+        counters.residues += sum(len(s) for s in unique_sequences)
+        counters.queue_wait_seconds += sum(started - request.enqueued_at for request in batch)
+        counters.inference_seconds += time.perf_counter() - started
+        if counters.batches % METRICS_EVERY_BATCHES == 0:
+            counters.log()
+
+        for request in batch:
+            request.done.set()
+
+
+def _serve_connection(connection, requests_queue: queue.Queue):
+    with connection:
+        try:
+            message = connection.recv()
+            request = _InferenceRequest(sequences=list(message['sequences']))
+            requests_queue.put(request)
+            request.done.wait()
+            connection.send({'bindings': request.result, 'error': request.error})
+        except (EOFError, OSError) as e:
+            logger.warning(f'Inference client disconnected: {str(e)}')
+
+
+def serve(socket_path: str = SOCKET_PATH):
+    """
+    Runs the Plank inference server. The server owns the only copy of ESM2 and `BindingPredictor`,
+    accepts sequences from `ds_plank` tasks on a local socket and coalesces requests arriving
+    within `PLANK_BATCH_WINDOW_MS` into one batched forward pass.
+
+    Args:
+        socket_path (str): Path of the Unix socket the server listens on.
+    """
+    import model_registry
+    model_registry.load_models()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    requests_queue = queue.Queue()
+    counters = _Counters()
+    threading.Thread(target=_run_batches, args=(requests_queue, counters), daemon=True).start()
+
+    # Socket is created only after the models are loaded, clients wait for it in `request_predictions`
+    with Listener(socket_path, family='AF_UNIX') as listener:
+        logger.info(f'Plank inference server listening on {socket_path}')
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_serve_connection, args=(connection, requests_queue), daemon=True).start()
+
+
+def request_predictions(sequences: List[str], socket_path: str = SOCKET_PATH) -> List[List[float]]:
+    """
+    Submits sequences to the Plank inference server and waits for per-sequence binding values.
+
+    Raises:
+        ConnectionError: The server is not reachable (its socket does not appear within
+            `PLANK_INFERENCE_CONNECT_TIMEOUT` seconds or nothing listens on it).
+        TimeoutError: The server did not respond within `PLANK_INFERENCE_RESPONSE_TIMEOUT` seconds.
+        RuntimeError: The server failed to predict the sequences.
+    """
+    global _unavailable_until
+    if time.monotonic() < _unavailable_until:
+        raise ConnectionError(f'Plank inference server not available at {socket_path} (failed recently)')
+
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while True:
+        try:
+            connection = Client(socket_path, family='AF_UNIX')
+            break
+        except ConnectionRefusedError as e:
+            # the socket exists, but the server is gone (it is being restarted), do not wait for it
+            _unavailable_until = time.monotonic() + RETRY_INTERVAL
+            raise ConnectionError(f'Plank inference server not available at {socket_path}: {e}')
+        except FileNotFoundError as e:
+            # the socket is created once the models are loaded
+            if time.monotonic() > deadline:
+                _unavailable_until = time.monotonic() + RETRY_INTERVAL
+                raise ConnectionError(f'Plank inference server not available at {socket_path}: {e}')
+            time.sleep(1)
+
+    with connection:
+        connection.send({'sequences': sequences})
+        if not connection.poll(RESPONSE_TIMEOUT):
+            raise TimeoutError(f'Plank inference server did not respond within {RESPONSE_TIMEOUT} s')
+        response = connection.recv()
+
+    if response['error']:
+        raise RuntimeError(f'Plank inference server failed: {response["error"]}')
+    return response['bindings']
+
+
+if __name__ == '__main__':
+    serve()
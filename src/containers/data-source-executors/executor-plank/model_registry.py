@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+import esm
+import torch
+from model import BindingPredictor
+
+from tasks_logger import create_logger
+
+ESM_MODEL_NAME = "esm2_t33_650M_UR50D"
+PREDICTOR_MODEL_PATH = "models/model_e10.pth"
+
+logger = create_logger('ds-plank')
+
+_lock = threading.Lock()
+_esm_model = None
+_esm_alphabet = None
+_predictor = None
+_predictor_path = None
+
+metrics = {
+    "esm_load_seconds": None,
+    "predictor_load_seconds": None,
+    "rss_before_load_mb": None,
+    "rss_after_load_mb": None,
+}
+
+
+def _resident_memory_mb():
+    """Returns resident set size of the current process in MB (None if it cannot be determined)."""
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _share_weights(model):
+    # Moves parameters into shared memory, so prefork children forked after loading
+    # keep reading the same pages instead of copying them on first touch.
+    model.share_memory()
+    for param in model.parameters():
+        param.requires_grad_(False)
+
+
+def load_models(predictor_path=PREDICTOR_MODEL_PATH):
+    """
+    Loads the ESM2 model and the `BindingPredictor` weights into the process-level registry.
+
+    Calling the function repeatedly is cheap, models are loaded only once per process.
+    When called in the Celery main process (on worker init), prefork children inherit
+    the already loaded weights.
+
+    Args:
+        predictor_path (str): Path to the `BindingPredictor` weights.
+    """
+    global _esm_model, _esm_alphabet, _predictor, _predictor_path
+
+    with _lock:
+        if _esm_model is not None and _predictor is not None and _predictor_path == predictor_path:
+            return
+
+        metrics["rss_before_load_mb"] = _resident_memory_mb()
+
+        if _esm_model is None:
+            logger.info(f'Loading ESM2 model {ESM_MODEL_NAME}')
+            start = time.perf_counter()
+            model, alphabet = esm.pretrained.load_model_and_alphabet(ESM_MODEL_NAME)
+            model.to(torch.device("cpu"))
+            model.eval()
+            _share_weights(model)
+            _esm_model, _esm_alphabet = model, alphabet
+            metrics["esm_load_seconds"] = time.perf_counter() - start
+            logger.info(f'ESM2 model loaded in {metrics["esm_load_seconds"]:.2f} s')
+
+        if _predictor is None or _predictor_path != predictor_path:
+            logger.info(f'Loading BindingPredictor weights from {predictor_path}')
+            start = time.perf_counter()
+            predictor = BindingPredictor()
+            predictor.load_model(predictor_path)
+            _share_weights(predictor)
+            _predictor, _predictor_path = predictor, predictor_path
+            metrics["predictor_load_seconds"] = time.perf_counter() - start
+            logger.info(f'BindingPredictor loaded in {metrics["predictor_load_seconds"]:.2f} s')
+
+        metrics["rss_after_load_mb"] = _resident_memory_mb()
+        log_metrics()
+
+
+def get_esm_model():
+    """Returns the resident ESM2 model and its alphabet, loading them on first use."""
+    if _esm_model is None:
+        load_models()
+    return _esm_model, _esm_alphabet
+
+
+def get_binding_predictor(predictor_path=PREDICTOR_MODEL_PATH):
+    """Returns the resident `BindingPredictor`, loading it on first use."""
+    if _predictor is None or _predictor_path != predictor_path:
+        load_models(predictor_path)
+    return _predictor
+
+
+def log_metrics():
+    logger.info(
+        f'Model registry metrics (pid {os.getpid()}): '
+        f'esm_load_seconds={metrics["esm_load_seconds"]}, '
+        f'predictor_load_seconds={metrics["predictor_load_seconds"]}, '
+        f'rss_before_load_mb={metrics["rss_before_load_mb"]}, '
+        f'rss_after_load_mb={metrics["rss_after_load_mb"]}, '
+        f'rss_current_mb={_resident_memory_mb()}'
+    )
@@ -1,44 +1,85 @@
+import os
 import json
-import esm
-import numpy as np
 import torch
-from model import BindingPredictor
+import model_registry
+import embedding_cache
 
-chunk_size = 5
 repr_layer = 33
 threshold = 1024
 embed_size = 1280
+max_batch_tokens = int(os.getenv('PLANK_MAX_BATCH_TOKENS', 4096))
+
+def make_length_buckets(lengths, token_budget=max_batch_tokens):
+    """
+    Groups sequence indices into buckets of similar length, so that every bucket padded to its own
+    longest sequence stays under the token budget. A sequence exceeding the budget gets its own bucket.
+
+    Args:
+        lengths (List[int]): Lengths of the sequences.
+        token_budget (int): Maximum number of (padded) tokens processed in one forward pass.
+
+    Returns:
+        List[List[int]]: Buckets of indices to the original `lengths` list.
+    """
+    buckets = []
+    bucket = []
+    bucket_width = 0
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        # Sequences are sorted descending, so the first one in a bucket determines its padded width
+        width = bucket_width if bucket else min(lengths[index] + 2, threshold)
+        if bucket and (len(bucket) + 1) * width > token_budget:
+            buckets.append(bucket)
+            bucket = []
+            width = min(lengths[index] + 2, threshold)
+        bucket.append(index)
+        bucket_width = width
+    if bucket:
+        buckets.append(bucket)
+    return buckets
 
 def embed_sequences(sequences):
-    # ESM2 model setup
-    model, alphabet = esm.pretrained.esm2_t33_650M_UR50D()
+    """
+    Embeds sequences using the ESM2 model. Embeddings are looked up in the embedding cache first,
+    ESM2 runs only on the cache misses. Missing sequences are processed in length-sorted buckets
+    and each bucket is padded only to its own longest sequence.
+
+    Returns:
+        List[torch.Tensor]: Per-residue representations of shape `(len(sequence), embed_size)`,
+        in the same order as the input sequences.
+    """
+    embedded = [embedding_cache.load(seq, repr_layer) for seq in sequences]
+
+    # Identical sequences (e.g. chains of a homomer) are embedded only once
+    missing = list(dict.fromkeys(seq for seq, embedding in zip(sequences, embedded) if embedding is None))
+    if not missing:
+        return embedded
+
+    # ESM2 model is resident in the worker process
+    model, alphabet = model_registry.get_esm_model()
     device = torch.device("cpu")
-    model.to(device)
-    model.eval()
 
     # Prepare correct format for the model
-    data = [(f"seq_{i}", seq) for i, seq in enumerate(sequences)]
-    max_len = max([len(s) for s in sequences])
-    embedded = []
+    data = [(f"seq_{i}", seq) for i, seq in enumerate(missing)]
+    computed = {}
 
-    # Process sequences in chunks
-    for i in range(0, len(data), chunk_size):
-        chunk_end = min(i + chunk_size, len(data))
-        embed_chunk = process_chunk(data[i:chunk_end], model, alphabet, max_len, device)
-        embedded.append(embed_chunk)
+    # Process sequences in buckets and scatter them back to the original order
+    for bucket in make_length_buckets([len(s) for s in missing]):
+        bucket_embeddings = process_bucket([data[i] for i in bucket], model, alphabet, device)
+        for index, embedding in zip(bucket, bucket_embeddings):
+            computed[missing[index]] = embedding
+            embedding_cache.store(missing[index], repr_layer, embedding)
 
-    # Merge outputs into one tensor 
-    return torch.concat(embedded, dim=0)
+    return [embedding if embedding is not None else computed[seq] for seq, embedding in zip(sequences, embedded)]
 
-def process_chunk(data, model, alphabet, max_len, device):
-    # Tokenize the sequences
+def process_bucket(data, model, alphabet, device):
+    # Tokenize the sequences, padded to the longest sequence in the bucket
     batch_converter = alphabet.get_batch_converter()
     batch_labels, batch_strs, batch_tokens = batch_converter(data)
     batch_tokens = batch_tokens.to(device)
     batch_lens = (batch_tokens != alphabet.padding_idx).sum(1)
 
     # Prepare output
-    embed = torch.zeros(len(data), max_len+2, embed_size)
+    embed = torch.zeros(len(data), batch_tokens.shape[1], embed_size)
 
     # Process in rounds for longer sequences
     rounds = batch_lens // threshold + 1
@@ -55,28 +96,35 @@ def process_chunk(data, model, alphabet, max_len, device):
 
         embed[remaining_index, start:end] = token_representations.detach().cpu()
 
-    # Crop starting and ending tokens
-    return embed[:, 1:-1, :]
-
-def predict_bindings(embeddings, lengths, result_file_path, seq_chains, seq, model_path = "models/model_e10.pth"):
-    # Predictor model setup
-    model = BindingPredictor()
-    model.load_model(model_path)
-
-    # Predict bindings
-    predictions = model.predict(embeddings).detach().cpu()
-
-    lengths = np.array(lengths)
-    if predictions.dim() == 1:
-        cropped = [predictions[:lengths[0]]]  # Slice by length
-    else:
-        # Multiple sequences, permute and unpad
-        cropped = torch.nn.utils.rnn.unpad_sequence(predictions.permute(1,0), lengths)
-
+    # Crop starting and ending tokens and padding of each sequence
+    return [embed[i, 1:len(seq) + 1].clone() for i, (_, seq) in enumerate(data)]
+
+def predict_binding_values(embeddings, model_path = model_registry.PREDICTOR_MODEL_PATH):
+    """
+    Predicts binding values for each residue of the embedded sequences.
+
+    Args:
+        embeddings (List[torch.Tensor]): Ragged per-residue embeddings as returned by `embed_sequences`.
+        model_path (str): Path to the `BindingPredictor` weights.
+
+    Returns:
+        List[List[float]]: Binding values for each sequence, 0 for residues below the threshold.
+    """
+    # Predictor model is resident in the process
+    model = model_registry.get_binding_predictor(model_path)
+
+    # Residues are independent for the predictor, so the ragged embeddings are
+    # evaluated as one flat batch and split back per sequence
+    lengths = [embedding.shape[0] for embedding in embeddings]
+    predictions = model.predict(torch.cat(embeddings, dim=0)).detach().cpu().reshape(-1)
+    return [prediction.tolist() for prediction in torch.split(predictions, lengths)]
+
+def save_bindings(bindings, result_file_path, seq_chains, seq):
+    # bindings come from the worker process or from the inference server
+    if [len(b) for b in bindings] != [len(s) for s in seq]:
+        raise ValueError("Number of predicted binding values does not match the sequence lengths")
     result_data = []
 
-    bindings = [prediction.tolist() for prediction in cropped]
-
     for i, chains in enumerate(seq_chains):
         result_data.append({
             "chains": chains,
@@ -87,4 +135,4 @@ def predict_bindings(embeddings, lengths, result_file_path, seq_chains, seq, mod
     with open(result_file_path, "w") as f:
             json.dump(result_data, f, indent=4)
 
-    return result_data
\ No newline at end of file
+    return result_data
@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+
+import importlib
+
+# Celery app of the `batch` worker, the tasks are defined in http-server.py (not importable by its name)
+celery = importlib.import_module('http-server').celery
@@ -2,14 +2,17 @@
 
 import json
 import os
+import shutil
+import tarfile
 import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from enum import Enum
 from io import StringIO
-from subprocess import Popen
 from typing import TypeAlias
 
-import requests
 from Bio import SeqIO, PDB
 from Bio.PDB.Polypeptide import is_aa
 from celery import Celery
@@ -18,6 +21,10 @@ from humps import decamelize
 from werkzeug.datastructures import FileStorage
 
 from tasks_logger import create_logger
+from storage import get_storage, StorageError
+from remote_validation import (
+    ValidationError, check_pdb_code, check_uniprot_code, check_chains, fetch_pdb, fetch_uniprot, create_session
+)
 
 ########################### Flask and Celery setup #############################
 
@@ -29,8 +36,14 @@ celery = Celery(
 celery.conf.update({
     'task_routes': {
         'metatask_SEQ': 'metatask',
-        'metatask_STR': 'metatask'
-    }
+        'metatask_STR': 'metatask',
+        'metatask_validate': 'metatask_validation',
+        'batch_submission': 'batch'
+    },
+    # All queues are declared with message priorities, every task sent by a metatask (and its callbacks)
+    # inherits the priority of the metatask, so bulk jobs give way to interactive ones on every worker
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True
 })
 
 logger = create_logger('http-server')
@@ -59,7 +72,18 @@ class InputModels(Enum):
     ALPHAFOLD = '2'
     ALPHAFOLD_CONSERVATION_HMM = '3'
 
+class StatusType(Enum):
+    STARTED = 0
+    COMPLETED = 1
+    FAILED = 2
+
+class BatchState(Enum):
+    VALIDATING = 'validating'
+    SUBMITTED = 'submitted'
+    FAILED = 'failed'
+
 TMP_FOLDER = 'tmp/'
+BATCHES_FOLDER = os.path.join(TMP_FOLDER, 'batches')
 
 PDB_FORM_FIELDS = [ 'pdbCode', 'chains', 'useConservation' ]
 CUSTOM_STR_FORM_FIELDS = [ 'chains', 'userInputModel' ]
@@ -68,17 +92,34 @@ SEQUENCE_FORM_FIELDS = [ 'sequence', 'useConservation' ]
 
 
 ID_PROVIDER_URL = os.getenv('ID_PROVIDER_URL')
+ID_PROVIDER_BATCH_URL = os.getenv('ID_PROVIDER_BATCH_URL')
+ID_PROVIDER_MAX_CONNECTIONS = int(os.getenv('ID_PROVIDER_MAX_CONNECTIONS', 32))
 APACHE_URL = os.getenv('APACHE_URL')
 
-PDB_ID_URL = 'https://www.ebi.ac.uk/pdbe/api/pdb/entry/molecules/{}'
-PDB_FILE_URL = 'https://files.rcsb.org/download/{}.pdb'
-
-UNIPROT_ID_URL = 'https://rest.uniprot.org/uniprotkb/{}'
-UNIPROT_FILE_URL = 'https://alphafold.ebi.ac.uk/files/AF-{}-F1-model_v4.pdb'
+# Accept PDB and UniProt inputs after syntactic checks only, the metatask validates and downloads them
+ASYNC_VALIDATION = os.getenv('ASYNC_VALIDATION', 'false').lower() == 'true'
+
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 10000))
+# Total uncompressed size of the structures in a batch archive, archives may be compressed far below the upload limit
+MAX_BATCH_ARCHIVE_MB = int(os.getenv('MAX_BATCH_ARCHIVE_MB', 4096))
+BATCH_VALIDATION_WORKERS = int(os.getenv('BATCH_VALIDATION_WORKERS', 16))
+BATCH_PROGRESS_EVERY = 100
+# Temporary input files of /upload-data are read by the metatask within minutes
+TMP_FILE_TTL = 900
+# bulk metatasks are throttled, their input files must be kept for much longer than the 15 minutes of /upload-data
+BATCH_TMP_TTL = int(os.getenv('BATCH_TMP_TTL', 86400))
+TMP_SWEEP_INTERVAL = 60
+BATCH_DATA_SOURCES = ['ds_foldseek', 'ds_p2rank', 'ds_plank', 'conservation']
+# Message priorities (at most `task_queue_max_priority`) of interactive and bulk metatasks
+INTERACTIVE_PRIORITY = 5
+BATCH_PRIORITY = 1
 
 
 logger = create_logger('http-server')
 
+# connections to id-provider are reused by all requests of the worker
+id_provider_session = create_session(ID_PROVIDER_MAX_CONNECTIONS)
+
 ############################## Private functions ###############################
 
 def _check_form_fields(input_data: dict, form_fields: list) -> ErrorStr | None:
@@ -98,22 +139,6 @@ def _check_form_fields(input_data: dict, form_fields: list) -> ErrorStr | None:
 #         return False
 
 
-def _download_file_from_url(url: str, filename: str) -> bool:
-    logger.info(f'Downloading file from: {url}')
-    try:
-        response = requests.get(url, timeout=(15,30))
-        response.raise_for_status()
-    except requests.RequestException as e:
-        logger.error(f'File download failed {str(e)}')
-        return False
-    
-    logger.info(f'File downloaded successfully')
-    with open(filename, 'w') as file:
-        file.write(response.text)
-    logger.info(f'File saved to: {filename}')
-    return True
-
-
 def _text_is_fasta_format(text: str) -> bool:
     try:
         records = list(SeqIO.parse(StringIO(text), 'fasta'))
@@ -152,64 +177,45 @@ def _try_parse_pdb(pdb_file: str, user_chains: list) -> ErrorStr | None:
     return None
 
 
-def _validate_pdb(input_data: dict) -> ValidationResult: 
+def _validate_pdb(input_data: dict, tmp_folder: str = TMP_FOLDER, defer_remote: bool = False) -> ValidationResult: 
 
     err = _check_form_fields(input_data, PDB_FORM_FIELDS)    
     if err:
         return ValidationResult(err_msg=err)
         
     pdb_id = input_data['pdbCode'].lower()
-    
-    try:
-        url = PDB_ID_URL.format(pdb_id)
-        logger.info(f'Downloading protein metadata from: {url}')
-        response = requests.get(url, timeout=(15,30))
-        response.raise_for_status()
-        response_data = response.json()[pdb_id]
-        logger.info('Protein metadata downloaded successfully')
-                
-        # check chains, empty string means no chain restriction
-        chains_str = input_data['chains']
-        selected_chains = set((chains_str.split(',') if chains_str else []))
 
-        protein_chains = set()
+    # input model setup for p2rank
+    input_data['inputModel'] = 'default'
 
-        for entity in response_data:
-            if entity.get("molecule_type", "").startswith('polypeptide'):
-                protein_chains.update(entity.get("in_chains", []))
-
-        if not (selected_chains <= protein_chains):
-            return ValidationResult(err_msg='Wrong chains selected')
-
-        # try to download download pdb file
-        url = PDB_FILE_URL.format(pdb_id)
-
-        with tempfile.NamedTemporaryFile(
-            mode='w',
-            dir=TMP_FOLDER,
-            prefix=f'{pdb_id}_',
-            suffix='.pdb',
-            delete=False
-        ) as f:
-            tmp_file = os.path.relpath(f.name, os.getcwd())
-
-        if not _download_file_from_url(url, tmp_file):
-            return ValidationResult(
-                err_msg='PDB ID found, but cannot find or download corresponding .pdb file'
-            )
-        
-        # input model setup for p2rank
-        input_data['inputModel'] = 'default'
+    if defer_remote:
+        # the database lookup is done by the metatask, reject only malformed input here
+        err = check_pdb_code(pdb_id) or check_chains(input_data['chains'])
+        if err:
+            return ValidationResult(err_msg=err)
+        input_data['remoteInput'] = 'pdb'
+        return ValidationResult(protein_id=pdb_id)
 
-        return ValidationResult(protein_id=pdb_id, tmp_file=tmp_file)
-    
-    except requests.RequestException as e:
-        return ValidationResult(err_msg=f'PDB ID {pdb_id} not found in database due to an error: {str(e)}')
+    with tempfile.NamedTemporaryFile(
+        mode='w',
+        dir=tmp_folder,
+        prefix=f'{pdb_id}_',
+        suffix='.pdb',
+        delete=False
+    ) as f:
+        tmp_file = os.path.relpath(f.name, os.getcwd())
+
+    try:
+        fetch_pdb(pdb_id, input_data['chains'], tmp_file)
+    except ValidationError as e:
+        return ValidationResult(err_msg=str(e))
     except Exception as e:
         return ValidationResult(err_msg=f'Unknown exception occured: {str(e)}')
 
+    return ValidationResult(protein_id=pdb_id, tmp_file=tmp_file)
+
 
-def _validate_custom_str(input_data: dict, input_file: FileStorage | None) -> ValidationResult:
+def _validate_custom_str(input_data: dict, input_file: FileStorage | None, tmp_folder: str = TMP_FOLDER) -> ValidationResult:
 
     err = _check_form_fields(input_data, CUSTOM_STR_FORM_FIELDS)    
     if err:
@@ -233,7 +239,7 @@ def _validate_custom_str(input_data: dict, input_file: FileStorage | None) -> Va
     # save file to tmp folder
     with tempfile.NamedTemporaryFile(
         mode='wb',
-        dir=TMP_FOLDER,
+        dir=tmp_folder,
         prefix='str_',
         suffix='.pdb',
         delete=False
@@ -252,51 +258,45 @@ def _validate_custom_str(input_data: dict, input_file: FileStorage | None) -> Va
     return ValidationResult(err_msg=err, tmp_file=tmp_file)
 
 
-def _validate_uniprot(input_data: dict) -> ValidationResult:
+def _validate_uniprot(input_data: dict, tmp_folder: str = TMP_FOLDER, defer_remote: bool = False) -> ValidationResult:
     
     err = _check_form_fields(input_data, UNIPROT_FORM_FIELDS)    
     if err:
         return ValidationResult(err_msg=err)
         
     uniprot_id = input_data['uniprotCode'].upper()
-    
+
+    # input model setup for p2rank
+    input_data['inputModel'] = 'alphafold'
+
+    if defer_remote:
+        # the database lookup is done by the metatask, reject only malformed input here
+        err = check_uniprot_code(uniprot_id)
+        if err:
+            return ValidationResult(err_msg=err)
+        input_data['remoteInput'] = 'uniprot'
+        return ValidationResult(protein_id=uniprot_id)
+
+    with tempfile.NamedTemporaryFile(
+        mode='w',
+        dir=tmp_folder,
+        prefix=f'{uniprot_id}_',
+        suffix='.pdb',
+        delete=False
+    ) as f:
+        tmp_file = os.path.relpath(f.name, os.getcwd())
+
     try:
-        # check whether given Uniprot ID exists
-        url = UNIPROT_ID_URL.format(uniprot_id)
-        logger.info(f'Downloading protein metadata from: {url}')
-        response = requests.get(url, timeout=(15,30))
-        response.raise_for_status()
-        logger.info('Protein metadata downloaded successfully')
-        
-        # download pdb file from alphafold database
-        url = UNIPROT_FILE_URL.format(uniprot_id)
-        
-        with tempfile.NamedTemporaryFile(
-            mode='w',
-            dir=TMP_FOLDER,
-            prefix=f'{uniprot_id}_',
-            suffix='.pdb',
-            delete=False
-        ) as f:
-            tmp_file = os.path.relpath(f.name, os.getcwd())
-
-        if not _download_file_from_url(url, tmp_file):
-            return ValidationResult(
-                err_msg='Uniprot ID found, but cannot find or download corresponding .pdb file'
-            )
-
-        # input model setup for p2rank
-        input_data['inputModel'] = 'alphafold'
-
-        return ValidationResult(protein_id=uniprot_id, tmp_file=tmp_file)
-
-    except requests.RequestException as e:
-        return ValidationResult(err_msg=f'Uniprot ID {uniprot_id} not found in database due to an error: {str(e)}')
+        fetch_uniprot(uniprot_id, tmp_file)
+    except ValidationError as e:
+        return ValidationResult(err_msg=str(e))
     except Exception as e:
         return ValidationResult(err_msg=f'Unknown exception occured: {str(e)}')
 
+    return ValidationResult(protein_id=uniprot_id, tmp_file=tmp_file)
 
-def _validate_seq(input_data: dict) -> ValidationResult: 
+
+def _validate_seq(input_data: dict, tmp_folder: str = TMP_FOLDER) -> ValidationResult: 
     
     err = _check_form_fields(input_data, SEQUENCE_FORM_FIELDS)    
     if err:
@@ -319,7 +319,7 @@ def _validate_seq(input_data: dict) -> ValidationResult:
     # save sequence to tmp folder
     with tempfile.NamedTemporaryFile(
         mode='w',
-        dir=TMP_FOLDER,
+        dir=tmp_folder,
         prefix='seq_',
         suffix='.fasta',
         delete=False
@@ -333,16 +333,264 @@ def _validate_seq(input_data: dict) -> ValidationResult:
     return ValidationResult(protein_id=sequence, tmp_file=tmp_file)
 
 
-def _is_input_valid(input_method: str, input_data: dict, input_file: FileStorage | None) -> ValidationResult:
+def _is_input_valid(
+        input_method: str,
+        input_data: dict,
+        input_file: FileStorage | None,
+        tmp_folder: str = TMP_FOLDER,
+        defer_remote: bool = False
+) -> ValidationResult:
     match input_method:
-        case InputMethods.PDB.value: return _validate_pdb(input_data)
-        case InputMethods.CUSTOM_STR.value: return _validate_custom_str(input_data, input_file)
-        case InputMethods.UNIPROT.value: return _validate_uniprot(input_data)
-        case InputMethods.SEQUENCE.value: return _validate_seq(input_data)
+        case InputMethods.PDB.value: return _validate_pdb(input_data, tmp_folder, defer_remote)
+        case InputMethods.CUSTOM_STR.value: return _validate_custom_str(input_data, input_file, tmp_folder)
+        case InputMethods.UNIPROT.value: return _validate_uniprot(input_data, tmp_folder, defer_remote)
+        case InputMethods.SEQUENCE.value: return _validate_seq(input_data, tmp_folder)
         case _: return ValidationResult(err_msg='Unexpected input method')
 
+
+def _create_id_payload(input_method: str, validation_result: ValidationResult) -> dict:
+    return {
+        'input_method': input_method,
+        'input_protein': (
+            validation_result.protein_id.lower() if validation_result.protein_id
+            else None
+        )
+    }
+
+
+def _create_metatask_payload(input_method: str, input_data: dict, validation_result: ValidationResult, id_data: dict) -> dict:
+    # convert useConservation to Python friendly format
+    input_data['useConservation'] = str(input_data['useConservation']).lower() == 'true'
+
+    # change input method to 'STR' or 'SEQ'
+    input_data['inputMethod'] = (
+        'SEQ' if input_method == InputMethods.SEQUENCE.value else 'STR'
+    )
+
+    # tmp_folder is mounted to volume tmp which is shared with apache,
+    # remote inputs (`remoteInput`) are downloaded by the metatask itself
+    input_data['inputUrl'] = (
+        os.path.join(APACHE_URL, validation_result.tmp_file) if validation_result.tmp_file
+        else None
+    )
+
+    # convert keys to snake_case
+    metatask_payload = { decamelize(k):v for k,v in input_data.items() }
+    metatask_payload['id'] = id_data['id']
+    metatask_payload['id_existed'] = id_data['existed']
+    return metatask_payload
+
+
+def _batch_file(batch_id: str) -> FilePath:
+    return os.path.join(BATCHES_FOLDER, f'{batch_id}.json')
+
+
+def _save_batch(batch: dict) -> None:
+    os.makedirs(BATCHES_FOLDER, exist_ok=True)
+    batch_file = _batch_file(batch['batchId'])
+    tmp_file = f'{batch_file}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(batch, f)
+    os.replace(tmp_file, batch_file)
+
+
+def _parse_batch_items(input_data: dict) -> list[tuple[str, dict, None, None]] | ErrorStr:
+    """Converts the JSON body of `/upload-batch` to a list of (input method, form data, file name, file path) items."""
+    use_conservation = str(input_data.get('useConservation', 'false')).lower()
+    items = []
+    for pdb_code in input_data.get('pdbCodes', []):
+        items.append((InputMethods.PDB.value, {'pdbCode': str(pdb_code), 'chains': '', 'useConservation': use_conservation}, None, None))
+    for uniprot_code in input_data.get('uniprotCodes', []):
+        items.append((InputMethods.UNIPROT.value, {'uniprotCode': str(uniprot_code), 'useConservation': use_conservation}, None, None))
+    for item in input_data.get('items', []):
+        if not isinstance(item, dict) or 'inputMethod' not in item:
+            return f'Invalid item {item}, inputMethod not found'
+        if str(item['inputMethod']) == InputMethods.CUSTOM_STR.value:
+            return 'Custom structures must be uploaded in an archive'
+        item = { k: str(v).lower() if isinstance(v, bool) else str(v) for k, v in item.items() }
+        items.append((item.pop('inputMethod'), item, None, None))
+    return items
+
+
+def _extract_batch_archive(
+        archive: FileStorage,
+        input_data: dict,
+        batch_folder: FilePath
+) -> list[tuple[str, dict, str, FilePath]] | ErrorStr:
+    """
+    Streams structures (`.pdb` files) from a tarball uploaded to `/upload-batch` to the batch folder,
+    so the items can be sent to the `batch` worker as (input method, form data, file name, file path) items.
+    The archive may be compressed, the number of structures and their total size are checked before each one is written.
+    """
+    if 'userInputModel' not in input_data:
+        return 'userInputModel not found'
+    items = []
+    total_size = 0
+    try:
+        with tarfile.open(fileobj=archive.stream, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.lower().endswith(('.pdb', '.ent')):
+                    continue
+                if len(items) == MAX_BATCH_SIZE:
+                    return f'Too many proteins in the batch, at most {MAX_BATCH_SIZE} are allowed'
+                total_size += member.size
+                if total_size > MAX_BATCH_ARCHIVE_MB * 1024 * 1024:
+                    return f'Structures in the archive exceed {MAX_BATCH_ARCHIVE_MB} MB'
+                file_path = os.path.join(batch_folder, f'upload_{len(items)}.pdb')
+                with tar.extractfile(member) as source, open(file_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                form = {'chains': input_data.get('chains', ''), 'userInputModel': input_data['userInputModel']}
+                items.append((InputMethods.CUSTOM_STR.value, form, member.name, file_path))
+    except (tarfile.TarError, OSError) as e:
+        return f'Archive cannot be read: {str(e)}'
+    return items
+
+
+def _batch_item_name(input_data: dict, file_name: str | None) -> str:
+    if file_name:
+        return file_name
+    for field in ('pdbCode', 'uniprotCode', 'sequence'):
+        if field in input_data:
+            return input_data[field]
+    return ''
+
+
+def _validate_batch_item(item: tuple, batch_folder: FilePath) -> tuple[str, dict, str, ValidationResult]:
+    input_method, input_data, file_name, file_path = item
+    name = _batch_item_name(input_data, file_name)
+    try:
+        if file_path:
+            with open(file_path, 'rb') as f:
+                input_file = FileStorage(stream=f, filename=file_name)
+                return input_method, input_data, name, _is_input_valid(input_method, input_data, input_file, batch_folder)
+        return input_method, input_data, name, _is_input_valid(input_method, input_data, None, batch_folder)
+    except Exception as e:
+        return input_method, input_data, name, ValidationResult(err_msg=f'Unknown exception occured: {str(e)}')
+
+
+def _process_batch(batch: dict, items: list[tuple[str, dict, str | None, FilePath | None]], batch_folder: FilePath) -> None:
+    """
+    Validates all items of a batch concurrently, allocates their IDs with a single id-provider call
+    and sends the metatasks to the `metatask_bulk` queue with `BATCH_PRIORITY` over one broker connection.
+    Progress is saved to the batch file, which is served by `/batch/<batch_id>`.
+    """
+    batch_id = batch['batchId']
+    valid = []
+    with ThreadPoolExecutor(max_workers=BATCH_VALIDATION_WORKERS) as executor:
+        futures = [executor.submit(_validate_batch_item, item, batch_folder) for item in items]
+        for count, future in enumerate(as_completed(futures), 1):
+            input_method, input_data, name, validation_result = future.result()
+            if validation_result.err_msg:
+                batch['rejected'].append({'input': name, 'error': validation_result.err_msg})
+            else:
+                valid.append((input_method, input_data, name, validation_result))
+            if count % BATCH_PROGRESS_EVERY == 0:
+                batch['validated'] = count
+                _save_batch(batch)
+    batch['validated'] = len(items)
+    logger.info(f'batch {batch_id} validated: {len(valid)} valid, {len(batch["rejected"])} rejected')
+
+    if valid:
+        id_payload = {'items': [_create_id_payload(input_method, result) for input_method, _, _, result in valid]}
+        logger.info(f'batch {batch_id} Sending POST request to id-provider: {ID_PROVIDER_BATCH_URL}, {len(valid)} items')
+        try:
+            response = id_provider_session.post(ID_PROVIDER_BATCH_URL, json=id_payload, timeout=(10,120))
+            response.raise_for_status()
+            ids = response.json()['ids']
+        except Exception as e:
+            logger.error(f'batch {batch_id} Failed to get IDs from id-provider: {str(e)}')
+            batch['state'] = BatchState.FAILED.value
+            batch['error'] = 'Failed to get IDs from id-provider'
+            _save_batch(batch)
+            return
+
+        with celery.producer_or_acquire() as producer:
+            for (input_method, input_data, name, validation_result), id_data in zip(valid, ids):
+                metatask_payload = _create_metatask_payload(input_method, input_data, validation_result, id_data)
+                celery.send_task(
+                    f'metatask_{metatask_payload["input_method"]}',
+                    args=[metatask_payload],
+                    queue='metatask_bulk',
+                    priority=BATCH_PRIORITY,
+                    producer=producer
+                )
+                batch['jobs'].append({
+                    'input': name,
+                    'id': id_data['id'],
+                    'useConservation': metatask_payload['use_conservation']
+                })
+        logger.info(f'batch {batch_id} {len(ids)} metatasks sent')
+
+    batch['state'] = BatchState.SUBMITTED.value
+    _save_batch(batch)
+    # the batch folder is deleted by a later sweep after BATCH_TMP_TTL seconds
+    _sweep_tmp_folder()
+
+
+@celery.task(name='batch_submission')
+def process_batch(batch: dict, items: list[tuple[str, dict, str | None, FilePath | None]], batch_folder: FilePath) -> None:
+    """
+    Celery task of the `batch` worker (see `batch_worker.py`) processing a batch submitted with `/upload-batch`,
+    so the validation of large batches does not run inside the web server.
+    """
+    try:
+        _process_batch(batch, items, batch_folder)
+    except Exception as e:
+        logger.error(f'batch {batch["batchId"]} failed: {str(e)}')
+        batch['state'] = BatchState.FAILED.value
+        batch['error'] = f'Unknown exception occured: {str(e)}'
+        _save_batch(batch)
+
+
+def _read_job_status(job: dict) -> str:
+    data_sources = BATCH_DATA_SOURCES + (['ds_p2rank/conservation'] if job['useConservation'] else [])
+    statuses = []
+    for data_source in data_sources:
+        try:
+            statuses.append(get_storage().read_json(f'{data_source}/{job["id"]}/status.json').get('status'))
+        except StorageError:
+            statuses.append(None)
+
+    if StatusType.FAILED.value in statuses:
+        return 'failed'
+    if all(status == StatusType.COMPLETED.value for status in statuses):
+        return 'completed'
+    if any(status is not None for status in statuses):
+        return 'running'
+    return 'queued'
+
 ############################## Public functions ################################
 
+_last_tmp_sweep = 0.0
+
+
+def _sweep_tmp_folder() -> None:
+    """
+    Removes temporary input files older than `TMP_FILE_TTL` and batch folders older than `BATCH_TMP_TTL`,
+    at most once per `TMP_SWEEP_INTERVAL` in each process.
+    """
+    global _last_tmp_sweep
+    now = time.time()
+    if now - _last_tmp_sweep < TMP_SWEEP_INTERVAL:
+        return
+    _last_tmp_sweep = now
+    try:
+        entries = list(os.scandir(TMP_FOLDER))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            age = now - entry.stat(follow_symlinks=False).st_mtime
+            if entry.is_dir(follow_symlinks=False):
+                # `batches` holds the progress files served by /batch/<batch_id>
+                if entry.name.startswith('batch_') and age > BATCH_TMP_TTL:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            elif age > TMP_FILE_TTL:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # removed by another process
+
+
 @app.route('/upload-data', methods=['POST'])
 def upload_data() -> Response:
     """
@@ -353,6 +601,10 @@ def upload_data() -> Response:
     and sends a task named `metatask_{SEQ|STR}` to a queue for processing. 
     A temporary input file is scheduled for deletion after 15 minutes.
 
+    With `ASYNC_VALIDATION` enabled, PDB and UniProt inputs are only checked syntactically and
+    the ID is returned without any call to the external databases. The metatask validates and
+    downloads the structure, a rejected input is reported in `inputs/{id}/status.json`.
+
     Processing Steps:
         1. Validate input data and download temporary input file.
         2. If valid, request or generate an ID from the ID provider.
@@ -386,7 +638,7 @@ def upload_data() -> Response:
     logger.info(f'userFile exists: {True if input_file else False}')
 
     logger.info('Starting user input validation...')
-    validation_result = _is_input_valid(input_method, input_data, input_file)
+    validation_result = _is_input_valid(input_method, input_data, input_file, defer_remote=ASYNC_VALIDATION)
 
     if validation_result.err_msg:
         logger.info(validation_result.err_msg)
@@ -394,21 +646,11 @@ def upload_data() -> Response:
     
     logger.info('User input validation passed')
 
-    # convert useConservation to Python friendly format
-    use_conservation = input_data['useConservation'].lower() == 'true'
-    input_data['useConservation'] = use_conservation
-
-    id_payload = {
-        'input_method': input_method,
-        'input_protein': (
-            validation_result.protein_id.lower() if validation_result.protein_id
-            else None
-        )
-    }
+    id_payload = _create_id_payload(input_method, validation_result)
 
     logger.info(f'Sending POST request to id-provider: {ID_PROVIDER_URL}, payload:\n {json.dumps(id_payload, indent=2)}')
     try:
-        response = requests.post(ID_PROVIDER_URL, json=id_payload, timeout=(10,20))
+        response = id_provider_session.post(ID_PROVIDER_URL, json=id_payload, timeout=(10,20))
         response.raise_for_status()
     except:
         # should not happen
@@ -419,41 +661,130 @@ def upload_data() -> Response:
 
     logger.info(f'id-provider responded positively, response:\n{json.dumps(response_data, indent=2)}')
 
-    # change input method to 'STR' or 'SEQ'
-    new_input_method = (
-        'SEQ' if input_method == InputMethods.SEQUENCE.value else 'STR'
-    )
-    
-    input_data['inputMethod'] = new_input_method
-    logger.info(f'inputMethod changed from {input_method} to {new_input_method}')
-
-    # tmp_folder is mounted to volume tmp which is shared with apache
-    input_data['inputUrl'] = os.path.join(APACHE_URL, validation_result.tmp_file)
-
-    # convert keys to snake_case
     logger.info('Preparing metatask payload...')
-    metatask_payload = { decamelize(k):v for k,v in input_data.items() }
-    metatask_payload['id'] = response_data['id']
-    metatask_payload['id_existed'] = response_data['existed']
+    metatask_payload = _create_metatask_payload(input_method, input_data, validation_result, response_data)
     logger.info(f'Metatask payload prepared:\n{json.dumps(metatask_payload, indent=2)}')
 
-    metatask_task_name = f'metatask_{metatask_payload["input_method"]}'
+    # remote inputs are validated by their own worker first, it continues with metatask_STR
+    metatask_task_name = (
+        'metatask_validate' if metatask_payload.get('remote_input')
+        else f'metatask_{metatask_payload["input_method"]}'
+    )
     logger.info(f'Sending {metatask_task_name}')
     celery.send_task(
         metatask_task_name,
-        args=[metatask_payload]
+        args=[metatask_payload],
+        priority=INTERACTIVE_PRIORITY
     )
 
-    # Delete validation_result.tmp_file file after 15 minutes
-    delete_cmd = f'sleep 900 && rm -f {validation_result.tmp_file}'
-    logger.info(f'Starting a process which deletes tmp file after 15 minutes: {delete_cmd}')
-    Popen(delete_cmd, shell=True)
-    
+    # validation_result.tmp_file is deleted by a later sweep after TMP_FILE_TTL seconds
+    _sweep_tmp_folder()
+
     logger.info(f'http-server finished, returning ID: {response_data["id"]}')
 
     return jsonify(response_data['id'])
 
 
+@app.route('/upload-batch', methods=['POST'])
+def upload_batch() -> Response:
+    """
+    Handles POST requests to submit many proteins at once (e.g. screening campaigns).
+
+    The request is either a JSON object with `pdbCodes` and/or `uniprotCodes` (lists of IDs,
+    `useConservation` applies to all of them) and/or `items` (objects with the same fields as
+    the `/upload-data` form), or a multipart form with `archive`, a tarball of `.pdb` files,
+    together with `userInputModel` and optionally `chains`.
+
+    The batch is processed in the background by the `batch` worker: the items are validated concurrently,
+    their IDs are allocated with a single id-provider call and the metatasks are sent to the `metatask_bulk`
+    queue with a lower priority than interactive submissions, which all their tasks inherit.
+
+    Returns:
+        Accepted response (202): A JSON object containing:
+            - `batchId` (str): Handle of the batch for `/batch/<batch_id>`.
+            - `total` (int): Number of submitted proteins.
+
+        Error response (400): A JSON object containing:
+            - `error` (str): Description of input errors.
+    """
+
+    logger.info(f'upload-batch POST request received')
+
+    batch_id = uuid.uuid4().hex
+    batch_folder = os.path.join(TMP_FOLDER, f'batch_{batch_id}')
+    os.makedirs(batch_folder, exist_ok=True)
+
+    archive = request.files.get('archive')
+    if archive:
+        items = _extract_batch_archive(archive, request.form.to_dict(), batch_folder)
+    elif request.is_json:
+        items = _parse_batch_items(request.get_json(silent=True) or {})
+    else:
+        items = 'Batch must be a JSON object or a form with an archive'
+
+    if not isinstance(items, str) and not items:
+        items = 'No proteins found in the batch'
+    elif not isinstance(items, str) and len(items) > MAX_BATCH_SIZE:
+        items = f'Too many proteins in the batch ({len(items)}), at most {MAX_BATCH_SIZE} are allowed'
+    if isinstance(items, str):
+        logger.info(items)
+        shutil.rmtree(batch_folder, ignore_errors=True)
+        return jsonify({'error': items}), 400
+
+    batch = {
+        'batchId': batch_id,
+        'state': BatchState.VALIDATING.value,
+        'total': len(items),
+        'validated': 0,
+        'rejected': [],
+        'jobs': []
+    }
+    _save_batch(batch)
+
+    logger.info(f'batch {batch_id} Sending {len(items)} proteins to the batch worker')
+    celery.send_task('batch_submission', args=[batch, items, batch_folder])
+
+    return jsonify({'batchId': batch_id, 'total': len(items)}), 202
+
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id: str) -> Response:
+    """
+    Handles GET requests for aggregate progress of a batch submitted with `/upload-batch`.
+
+    Progress of each job is derived from the status files of its data sources. Use the `details`
+    query parameter to also list the state of every job.
+
+    Returns:
+        Success response (200): A JSON object containing:
+            - `batchId` (str), `state` (str): `validating`, `submitted` or `failed`.
+            - `total`, `validated` (int): Number of submitted and already validated proteins.
+            - `rejected` (list): Proteins which did not pass the validation, with the error.
+            - `progress` (dict): Number of jobs which are `queued`, `running`, `completed` or `failed`.
+            - `jobs` (list): With `details` only, the `input`, `id` and `state` of each job.
+
+        Error response (404): A JSON object containing:
+            - `error` (str): The batch does not exist.
+    """
+
+    if not all(c in '0123456789abcdef' for c in batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    try:
+        with open(_batch_file(batch_id), 'r') as f:
+            batch = json.load(f)
+    except FileNotFoundError:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    jobs = batch.pop('jobs')
+    with ThreadPoolExecutor(max_workers=BATCH_VALIDATION_WORKERS) as executor:
+        states = list(executor.map(_read_job_status, jobs))
+
+    batch['progress'] = {state: states.count(state) for state in ('queued', 'running', 'completed', 'failed')}
+    if request.args.get('details'):
+        batch['jobs'] = [{**job, 'state': state} for job, state in zip(jobs, states)]
+    return jsonify(batch)
+
+
 if __name__ == '__main__':
     os.makedirs(TMP_FOLDER, exist_ok=True)
     logger.info(f'Temporary folder prepared: {TMP_FOLDER}')
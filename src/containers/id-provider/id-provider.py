@@ -35,6 +35,29 @@ logger = create_logger('id-provider')
 def _check(key):
     return redis_client.get(key)
 
+
+def _create_key(input_method, input_protein):
+    return (
+        f'{input_method}:{input_protein}'
+        if input_method != InputMethods.CUSTOM_STR.value
+        else f'{input_method}:{str(time())[-6]}'
+    )
+
+
+def _create_id(input_method, input_protein, counter):
+    return (
+        f'{InputMethods(input_method).name.lower()}_{input_protein}'
+        if input_method in (InputMethods.PDB.value, InputMethods.UNIPROT.value)
+        else f'{InputMethods(input_method).name.lower()}_{hex(counter)[2:]}'
+    )
+
+
+def _is_valid_request(input_method, input_protein):
+    return (
+        input_method in [m.value for m in InputMethods] and
+        (input_protein is not None or input_method == InputMethods.CUSTOM_STR.value)
+    )
+
 ############################### Public functions ###############################
 
 @app.route('/generate', methods=['POST'])
@@ -69,11 +92,7 @@ def get_or_generate():
         logger.info('Wrong input from a user, status code 400')
         return jsonify({"error": "input type or input string is missing"}), 400
 
-    key = (
-        f'{input_method}:{input_protein}'
-        if input_method != InputMethods.CUSTOM_STR.value
-        else f'{input_method}:{str(time())[-6]}'
-    )
+    key = _create_key(input_method, input_protein)
     logger.info(f'Key created: {key}')
         
     existing_id = _check(key)
@@ -83,9 +102,9 @@ def get_or_generate():
         return jsonify({"id": existing_id.decode(), "stored_value": key, "existed" : True}) 
 
     generated_id = (
-        f'{InputMethods(input_method).name.lower()}_{input_protein}'
+        _create_id(input_method, input_protein, None)
         if input_method in (InputMethods.PDB.value, InputMethods.UNIPROT.value)
-        else f'{InputMethods(input_method).name.lower()}_{hex(redis_client.incr("id_counter"))[2:]}'
+        else _create_id(input_method, input_protein, redis_client.incr("id_counter"))
     )
     logger.info(f'{key} New ID generated: {generated_id}')
 
@@ -97,6 +116,70 @@ def get_or_generate():
     return jsonify({"id": generated_id, "stored_value": key, "existed" : False})
 
 
+@app.route('/generate-batch', methods=['POST'])
+def get_or_generate_batch():
+    """
+    Handles POST requests to generate or retrieve IDs for many proteins at once (bulk submissions).
+
+    This endpoint expects a JSON payload with `items`, a list of objects with `input_method` and `input_protein`,
+    and works the same as `/generate` for each of them. All keys are looked up with a single `MGET`,
+    the counter is incremented once for all new custom structures and sequences, and new pairs
+    are stored in one pipeline, so the cost does not grow with round trips to the database.
+
+    Returns:
+        Success response (200): A JSON object containing:
+            - `ids` (list): For each item (in the same order), an object with `id`, `stored_value` and `existed`.
+
+        Error response (400): A JSON object containing:
+            - `error` (str): A description of the issue with the request.
+    """
+
+    items = (request.json or {}).get('items')
+    logger.info(f'generate-batch POST request received: {len(items) if isinstance(items, list) else None} items')
+
+    if not isinstance(items, list) or not items:
+        logger.info('Wrong input from a user, status code 400')
+        return jsonify({"error": "items are missing"}), 400
+
+    for item in items:
+        if not isinstance(item, dict) or not _is_valid_request(item.get('input_method'), item.get('input_protein')):
+            logger.info(f'Wrong item {item}, status code 400')
+            return jsonify({"error": f"input type or input string is missing in item {item}"}), 400
+
+    keys = [_create_key(item['input_method'], item['input_protein']) for item in items]
+    existing_ids = redis_client.mget(keys)
+
+    new_indices = [i for i, existing_id in enumerate(existing_ids) if not existing_id]
+    counted = [
+        i for i in new_indices
+        if items[i]['input_method'] not in (InputMethods.PDB.value, InputMethods.UNIPROT.value)
+    ]
+    last_counter = redis_client.incrby("id_counter", len(counted)) if counted else 0
+    counters = dict(zip(counted, range(last_counter - len(counted) + 1, last_counter + 1)))
+
+    results = []
+    generated = {}
+    pipeline = redis_client.pipeline()
+    for i, (item, key, existing_id) in enumerate(zip(items, keys, existing_ids)):
+        if existing_id:
+            results.append({"id": existing_id.decode(), "stored_value": key, "existed": True})
+            continue
+        if key in generated:
+            # same protein submitted twice in one batch
+            results.append({"id": generated[key], "stored_value": key, "existed": True})
+            continue
+
+        generated_id = _create_id(item['input_method'], item['input_protein'], counters.get(i))
+        if item['input_method'] != InputMethods.CUSTOM_STR.value:
+            pipeline.set(key, generated_id)
+            generated[key] = generated_id
+        results.append({"id": generated_id, "stored_value": key, "existed": False})
+    pipeline.execute()
+
+    logger.info(f'{len(new_indices)} of {len(items)} IDs generated, returning IDs')
+    return jsonify({"ids": results})
+
+
 @app.route('/get-id', methods=['GET'])
 def get_id():
     """
@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
+import fcntl
+import glob
 import json
 import os
 import time
+import uuid
+from datetime import datetime, timezone
 from enum import Enum
 
-import requests
 from celery import Celery
+from celery.canvas import Signature
 from celery.result import AsyncResult
+from Bio.PDB import PDBParser
 
 from tasks_logger import create_logger
+from chain_sequences import extract_chain_sequences
+from storage import get_storage, input_path, StorageError
+from remote_validation import ValidationError, fetch_pdb, fetch_uniprot
+from transfer import download, TransferError
 
 ################################ Celery setup ##################################
 
@@ -25,14 +34,40 @@ celery.conf.update({
         'ds_plank': 'ds_plank',
         'conservation': 'conservation',
         'converter_seq_to_str': 'converter',
-        'converter_str_to_seq': 'converter'
-    }
+        'converter_str_to_seq': 'converter',
+        'metatask_STR': 'metatask',
+        'metatask_converted': 'metatask',
+        'metatask_stage_done': 'metatask',
+        'metatask_timeline': 'metatask'
+    },
+    # Queues are declared with message priorities (see http-server), tasks sent by a metatask inherit its priority
+    'task_queue_max_priority': 10,
+    'task_inherit_parent_priority': True
 })
 
+# Set for the metatask_bulk worker only, bulk submissions are admitted slower than interactive ones
+if os.getenv('METATASK_RATE_LIMIT'):
+    celery.conf.task_annotations = {
+        'metatask_SEQ': {'rate_limit': os.getenv('METATASK_RATE_LIMIT')},
+        'metatask_STR': {'rate_limit': os.getenv('METATASK_RATE_LIMIT')}
+    }
+
 ################################## Constants ###################################
 
-APACHE_URL = os.getenv('APACHE_URL')
 INPUTS_FOLDER = 'inputs/'
+# Join state of running pipelines, kept out of the (publicly served) inputs
+PIPELINE_FOLDER = os.getenv('METATASK_PIPELINE_DIR', 'pipeline/')
+PIPELINE_MAX_AGE = 7 * 24 * 3600
+PIPELINE_PRUNE_INTERVAL = 3600
+TIMELINE_FILE = 'timeline.json'
+STATUS_FILE = 'status.json'
+MAPPING_FILE = 'mapping.json'
+P2RANK_MODELS = {
+    ('default', False): 'default',
+    ('default', True): 'conservation_hmm', 
+    ('alphafold', False): 'alphafold',  
+    ('alphafold', True): 'alphafold_conservation_hmm'  
+}
 
 class StatusType(Enum):
     STARTED = 0
@@ -40,25 +75,31 @@ class StatusType(Enum):
     FAILED = 2
 
 logger = create_logger('metatask')
+_last_prune = 0.0
 
 ############################## Private functions ###############################
 
 def _download_file_from_url(id: str, url: str, filename: str) -> bool:
     logger.info(f'{id} Downloading file from: {url}')
     try:
-        response = requests.get(url, timeout=(10,20))
-        response.raise_for_status()
-    except requests.RequestException as e:
+        result = download(url, filename, timeout=(10,20))
+    except TransferError as e:
         logger.error(f'{id} File download failed {str(e)}')
         return False
     
-    logger.info(f'{id} File downloaded successfully')
-    with open(filename, 'w') as file:
-        file.write(response.text)
+    logger.info(f'{id} File downloaded successfully ({result.size} bytes in {result.seconds:.2f} s)')
     logger.info(f'{id} File saved to: {filename}')
     return True
 
 
+def _publish_input(id: str, filename: str) -> None:
+    # no-op unless the inputs are read from the object store
+    try:
+        get_storage().publish(input_path(id, filename), os.path.join(INPUTS_FOLDER, id, filename))
+    except StorageError as e:
+        logger.error(f'{id} {filename} could not be published: {str(e)}')
+
+
 def  _prepare_seq_input(id: str, url: str) -> bool:
 
     input_folder = os.path.join(INPUTS_FOLDER, id)
@@ -73,6 +114,7 @@ def  _prepare_seq_input(id: str, url: str) -> bool:
         if not _download_file_from_url(id, url, fasta_file):
             logger.error(f'{id} {fasta_file} cannot be prepared properly')
             return False
+        _publish_input(id, 'sequence_1.fasta')
     
     logger.info(f'{id} {fasta_file} prepared')
 
@@ -95,6 +137,7 @@ def  _prepare_seq_input(id: str, url: str) -> bool:
                 json_file,
                 indent=4
             )
+        _publish_input(id, 'chains.json')
     logger.info(f'{id} {chain_json} prepared')
     return True
 
@@ -112,6 +155,46 @@ def _prepare_str_input(id: str, url: str) -> bool:
         if not _download_file_from_url(id, url, pdb_file):
             logger.error(f'{id} {pdb_file} cannot be prepared properly')
             return False
+        _publish_input(id, 'structure.pdb')
+    logger.info(f'{id} {pdb_file} prepared')
+    return True
+
+
+def _update_input_status(id: str, status: StatusType, infoMessage: str = '', errorMessage: str = '') -> None:
+    status_file = os.path.join(INPUTS_FOLDER, id, STATUS_FILE)
+    logger.info(f'{id} Changing status in {status_file} to: {status.name}')
+    with open(status_file, 'w') as f:
+        json.dump({'status': status.value, 'infoMessage': infoMessage, 'errorMessage': errorMessage}, f)
+    _publish_input(id, STATUS_FILE)
+
+
+def _prepare_remote_input(id: str, input_data: dict) -> bool:
+    """
+    Validation stage of inputs accepted by http-server with `ASYNC_VALIDATION`: checks the PDB / UniProt
+    entry in its database and downloads the structure. A rejected input is reported in `inputs/{id}/status.json`.
+    """
+    input_folder = os.path.join(INPUTS_FOLDER, id)
+    os.makedirs(input_folder, exist_ok=True)
+    logger.info(f'{id} Input folder prepared: {input_folder}')
+
+    pdb_file = os.path.join(input_folder, 'structure.pdb')
+    if os.path.exists(pdb_file):
+        logger.info(f'{id} {pdb_file} prepared')
+        return True
+
+    _update_input_status(id, StatusType.STARTED, infoMessage='Validating input')
+    try:
+        if input_data['remote_input'] == 'pdb':
+            fetch_pdb(input_data['pdb_code'], input_data.get('chains', ''), pdb_file)
+        else:
+            fetch_uniprot(input_data['uniprot_code'], pdb_file)
+    except ValidationError as e:
+        logger.warning(f'{id} Input rejected: {str(e)}')
+        _update_input_status(id, StatusType.FAILED, errorMessage=str(e))
+        return False
+
+    _publish_input(id, 'structure.pdb')
+    _update_input_status(id, StatusType.COMPLETED, infoMessage='Input validated')
     logger.info(f'{id} {pdb_file} prepared')
     return True
 
@@ -137,6 +220,7 @@ def _save_converter_str_result(id: str, result: str) -> None:
     converter_result_file = os.path.join(INPUTS_FOLDER, id, 'structure.pdb') 
     with open(converter_result_file, 'w') as file:
         file.write(result)
+    _publish_input(id, 'structure.pdb')
     logger.info(f'{id} Structure from converter stored to: {converter_result_file}')
 
 
@@ -159,6 +243,7 @@ def _save_converter_seq_result(id: str, result: dict) -> None:
         file_path = os.path.join(INPUTS_FOLDER, id, f'{filename}')
         with open(file_path, 'w') as file:
             file.write(f'> Chains: {chain_list}\n{sequence}')
+        _publish_input(id, filename)
         logger.info(f'{id} Sequence for chains {str(chain_list)} stored in: {file_path}')
 
         # create mapping filename<->chain_list
@@ -178,21 +263,21 @@ def _save_converter_seq_result(id: str, result: dict) -> None:
             json_file,
             indent=4
         )
+    # published last, readers start from chains.json
+    _publish_input(id, 'chains.json')
     logger.info(f'{id} Mapping between files and chains stored in: {chains_file}')
 
 
 def _is_task_running_or_completed(id: str, output_folder: str) -> bool:
     
     try:
-        status_url = os.path.join(output_folder, 'status.json')
-        logger.info(f'{id} Getting status file from: {status_url}')
-        response = requests.get(status_url, timeout=(10,20))
-        response.raise_for_status()
-        task_status = response.json().get('status')
+        status_file = os.path.join(output_folder, 'status.json')
+        logger.info(f'{id} Getting status file: {status_file}')
+        task_status = get_storage().read_json(status_file).get('status')
         logger.info(f'{id} Status: {task_status}')
         return (task_status == StatusType.STARTED.value or
                 task_status == StatusType.COMPLETED.value)
-    except requests.RequestException as e:
+    except StorageError as e:
         logger.warning(f'{id} Could not get status: {str(e)}')
         return False
 
@@ -202,18 +287,29 @@ def _run_task(
         id: str,
         id_existed: bool,
         output_folder: str | None = None,
-        task_args: dict | None = None
+        task_args: dict | None = None,
+        link: Signature | None = None,
+        run_id: str | None = None,
+        stage: str | None = None
 ) -> AsyncResult | None:
     
     if not output_folder:
-        output_folder = os.path.join(APACHE_URL, task_name, id)
+        output_folder = os.path.join(task_name, id)
     
     if not id_existed or not _is_task_running_or_completed(id, output_folder):
         task_args = [id, task_args] if task_args else [id]
+        links = [link] if link else []
+        if run_id:
+            stage = stage or task_name
+            _record_timeline(id, run_id, stage, 'sent')
+            links.append(_callback('metatask_timeline', id, run_id, stage, 'finished'))
         logger.info(f'{id} Sending {task_name} (args: {str(task_args)})')
         task = celery.send_task(
             task_name,
             args=task_args,
+            # dependents run whether the task succeeds or fails, same as when waiting for it
+            link=links or None,
+            link_error=links or None,
         )
 
         return task
@@ -221,53 +317,240 @@ def _run_task(
     return None
 
 
-def _run_foldseek(id: str, id_existed: bool) -> None:
+def _run_foldseek(id: str, id_existed: bool, run_id: str | None = None) -> None:
     _run_task(
         task_name='ds_foldseek',
         id=id,
         id_existed=id_existed,
+        run_id=run_id,
     )
 
 
-def _run_p2rank(id: str, id_existed: bool, input_model: str, use_conservation: bool) -> None:
+def _run_p2rank(id: str, id_existed: bool, input_model: str, use_conservation: bool, run_id: str | None = None) -> None:
     
-    output_folder = os.path.join(APACHE_URL, 'ds_p2rank', id)
+    output_folder = os.path.join('ds_p2rank', id)
     if use_conservation:
         output_folder = os.path.join(output_folder, 'conservation')
 
-    p2rank_models = {
-        ('default', False): 'default',
-        ('default', True): 'conservation_hmm', 
-        ('alphafold', False): 'alphafold',  
-        ('alphafold', True): 'alphafold_conservation_hmm'  
-    }
-    
-
     _run_task(
         task_name='ds_p2rank',
         id=id,
         id_existed=id_existed,
         output_folder=output_folder,
         task_args={
-            'input_model': p2rank_models[(input_model, use_conservation)],
+            'input_model': P2RANK_MODELS[(input_model, use_conservation)],
             'use_conservation': use_conservation
-        }
+        },
+        run_id=run_id,
+        stage='ds_p2rank_conservation' if use_conservation else 'ds_p2rank'
     )
 
 
-def _run_plank(id: str, id_existed: bool) -> None:
+def _run_p2rank_combined(id: str, id_existed: bool, input_model: str, run_id: str | None = None) -> None:
+    """
+    Runs both P2Rank variants (without and with conservation) in one `ds_p2rank` task,
+    which shares the input structure and the warm P2Rank between them. Conservation must be finished.
+    """
+    output_folder = os.path.join('ds_p2rank', id)
+    if id_existed and (_is_task_running_or_completed(id, output_folder) or
+                       _is_task_running_or_completed(id, os.path.join(output_folder, 'conservation'))):
+        # at least one variant exists already, run the missing one alone
+        _run_p2rank(id, id_existed, input_model=input_model, use_conservation=False, run_id=run_id)
+        _run_p2rank(id, id_existed, input_model=input_model, use_conservation=True, run_id=run_id)
+        return
+
+    _run_task(
+        task_name='ds_p2rank',
+        id=id,
+        id_existed=False,
+        output_folder=output_folder,
+        task_args={
+            'input_model': P2RANK_MODELS[(input_model, False)],
+            'use_conservation': False,
+            'conservation_model': P2RANK_MODELS[(input_model, True)]
+        },
+        run_id=run_id,
+        stage='ds_p2rank_combined'
+    )
+
+
+def _run_plank(id: str, id_existed: bool, run_id: str | None = None) -> None:
     _run_task(
         task_name='ds_plank',
         id=id,
         id_existed=id_existed,
+        run_id=run_id,
     )
 
 
-def _run_conservation(id: str, id_existed: bool) -> AsyncResult | None:
+def _run_conservation(id: str, id_existed: bool, link: Signature | None = None, run_id: str | None = None) -> AsyncResult | None:
     return _run_task(
         task_name='conservation',
         id=id,
         id_existed=id_existed,
+        link=link,
+        run_id=run_id,
+    )
+
+
+def _callback(task_name: str, *args) -> Signature:
+    """
+    Signature of a metatask callback fired by another worker once a task finishes. The queue is set explicitly,
+    the worker sending the callback does not know metatask routes. Immutable signatures ignore the finished task result.
+    """
+    return celery.signature(task_name, args=args, queue=_metatask_queue(), immutable=True)
+
+
+def _metatask_queue() -> str:
+    """
+    Queue the running metatask was delivered from (`metatask` or `metatask_bulk`). Callbacks of a run are sent
+    to the same queue, so the callbacks of bulk submissions do not take the slots of interactive ones.
+    """
+    task = celery.current_task
+    delivery_info = (task.request.delivery_info or {}) if task else {}
+    return delivery_info.get('routing_key') or 'metatask'
+
+
+def _stage_marker(id: str, run_id: str, stage: str) -> str:
+    return os.path.join(PIPELINE_FOLDER, f'{id}.{run_id}.{stage}')
+
+
+def _prune_stage_markers() -> None:
+    """
+    Removes stage markers of runs older than `PIPELINE_MAX_AGE`, at most once per `PIPELINE_PRUNE_INTERVAL`.
+    Markers are not removed when a run finishes, a late callback of the run would claim its action again.
+    """
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < PIPELINE_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    for marker in glob.glob(os.path.join(PIPELINE_FOLDER, '*')):
+        try:
+            if now - os.path.getmtime(marker) > PIPELINE_MAX_AGE:
+                os.remove(marker)
+        except FileNotFoundError:
+            # removed by another worker
+            pass
+
+
+def _mark_stage_done(id: str, run_id: str, stage: str) -> None:
+    marker = _stage_marker(id, run_id, stage)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, 'a').close()
+    logger.info(f'{id} Pipeline stage {stage} done')
+
+
+def _is_stage_done(id: str, run_id: str, stage: str) -> bool:
+    return os.path.exists(_stage_marker(id, run_id, stage))
+
+
+def _claim(id: str, run_id: str, action: str) -> bool:
+    """Returns True only for the first caller, so an action joining several stages fires exactly once."""
+    marker = _stage_marker(id, run_id, action)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    try:
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _record_timeline(id: str, run_id: str, stage: str, event: str) -> None:
+    """
+    Appends a stage event (e.g. `conservation` `sent`/`finished`) of a metatask run to `inputs/{id}/timeline.json`,
+    so the critical path of each job can be measured. Callbacks of parallel tasks may write at the same time, the file is locked.
+    """
+    timeline_file = os.path.join(INPUTS_FOLDER, id, TIMELINE_FILE)
+    now = time.time()
+    try:
+        with open(timeline_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read()
+            timeline = json.loads(content) if content else {}
+            events = timeline.setdefault(run_id, [])
+            started = events[0]['timestamp'] if events else now
+            events.append({
+                'stage': stage,
+                'event': event,
+                'time': datetime.fromtimestamp(now, tz=timezone.utc).isoformat(),
+                'timestamp': now,
+                'elapsed': round(now - started, 3)
+            })
+            f.seek(0)
+            f.truncate()
+            json.dump(timeline, f, indent=4)
+    except (OSError, ValueError) as e:
+        logger.warning(f'{id} Timeline could not be updated: {str(e)}')
+
+
+def _extract_sequences(id: str) -> dict | None:
+    """
+    Extracts chain sequences from the input structure directly in metatask, which is much faster than
+    a round trip through the converter and lets conservation start right away. Returns None on failure.
+    """
+    pdb_file = os.path.join(INPUTS_FOLDER, id, 'structure.pdb')
+    try:
+        pdb = PDBParser(QUIET=True).get_structure(id, pdb_file)
+        result = extract_chain_sequences(pdb, MAPPING_FILE, logger)
+    except Exception as e:
+        logger.warning(f'{id} Sequences could not be extracted locally, using converter: {str(e)}')
+        return None
+    return result if result['chains'] else None
+
+
+def _run_seq_structure_dependents(input_data: dict, run_id: str) -> None:
+    # converter -> {foldseek, p2rank}
+    id = input_data['id']
+    id_existed = bool(input_data['id_existed'])
+    p2rank_model = input_data['input_model']
+
+    _run_foldseek(id, id_existed, run_id)
+
+    if _is_stage_done(id, run_id, 'conservation') and _claim(id, run_id, 'p2rank_conservation'):
+        # conservation finished while the structure was predicted, both P2Rank variants can run together
+        _run_p2rank_combined(id, id_existed, input_model=p2rank_model, run_id=run_id)
+    else:
+        _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=False, run_id=run_id)
+
+    _seq_stage_done(input_data, run_id, 'structure')
+
+
+def _seq_stage_done(input_data: dict, run_id: str, stage: str) -> None:
+    # {converter, conservation} -> p2rank with conservation
+    id = input_data['id']
+    _mark_stage_done(id, run_id, stage)
+    if (_is_stage_done(id, run_id, 'structure') and _is_stage_done(id, run_id, 'conservation')
+            and _claim(id, run_id, 'p2rank_conservation')):
+        _run_p2rank(id, bool(input_data['id_existed']), input_model=input_data['input_model'], use_conservation=True, run_id=run_id)
+        logger.info(f'{id} metatask_SEQ finished')
+
+
+def _run_str_sequence_dependents(input_data: dict, run_id: str) -> None:
+    # sequences -> {conservation, plank}, conservation -> p2rank with conservation
+    id = input_data['id']
+    id_existed = bool(input_data['id_existed'])
+    p2rank_model = input_data['input_model']
+
+    # conservation is on the critical path, it is started first
+    p2rank_conservation = _p2rank_signature(id, p2rank_model, use_conservation=True)
+    p2rank_conservation.link(_callback('metatask_timeline', id, run_id, 'ds_p2rank_conservation', 'finished'))
+    if not _run_conservation(id, id_existed, link=p2rank_conservation, run_id=run_id):
+        _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=True, run_id=run_id)
+
+    _run_plank(id, id_existed, run_id)
+
+
+def _p2rank_signature(id: str, input_model: str, use_conservation: bool) -> Signature:
+    return celery.signature(
+        'ds_p2rank',
+        args=[id, {
+            'input_model': P2RANK_MODELS[(input_model, use_conservation)],
+            'use_conservation': use_conservation
+        }],
+        queue='ds_p2rank',
+        immutable=True
     )
 
 ############################### Public functions ###############################
@@ -279,18 +562,20 @@ def metatask_seq(input_data: dict) -> None:
 
     This task orchestrates computing results for a protein sequence by running a series
     of follow-up tasks. Each step is executed only if the corresponding results do not already exist.
+    The task never waits for other tasks, dependent steps are started by callbacks
+    (`metatask_converted`, `metatask_stage_done`) as soon as the tasks they depend on finish.
 
     Processing Steps:
         1. Download and prepare the input sequence file.
         2. Run `ds_plank` task.
         3. Run `conservation` task.
-        4. If the input is new or missing structure files:
-            a. Send task `converter_seq_to_str` to convert sequence to structure.
-            b. Wait for the result and store it.
-        5. Run `ds_foldseek` for structure alignment.
+        4. If the input is new or missing structure files, send task `converter_seq_to_str`
+           to convert sequence to structure, its result is stored by `metatask_converted`.
+        5. Run `ds_foldseek` for structure alignment (after the converter).
         6. Run `ds_p2rank` twice:
-            - Without conservation scores.
-            - With conservation scores (after conservation task completes).
+            - Without conservation scores (after the converter).
+            - With conservation scores (after both the converter and conservation task complete).
+           If conservation is already finished, both variants run in one combined `ds_p2rank` task.
 
     Args:
         input_data (dict): A dictionary containing:
@@ -305,9 +590,11 @@ def metatask_seq(input_data: dict) -> None:
     
     id           = input_data['id']
     id_existed   = bool(input_data['id_existed'])
-    p2rank_model = input_data['input_model']
+    run_id       = metatask_seq.request.id or uuid.uuid4().hex
 
     logger.info(f'{id} metatask_SEQ started')
+    _record_timeline(id, run_id, 'metatask_SEQ', 'started')
+    _prune_stage_markers()
     
     # prepare input
     if not _prepare_seq_input(id, input_data['input_url']):
@@ -315,45 +602,24 @@ def metatask_seq(input_data: dict) -> None:
         logger.critical(f'{id} Input sequence could not be prepared, all tasks are skipped')
         return
 
-    _run_plank(id, id_existed)
+    conservation_done = _callback('metatask_stage_done', input_data, run_id, 'conservation')
+    if not _run_conservation(id, id_existed, link=conservation_done, run_id=run_id):
+        _seq_stage_done(input_data, run_id, 'conservation')
 
-    conservation = _run_conservation(id, id_existed)
+    _run_plank(id, id_existed, run_id)
     
     if not id_existed or not _inputs_exist(id):
         logger.info(f'{id} Sending converter_seq_to_str')
-        converter = celery.send_task(
+        _record_timeline(id, run_id, 'converter_seq_to_str', 'sent')
+        celery.send_task(
             'converter_seq_to_str',
             args=[id],
+            link=celery.signature('metatask_converted', args=(input_data, run_id), queue=_metatask_queue()),
+            link_error=_callback('metatask_converted', None, input_data, run_id),
         )
+        return
 
-        # wait for converter
-        logger.info(f'{id} Waiting for converter result...')
-        while not converter.ready():
-            time.sleep(0.1)
-
-        converter_result = converter.result
-        logger.info(f'{id} Converter result received')
-
-        if not converter_result:
-            logger.warning(f'{id} Converter returned None')
-        else:
-            # store results
-            _save_converter_str_result(id, converter_result)
-
-    _run_foldseek(id, id_existed)
-
-    _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=False)
-
-    if conservation:
-        logger.info(f'{id} Waiting for conservation worker to finish...')
-        while not conservation.ready():
-            time.sleep(5)
-        
-        logger.info(f'{id} Conservation worker finished')
-
-    _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=True)
-
-    logger.info(f'{id} metatask_SEQ finished')
+    _run_seq_structure_dependents(input_data, run_id)
 
 
 @celery.task(name='metatask_STR')
@@ -363,25 +629,30 @@ def metatask_str(input_data: dict) -> None:
 
     This task orchestrates computing results for a protein structure by running a sequence
     of follow-up tasks. Each step is executed only if the corresponding results do not already exist.
+    The task never waits for other tasks, dependent steps are started by callbacks as soon as
+    the tasks they depend on finish.
 
     Processing Steps:
-        1. Download and prepare the input structure file.
-        2. Run `ds_foldseek` for structure alignment.
-        3. Run `ds_p2rank` without conservation scores.
-        4. If the input is new or missing sequence files:
-            a. Send the `converter_str_to_seq` task to convert the structure to sequence.
-            b. Wait for the result and store it.
+        1. Download and prepare the input structure file. Inputs with `remote_input` (`pdb` / `uniprot`)
+           are validated against their database by `metatask_validate` before.
+        2. If the input is new or missing sequence files, extract chain sequences from the structure
+           directly (`converter_str_to_seq` is used as a fallback, its result is stored by `metatask_converted`).
+        3. Start the `conservation` task first, it is on the critical path of the job.
+        4. Run `ds_p2rank` with conservation scores, linked to the conservation task.
         5. Run the `ds_plank` task.
-        6. Start the `conservation` task.
-        7. Wait for the conservation task to complete.
-        8. Run `ds_p2rank` with conservation scores.
+        6. Run `ds_foldseek` for structure alignment.
+        7. Run `ds_p2rank` without conservation scores.
+
+    Sent and finished events of all stages are recorded in `inputs/{id}/timeline.json`.
 
     Args:
         input_data (dict): A dictionary containing:
             - `id` (str): Unique identifier for this input.
             - `id_existed` (bool): Indicates whether the input was previously processed.
             - `input_model` (str): The P2Rank model to use for predictions.
-            - `input_url` (str): URL pointing to the structure file to be processed.
+            - `input_url` (str | None): URL pointing to the structure file to be processed.
+            - `remote_input` (str, optional): `pdb` or `uniprot` when the input was not validated yet,
+              the structure is then downloaded using `pdb_code` and `chains` / `uniprot_code`.
 
     Returns:
         None
@@ -391,51 +662,115 @@ def metatask_str(input_data: dict) -> None:
     id           = input_data['id']
     id_existed   = bool(input_data['id_existed'])
     p2rank_model = input_data['input_model']
+    run_id       = metatask_str.request.id or uuid.uuid4().hex
 
     logger.info(f'{id} metatask_STR started')
+    _record_timeline(id, run_id, 'metatask_STR', 'started')
 
     # prepare input
-    if not _prepare_str_input(id, input_data['input_url']):
+    if input_data.get('remote_input'):
+        # validated by metatask_validate, the structure is prepared already
+        if not _prepare_remote_input(id, input_data):
+            logger.info(f'{id} Input structure rejected, all tasks are skipped')
+            return
+    elif not _prepare_str_input(id, input_data['input_url']):
         # should not happen, downloading form apache container
         logger.critical(f'{id} Input structure could not be prepared, all tasks are skipped')
         return
+
+    sequences_ready = id_existed and _inputs_exist(id)
+    if not sequences_ready:
+        result = _extract_sequences(id)
+        if result:
+            _save_converter_seq_result(id, result)
+            _record_timeline(id, run_id, 'sequences', 'finished')
+            sequences_ready = True
+
+    if sequences_ready:
+        # conservation runs in parallel with foldseek and p2rank
+        _run_str_sequence_dependents(input_data, run_id)
     
-    _run_foldseek(id, id_existed)
+    _run_foldseek(id, id_existed, run_id)
 
-    _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=False)
+    _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=False, run_id=run_id)
 
-    if not id_existed or not _inputs_exist(id):
+    if not sequences_ready:
         logger.info(f'{id} Sending converter_str_to_seq')
-        converter = celery.send_task(
+        _record_timeline(id, run_id, 'converter_str_to_seq', 'sent')
+        celery.send_task(
             'converter_str_to_seq',
             args=[id],
+            link=celery.signature('metatask_converted', args=(input_data, run_id), queue=_metatask_queue()),
+            link_error=_callback('metatask_converted', None, input_data, run_id),
         )
+        return
 
-        # wait for converter
-        logger.info(f'{id} Waiting for converter result...')
-        while not converter.ready():
-            time.sleep(0.1)
+    logger.info(f'{id} metatask_STR finished')
 
-        converter_result = converter.result
-        logger.info(f'{id} Converter result received')
 
-        if not converter_result:
-            logger.warning(f'{id} Converter returned None')
-        else:
-            # store results
-            _save_converter_seq_result(id, converter_result)
+@celery.task(name='metatask_validate')
+def metatask_validate(input_data: dict) -> None:
+    """
+    Celery task validating inputs accepted by http-server with `ASYNC_VALIDATION` (see `_prepare_remote_input`).
+    It runs on the `metatask_validation` queue, so the calls to the PDB / UniProt databases do not hold
+    the metatask slots, and the validated input continues with `metatask_STR`.
 
-    _run_plank(id, id_existed)
-    
-    conservation = _run_conservation(id, id_existed)
+    Args:
+        input_data (dict): Input data of `metatask_STR` with `remote_input`.
+    """
+    id = input_data['id']
+    if not _prepare_remote_input(id, input_data):
+        logger.info(f'{id} Input structure rejected, all tasks are skipped')
+        return
 
-    if conservation:
-        logger.info(f'{id} Waiting for conservation worker to finish...')
-        while not conservation.ready():
-            time.sleep(5)
-        
-        logger.info(f'{id} Conservation worker finished')
-    
-    _run_p2rank(id, id_existed, input_model=p2rank_model, use_conservation=True)
+    logger.info(f'{id} Sending metatask_STR')
+    celery.send_task('metatask_STR', args=[input_data])
 
-    logger.info(f'{id} metatask_STR finished')
+
+@celery.task(name='metatask_converted')
+def metatask_converted(converter_result, input_data: dict, run_id: str) -> None:
+    """
+    Callback of `converter_seq_to_str` / `converter_str_to_seq`. Stores the converter result
+    and starts the tasks which depend on it.
+
+    Args:
+        converter_result (str | dict | None): Result of the converter, None if the converter failed.
+        input_data (dict): Input data of the metatask, see `metatask_seq` and `metatask_str`.
+        run_id (str): ID of the metatask run.
+    """
+    id = input_data['id']
+    logger.info(f'{id} Converter result received')
+    _record_timeline(id, run_id, f'converter_{input_data["input_method"].lower()}', 'finished')
+
+    if not converter_result:
+        logger.warning(f'{id} Converter returned None')
+    elif input_data['input_method'] == 'SEQ':
+        _save_converter_str_result(id, converter_result)
+    else:
+        _save_converter_seq_result(id, converter_result)
+
+    if input_data['input_method'] == 'SEQ':
+        _run_seq_structure_dependents(input_data, run_id)
+    else:
+        _run_str_sequence_dependents(input_data, run_id)
+        logger.info(f'{id} metatask_STR finished')
+
+
+@celery.task(name='metatask_stage_done')
+def metatask_stage_done(input_data: dict, run_id: str, stage: str) -> None:
+    """
+    Callback fired when a pipeline stage (e.g. `conservation`) finished, starts the tasks waiting for it.
+
+    Args:
+        input_data (dict): Input data of the metatask.
+        run_id (str): ID of the metatask run.
+        stage (str): Finished stage.
+    """
+    logger.info(f'{input_data["id"]} {stage} worker finished')
+    _seq_stage_done(input_data, run_id, stage)
+
+
+@celery.task(name='metatask_timeline')
+def metatask_timeline(id: str, run_id: str, stage: str, event: str) -> None:
+    """Callback recording a stage event of a metatask run, see `_record_timeline`."""
+    _record_timeline(id, run_id, stage, event)
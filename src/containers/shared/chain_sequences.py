@@ -0,0 +1,75 @@
+import json
+import os
+from Bio.PDB import Polypeptide, is_aa
+from Bio.Data.IUPACData import protein_letters_3to1
+
+MAPPING_FILE = "mapping.json"
+
+_mapping = None
+
+
+def is_standard_aa(code):
+    return code.capitalize() in protein_letters_3to1
+
+
+def _get_mapping(mapping_file):
+    global _mapping
+    if _mapping is None:
+        with open(mapping_file, "r") as infile:
+            _mapping = json.load(infile)
+    return _mapping
+
+
+def extract_chain_sequences(pdb, mapping_file=MAPPING_FILE, logger=None):
+    """
+    Extracts amino acid sequences for each chain of a parsed structure and maps sequence indices
+    to structure residue indices. Non-standard residues are converted using the mapping file.
+
+    Args:
+        pdb (Bio.PDB.Structure.Structure): Parsed structure.
+        mapping_file (str): Path to the JSON mapping of non-standard residues to standard ones.
+        logger (logging.Logger | None): Logger for conversion messages.
+
+    Returns:
+        ```
+        {
+            "chains": {sequence: [chain_ids]},
+            "seqToStrMapping": {chain_id: {seq_index: structure_index}}
+        }
+        ```
+
+    Raises:
+        ValueError: A non-standard residue is not in the mapping file.
+    """
+    chains = {}
+    seq_to_str_mapping = {}
+    for model in pdb:
+        for chain in model:
+            seq = ""
+            seq_index = 0
+            for residue in chain:
+                if is_aa(residue, standard=False):
+                    structure_index = residue.id[1]
+                    residue = residue.resname
+                    if not is_standard_aa(residue):
+                        mapping_dict = _get_mapping(mapping_file)
+                        if residue in mapping_dict:
+                            if logger:
+                                logger.info(f'{pdb.id} Residue {residue} found in mapping file, converting to standard residue')
+                            residue = mapping_dict[residue]
+                        else:
+                            raise ValueError(f"Residue {residue} not found in {os.path.basename(mapping_file)}")
+                    chain_code = chain.id
+                    if chain_code not in seq_to_str_mapping:
+                        seq_to_str_mapping[chain_code] = {}
+                    seq_to_str_mapping[chain_code][seq_index] = structure_index
+                    seq += Polypeptide.index_to_one(Polypeptide.three_to_index(residue))
+                    seq_index += 1
+
+            if seq != "":
+                chains.setdefault(seq, []).append(chain.id)
+
+    return {
+        "chains": chains,
+        "seqToStrMapping": seq_to_str_mapping
+    }
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from tasks_logger import create_logger
+
+logger = create_logger('disk-cache')
+
+EVICTION_CHECK_FRACTION = 0.05  # run eviction after writing this fraction of the size limit
+EVICTION_TARGET_FRACTION = 0.9  # evict down to this fraction of the size limit
+LOG_STATS_EVERY = 100
+
+
+class DiskCache:
+    """
+    Size-bounded, content-addressed cache stored in a directory.
+
+    Entries are plain files, so the cache can be shared by all processes (and containers) which
+    mount the same directory. Writes are atomic (temporary file + rename), entries are evicted
+    in least-recently-used order (access time is refreshed on every hit) when the directory
+    grows over `max_bytes`. Optionally, entries older than `ttl` seconds are treated as missing,
+    lookups may also use their own TTL (e.g. shorter for metadata than for files in the same cache).
+    """
+
+    def __init__(self, name: str, directory: str, max_bytes: int, ttl: float | None = None):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._written_since_eviction = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Creates a cache key from the given parts (e.g. sequence, model name and version)."""
+        return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+    def path(self, key: str, suffix: str = "") -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get(self, key: str, suffix: str = "", ttl: float | None = None) -> str | None:
+        """Returns the path of a cached entry or None when it is missing or expired (`ttl` overrides the cache TTL)."""
+        ttl = self.ttl if ttl is None else ttl
+        path = self.path(key, suffix)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+
+        now = time.time()
+        if ttl is not None and now - stat.st_mtime > ttl:
+            self._count(hit=False)
+            return None
+
+        # Access time drives LRU eviction, modification time is kept for the TTL
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+        self._count(hit=True)
+        return path
+
+    def get_bytes(self, key: str, suffix: str = "", ttl: float | None = None) -> bytes | None:
+        """Returns the content of a cached entry or None when it is missing or expired."""
+        path = self.get(key, suffix, ttl)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None  # evicted by another process
+
+    def get_file(self, key: str, destination: str, suffix: str = "", ttl: float | None = None) -> bool:
+        """Copies a cached entry to `destination` (atomically), returns False when it is missing or expired."""
+        path = self.get(key, suffix, ttl)
+        if path is None:
+            return False
+        tmp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, destination)
+            return True
+        except FileNotFoundError:
+            return False  # evicted by another process
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def writer(self, key: str, suffix: str = ""):
+        """
+        Yields a temporary path to write an entry to. The entry is published atomically
+        when the block finishes without an exception.
+        """
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        os.close(fd)
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._written_since_eviction += os.path.getsize(path)
+        if self._written_since_eviction >= self.max_bytes * EVICTION_CHECK_FRACTION:
+            self.evict()
+
+    def put_bytes(self, key: str, data: bytes, suffix: str = "") -> str:
+        with self.writer(key, suffix) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        return self.path(key, suffix)
+
+    def put_file(self, key: str, source_path: str, suffix: str = "") -> str:
+        with self.writer(key, suffix) as tmp_path:
+            shutil.copyfile(source_path, tmp_path)
+        return self.path(key, suffix)
+
+    def evict(self):
+        """Removes expired entries and least recently used entries over the size limit."""
+        self._written_since_eviction = 0
+        now = time.time()
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.startswith(".tmp_"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed by another process
+                if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total_size += stat.st_size
+
+        if total_size <= self.max_bytes:
+            return
+
+        target_size = self.max_bytes * EVICTION_TARGET_FRACTION
+        for _, size, path in sorted(entries):
+            if total_size <= target_size:
+                break
+            self._remove(path)
+            total_size -= size
+        logger.info(f'{self.name} cache evicted down to {total_size} bytes')
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f'{self.name} cache metrics (pid {os.getpid()}): hits={stats["hits"]}, misses={stats["misses"]}, '
+            f'hit_rate={stats["hit_rate"]:.2f}, evictions={stats["evictions"]}'
+        )
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except FileNotFoundError:
+            pass
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if (self.hits + self.misses) % LOG_STATS_EVERY == 0:
+            self.log_stats()
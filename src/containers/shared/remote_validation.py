@@ -0,0 +1,235 @@
+import gzip
+import json
+import os
+import re
+
+import requests
+
+from tasks_logger import create_logger
+from disk_cache import DiskCache
+from transfer import download, write_atomic, TransferError, CHUNK_SIZE
+
+PDB_ID_URL = 'https://www.ebi.ac.uk/pdbe/api/pdb/entry/molecules/{}'
+PDB_FILE_URL = 'https://files.rcsb.org/download/{}.pdb'
+
+UNIPROT_ID_URL = 'https://rest.uniprot.org/uniprotkb/{}'
+UNIPROT_FILE_URL = 'https://alphafold.ebi.ac.uk/files/AF-{}-F1-model_v4.pdb'
+
+HTTP_TIMEOUT = (15, 30)
+# Connections kept open (and at most used at once) to each of the databases, per process
+REMOTE_MAX_CONNECTIONS = int(os.getenv('REMOTE_MAX_CONNECTIONS', 16))
+
+# Cache of metadata and structure files, a volume shared by http-server and metatask (disabled when not set)
+REMOTE_CACHE_DIR = os.getenv('REMOTE_CACHE_DIR')
+REMOTE_CACHE_MAX_MB = int(os.getenv('REMOTE_CACHE_MAX_MB', 2048))
+METADATA_TTL = int(os.getenv('REMOTE_CACHE_METADATA_TTL', 86400))
+STRUCTURE_TTL = int(os.getenv('REMOTE_CACHE_STRUCTURE_TTL', 7 * 86400))
+
+# Optional local mirrors, their files are used without any network access:
+#   PDB_MIRROR_DIR  - wwPDB layout (`{id[1:3]}/pdb{id}.ent.gz`) or flat (`pdb{id}.ent`, `{id}.pdb`, optionally gzipped)
+#   AFDB_MIRROR_DIR - AlphaFold DB files (`AF-{uniprot}-F1-model_v4.pdb`, optionally gzipped)
+PDB_MIRROR_DIR = os.getenv('PDB_MIRROR_DIR')
+AFDB_MIRROR_DIR = os.getenv('AFDB_MIRROR_DIR')
+
+AMINO_ACIDS = {
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+    'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL'
+}
+
+# 4 character PDB ID or the extended `pdb_` + 8 characters format
+PDB_CODE_PATTERN = re.compile(r'^([0-9][a-z0-9]{3}|pdb_[0-9]{4}[a-z0-9]{4})$')
+# UniProtKB accession, see https://www.uniprot.org/help/accession_numbers
+UNIPROT_CODE_PATTERN = re.compile(r'^([OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2})$')
+CHAINS_PATTERN = re.compile(r'^[A-Za-z0-9]{1,4}(,[A-Za-z0-9]{1,4})*$')
+
+logger = create_logger('remote-validation')
+
+
+class ValidationError(Exception):
+    """The input was rejected, the message is meant for the user."""
+
+
+def create_session(max_connections: int) -> requests.Session:
+    """
+    Creates a session which reuses connections. Each host gets its own pool of at most `max_connections`
+    connections, further requests to the host wait for a free connection instead of opening new ones.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=max_connections, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = create_session(REMOTE_MAX_CONNECTIONS)
+cache = DiskCache('remote', REMOTE_CACHE_DIR, REMOTE_CACHE_MAX_MB * 1024 * 1024) if REMOTE_CACHE_DIR and REMOTE_CACHE_MAX_MB > 0 else None
+
+
+def _fetch(url: str, ttl: int) -> bytes:
+    """Downloads `url` through the cache, raises `requests.RequestException` on failure (failures are not cached)."""
+    if cache:
+        content = cache.get_bytes(DiskCache.make_key(url), ttl=ttl)
+        if content is not None:
+            logger.info(f'Using cached {url}')
+            return content
+
+    response = session.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    _cache_put(url, lambda key: cache.put_bytes(key, response.content))
+    return response.content
+
+
+def _cache_put(url: str, put) -> None:
+    # the cache only saves requests, a full or read-only volume must not fail the validation
+    if not cache:
+        return
+    try:
+        put(DiskCache.make_key(url))
+    except OSError as e:
+        logger.warning(f'Cannot cache {url}: {str(e)}')
+
+
+def _find_mirrored(mirror_dir: str | None, filenames: list[str]) -> str | None:
+    if not mirror_dir:
+        return None
+    for filename in filenames:
+        path = os.path.join(mirror_dir, filename)
+        for candidate in (path, f'{path}.gz'):
+            if os.path.isfile(candidate):
+                logger.info(f'Using mirrored {candidate}')
+                return candidate
+    return None
+
+
+def _open_mirrored(path: str):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _copy_mirrored(path: str, filename: str) -> None:
+    with _open_mirrored(path) as f:
+        write_atomic(filename, iter(lambda: f.read(CHUNK_SIZE), b''))
+
+
+def _protein_chains(path: str) -> set[str]:
+    """Chains with standard amino acid residues in a (mirrored) PDB file."""
+    with _open_mirrored(path) as f:
+        return {
+            line[21:22].decode() for line in f
+            if line.startswith(b'ATOM') and line[17:20].decode().strip() in AMINO_ACIDS
+        }
+
+
+def check_pdb_code(pdb_code: str) -> str | None:
+    """Syntactic check of a PDB ID, returns an error message or None."""
+    if not PDB_CODE_PATTERN.match(pdb_code.lower()):
+        return f'Invalid PDB ID: {pdb_code}'
+    return None
+
+
+def check_uniprot_code(uniprot_code: str) -> str | None:
+    """Syntactic check of a UniProt accession, returns an error message or None."""
+    if not UNIPROT_CODE_PATTERN.match(uniprot_code.upper()):
+        return f'Invalid Uniprot ID: {uniprot_code}'
+    return None
+
+
+def check_chains(chains_str: str) -> str | None:
+    """Syntactic check of comma separated chain IDs (empty string means no chain restriction)."""
+    if chains_str and not CHAINS_PATTERN.match(chains_str):
+        return f'Invalid chains: {chains_str}'
+    return None
+
+
+def download_file(url: str, filename: str, ttl: int = STRUCTURE_TTL) -> bool:
+    """Downloads `url` to `filename`, the file is replaced only after a successful download."""
+    if cache and cache.get_file(DiskCache.make_key(url), filename, ttl=ttl):
+        logger.info(f'Using cached {url}, saved to: {filename}')
+        return True
+
+    logger.info(f'Downloading file from: {url}')
+    try:
+        download(url, filename, session=session, timeout=HTTP_TIMEOUT)
+    except TransferError as e:
+        logger.error(f'File download failed {str(e)}')
+        return False
+
+    logger.info(f'File saved to: {filename}')
+    _cache_put(url, lambda key: cache.put_file(key, filename))
+    return True
+
+
+def fetch_pdb(pdb_code: str, chains_str: str, filename: str) -> None:
+    """
+    Checks that the PDB entry exists in PDBe and contains the selected chains,
+    then downloads its structure from RCSB to `filename`.
+
+    Args:
+        pdb_code (str): PDB ID of the entry.
+        chains_str (str): Comma separated chain IDs, empty string means no chain restriction.
+        filename (str): Where to save the structure.
+
+    Raises:
+        ValidationError: The entry does not exist, the chains are wrong or the file cannot be downloaded.
+    """
+    pdb_id = pdb_code.lower()
+    selected_chains = set((chains_str.split(',') if chains_str else []))
+
+    mirrored = _find_mirrored(PDB_MIRROR_DIR, [
+        os.path.join(pdb_id[1:3], f'pdb{pdb_id}.ent'), f'pdb{pdb_id}.ent', f'{pdb_id}.pdb'
+    ])
+    if mirrored:
+        if not (selected_chains <= _protein_chains(mirrored)):
+            raise ValidationError('Wrong chains selected')
+        _copy_mirrored(mirrored, filename)
+        return
+
+    try:
+        url = PDB_ID_URL.format(pdb_id)
+        logger.info(f'Downloading protein metadata from: {url}')
+        response_data = json.loads(_fetch(url, METADATA_TTL))[pdb_id]
+        logger.info('Protein metadata downloaded successfully')
+    except (requests.RequestException, ValueError, KeyError) as e:
+        raise ValidationError(f'PDB ID {pdb_id} not found in database due to an error: {str(e)}')
+
+    protein_chains = set()
+    for entity in response_data:
+        if entity.get("molecule_type", "").startswith('polypeptide'):
+            protein_chains.update(entity.get("in_chains", []))
+
+    if not (selected_chains <= protein_chains):
+        raise ValidationError('Wrong chains selected')
+
+    if not download_file(PDB_FILE_URL.format(pdb_id), filename):
+        raise ValidationError('PDB ID found, but cannot find or download corresponding .pdb file')
+
+
+def fetch_uniprot(uniprot_code: str, filename: str) -> None:
+    """
+    Checks that the UniProt entry exists and downloads its predicted structure
+    from AlphaFold DB to `filename`.
+
+    Args:
+        uniprot_code (str): UniProt accession of the entry.
+        filename (str): Where to save the structure.
+
+    Raises:
+        ValidationError: The entry does not exist or the file cannot be downloaded.
+    """
+    uniprot_id = uniprot_code.upper()
+
+    # the entry exists when its predicted structure is mirrored
+    mirrored = _find_mirrored(AFDB_MIRROR_DIR, [os.path.basename(UNIPROT_FILE_URL.format(uniprot_id))])
+    if mirrored:
+        _copy_mirrored(mirrored, filename)
+        return
+
+    try:
+        url = UNIPROT_ID_URL.format(uniprot_id)
+        logger.info(f'Downloading protein metadata from: {url}')
+        _fetch(url, METADATA_TTL)
+        logger.info('Protein metadata downloaded successfully')
+    except requests.RequestException as e:
+        raise ValidationError(f'Uniprot ID {uniprot_id} not found in database due to an error: {str(e)}')
+
+    if not download_file(UNIPROT_FILE_URL.format(uniprot_id), filename):
+        raise ValidationError('Uniprot ID found, but cannot find or download corresponding .pdb file')
@@ -1,6 +1,7 @@
 import json
 from enum import Enum
 from tasks_logger import create_logger
+from storage import publish_result
 
 logger = create_logger('status-manager')
 
@@ -15,6 +16,7 @@ def update_status(status_file_path, id, status: StatusType, infoMessage = "", er
     try:
         with open(status_file_path, "w") as f:
             json.dump({"status": status.value, "infoMessage": infoMessage, "errorMessage": errorMessage}, f)
+        publish_result(status_file_path)
         logger.info(f'{id} Status changed')
     except Exception as e:
         logger.error(f'{id} Status change failed: {str(e)}')
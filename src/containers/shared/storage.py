@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+import requests
+
+from tasks_logger import create_logger
+from transfer import download, write_atomic, TransferError
+
+# Where workers read shared data (inputs, results of other tasks) from:
+#   http  - Apache (`STORAGE_URL`), the default
+#   local - volumes mounted under `STORAGE_DIR` (e.g. `inputs:/app/data/inputs:ro`)
+#   s3    - S3-compatible object store (`STORAGE_S3_ENDPOINT`, e.g. MinIO), credentials from `AWS_*` variables
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'http')
+STORAGE_URL = os.getenv('STORAGE_URL', 'http://apache:80/data')
+STORAGE_DIR = os.getenv('STORAGE_DIR', '/app/data')
+STORAGE_S3_ENDPOINT = os.getenv('STORAGE_S3_ENDPOINT')
+STORAGE_S3_BUCKET = os.getenv('STORAGE_S3_BUCKET', 'plankweb')
+STORAGE_S3_PREFIX = os.getenv('STORAGE_S3_PREFIX', '')
+# Area of the results written by this container (e.g. `conservation`), used to publish them to the object store
+STORAGE_RESULTS_AREA = os.getenv('STORAGE_RESULTS_AREA')
+STORAGE_FETCH_WORKERS = int(os.getenv('STORAGE_FETCH_WORKERS', 8))
+HTTP_TIMEOUT = (10, 20)
+RESULTS_FOLDER = 'results'
+
+logger = create_logger('storage')
+
+_storage = None
+
+
+class StorageError(Exception):
+    """Shared data could not be read (or published)."""
+
+
+class NotFoundError(StorageError):
+    """Requested file does not exist in the storage."""
+
+
+class Storage(ABC):
+    """
+    Read access to data shared between containers. Paths are relative to the data root,
+    e.g. `inputs/{id}/chains.json` or `ds_p2rank/{id}/status.json`.
+    """
+
+    @abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        pass
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.read_bytes(path)
+            return True
+        except NotFoundError:
+            return False
+
+    def save(self, path: str, destination: str) -> None:
+        """Stores the file at `path` to the local file `destination` (written atomically)."""
+        write_atomic(destination, [self.read_bytes(path)])
+
+    def publish(self, path: str, local_file: str) -> None:
+        """
+        Makes a file written to a volume of this container available at `path`. The HTTP and local
+        backends read the volumes directly, so only the object store needs an upload.
+        """
+
+    def read_text(self, path: str) -> str:
+        return self.read_bytes(path).decode()
+
+    def read_json(self, path: str):
+        try:
+            return json.loads(self.read_bytes(path))
+        except ValueError as e:
+            raise StorageError(f'Invalid JSON in {path}: {str(e)}')
+
+    def fetch_all(self, paths: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Reads all files at once (concurrently for the remote backends).
+
+        Args:
+            paths (Iterable[str]): Paths of the files.
+
+        Returns:
+            Dict[str, bytes]: Content of each file.
+
+        Raises:
+            StorageError: Any of the files could not be read.
+        """
+        paths = list(dict.fromkeys(paths))
+        if len(paths) <= 1:
+            return {path: self.read_bytes(path) for path in paths}
+        with ThreadPoolExecutor(max_workers=min(STORAGE_FETCH_WORKERS, len(paths))) as executor:
+            return dict(zip(paths, executor.map(self.read_bytes, paths)))
+
+
+class HttpStorage(Storage):
+    """Reads the data over HTTP from the Apache container serving the shared volumes."""
+
+    def __init__(self, base_url: str = STORAGE_URL):
+        self.base_url = base_url.rstrip('/')
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=STORAGE_FETCH_WORKERS)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def url(self, path: str) -> str:
+        return f'{self.base_url}/{path.lstrip("/")}'
+
+    def read_bytes(self, path: str) -> bytes:
+        url = self.url(path)
+        try:
+            response = self._session.get(url, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            raise StorageError(f'Failed to download {url}: {str(e)}')
+        if response.status_code == 404:
+            raise NotFoundError(f'{url} not found')
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise StorageError(str(e))
+        return response.content
+
+    def save(self, path: str, destination: str) -> None:
+        url = self.url(path)
+        try:
+            download(url, destination, session=self._session, timeout=HTTP_TIMEOUT)
+        except TransferError as e:
+            if e.status_code == 404:
+                raise NotFoundError(f'{url} not found')
+            raise StorageError(str(e))
+
+
+class LocalStorage(Storage):
+    """
+    Reads the data directly from the shared volumes mounted under `root`, without any HTTP round trip.
+    Files are copied with `os.sendfile` (by `shutil.copyfile`), or hard-linked when on the same volume.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR):
+        self.root = root
+
+    def local_path(self, path: str) -> str:
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def read_bytes(self, path: str) -> bytes:
+        try:
+            with open(self.local_path(path), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise NotFoundError(f'{self.local_path(path)} not found')
+        except OSError as e:
+            raise StorageError(f'Failed to read {self.local_path(path)}: {str(e)}')
+
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(self.local_path(path))
+
+    def fetch_all(self, paths: Iterable[str]) -> Dict[str, bytes]:
+        return {path: self.read_bytes(path) for path in dict.fromkeys(paths)}
+
+    def save(self, path: str, destination: str) -> None:
+        source = self.local_path(path)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        tmp_file = f'{destination}.{uuid.uuid4().hex}.tmp'
+        try:
+            try:
+                os.link(source, tmp_file)
+            except OSError:
+                shutil.copyfile(source, tmp_file)
+            os.replace(tmp_file, destination)
+        except FileNotFoundError:
+            raise NotFoundError(f'{source} not found')
+        except OSError as e:
+            raise StorageError(f'Failed to copy {source}: {str(e)}')
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+
+class S3Storage(Storage):
+    """
+    Reads the data from an S3-compatible object store (AWS S3, or MinIO as a local stand-in).
+    Writers publish their files with `publish`, keys are `STORAGE_S3_PREFIX` + path.
+    """
+
+    def __init__(self, endpoint: str | None = STORAGE_S3_ENDPOINT, bucket: str = STORAGE_S3_BUCKET, prefix: str = STORAGE_S3_PREFIX):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise StorageError('STORAGE_BACKEND=s3 requires boto3')
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client('s3', endpoint_url=endpoint, config=Config(max_pool_connections=STORAGE_FETCH_WORKERS))
+
+    def key(self, path: str) -> str:
+        return self.prefix + path.lstrip('/')
+
+    def read_bytes(self, path: str) -> bytes:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=self.key(path))['Body'].read()
+        except self._client.exceptions.NoSuchKey:
+            raise NotFoundError(f's3://{self.bucket}/{self.key(path)} not found')
+        except Exception as e:
+            raise StorageError(f'Failed to read s3://{self.bucket}/{self.key(path)}: {str(e)}')
+
+    def save(self, path: str, destination: str) -> None:
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        tmp_file = f'{destination}.{uuid.uuid4().hex}.tmp'
+        try:
+            self._client.download_file(self.bucket, self.key(path), tmp_file)
+            os.replace(tmp_file, destination)
+        except Exception as e:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise NotFoundError(f's3://{self.bucket}/{self.key(path)} not found')
+            raise StorageError(f'Failed to download s3://{self.bucket}/{self.key(path)}: {str(e)}')
+
+    def publish(self, path: str, local_file: str) -> None:
+        try:
+            self._client.upload_file(local_file, self.bucket, self.key(path))
+        except Exception as e:
+            raise StorageError(f'Failed to upload {local_file} to s3://{self.bucket}/{self.key(path)}: {str(e)}')
+
+
+def get_storage() -> Storage:
+    """Returns the storage backend configured by `STORAGE_BACKEND` (created once per process)."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == 'local':
+            _storage = LocalStorage()
+        elif STORAGE_BACKEND == 's3':
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == 'http':
+            _storage = HttpStorage()
+        else:
+            raise StorageError(f'Unknown storage backend: {STORAGE_BACKEND}')
+        logger.info(f'Using {STORAGE_BACKEND} storage backend')
+    return _storage
+
+
+def input_path(id: str, filename: str) -> str:
+    return f'inputs/{id}/{filename}'
+
+
+def fetch_inputs(id: str, filenames: Iterable[str] = ()) -> Dict[str, bytes]:
+    """
+    Input phase of a worker: reads `chains.json` of the input and then all FASTA files it lists,
+    together with any other requested input files, in a single bulk fetch.
+
+    Args:
+        id (str): Generated ID for the input protein.
+        filenames (Iterable[str]): Other input files to fetch with the FASTA files (e.g. `structure.pdb`).
+
+    Returns:
+        Dict[str, bytes]: Content of each fetched file by its file name (including `chains.json`).
+
+    Raises:
+        StorageError: Any of the files could not be read.
+    """
+    storage = get_storage()
+    chains_json = storage.read_bytes(input_path(id, 'chains.json'))
+    try:
+        fasta_files = list(json.loads(chains_json).get('fasta', {}))
+    except ValueError as e:
+        raise StorageError(f'{id} Invalid chains.json: {str(e)}')
+
+    filenames = list(dict.fromkeys([*fasta_files, *filenames]))
+    files = storage.fetch_all(input_path(id, filename) for filename in filenames)
+    result = {filename: files[input_path(id, filename)] for filename in filenames}
+    result['chains.json'] = chains_json
+    logger.info(f'{id} Fetched {len(result)} input files')
+    return result
+
+
+def publish_result(local_file: str) -> None:
+    """
+    Publishes a file from the results folder of this container (`results/{id}/...`) as
+    `{STORAGE_RESULTS_AREA}/{id}/...`, so other containers can read it through the object store.
+    Does nothing with the HTTP and local backends.
+    """
+    if STORAGE_BACKEND != 's3' or not STORAGE_RESULTS_AREA:
+        return
+    relative_path = os.path.relpath(local_file, RESULTS_FOLDER)
+    get_storage().publish(f'{STORAGE_RESULTS_AREA}/{relative_path}', local_file)
+
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Iterable
+from urllib.parse import urlsplit
+
+import requests
+
+from tasks_logger import create_logger
+
+CHUNK_SIZE = 64 * 1024
+HTTP_TIMEOUT = (15, 30)
+
+logger = create_logger('transfer')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TransferError(Exception):
+    """Download failed, the destination file was left untouched."""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class TransferResult:
+    size: int           # bytes written to the destination
+    wire_size: int      # bytes received (before decompression of `gzipped` payloads)
+    sha256: str
+    seconds: float
+
+
+class TransferStats:
+    """Byte and latency counters of all transfers of the process, per host."""
+
+    def __init__(self):
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def add(self, host: str, size: int, seconds: float, failed: bool = False) -> None:
+        with self._lock:
+            stats = self.hosts.setdefault(host, {'transfers': 0, 'failures': 0, 'bytes': 0, 'seconds': 0.0})
+            stats['transfers'] += 1
+            stats['failures'] += failed
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {host: dict(stats) for host, stats in self.hosts.items()}
+
+
+stats = TransferStats()
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        return _session
+
+
+def write_atomic(destination: str, chunks: Iterable[bytes], expected_sha256: str | None = None) -> tuple[int, str]:
+    """
+    Writes `chunks` to a temporary file next to `destination`, then (after fsync) renames it to
+    `destination`, so readers never see a partially written file.
+
+    Returns:
+        tuple[int, str]: Number of written bytes and their SHA-256.
+
+    Raises:
+        TransferError: The content does not match `expected_sha256`, `destination` is left untouched.
+    """
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    tmp_file = f'{destination}.{uuid.uuid4().hex}.tmp'
+    checksum = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected_sha256 and checksum.hexdigest() != expected_sha256:
+            raise TransferError(f'Checksum mismatch for {destination}: expected {expected_sha256}, got {checksum.hexdigest()}')
+        os.replace(tmp_file, destination)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return size, checksum.hexdigest()
+
+
+def _gunzip(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def download(
+        url: str,
+        destination: str,
+        session: requests.Session | None = None,
+        timeout: tuple = HTTP_TIMEOUT,
+        gzipped: bool = False,
+        expected_sha256: str | None = None,
+        method: str = 'GET',
+        data=None
+) -> TransferResult:
+    """
+    Streams `url` to `destination` in `CHUNK_SIZE` chunks without holding the response in memory.
+    The file appears atomically (temporary file, fsync, rename) and only after a complete download.
+
+    Args:
+        url (str): URL to download.
+        destination (str): Path of the downloaded file.
+        session (requests.Session | None): Session to reuse connections of, a shared one by default.
+        timeout (tuple): Connect and read timeouts.
+        gzipped (bool): The payload is a gzip file (e.g. `.pdb.gz`), it is decompressed while streaming.
+            Compressed transfer encoding (`Content-Encoding: gzip`) is handled by requests.
+        expected_sha256 (str | None): Checksum the downloaded (decompressed) file must have.
+        method (str): HTTP method.
+        data: Request body.
+
+    Returns:
+        TransferResult: Size, checksum and duration of the transfer.
+
+    Raises:
+        TransferError: The download failed or the checksum does not match.
+    """
+    session = session or _get_session()
+    host = urlsplit(url).netloc
+    wire_size = 0
+    start = time.perf_counter()
+
+    def chunks(response):
+        nonlocal wire_size
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            wire_size += len(chunk)
+            yield chunk
+
+    try:
+        with session.request(method, url, data=data, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            content = _gunzip(chunks(response)) if gzipped else chunks(response)
+            size, sha256 = write_atomic(destination, content, expected_sha256)
+    except (requests.RequestException, zlib.error, OSError, TransferError) as e:
+        stats.add(host, wire_size, time.perf_counter() - start, failed=True)
+        if isinstance(e, TransferError):
+            raise
+        status_code = e.response.status_code if isinstance(e, requests.HTTPError) and e.response is not None else None
+        raise TransferError(f'Failed to download {url}: {str(e)}', status_code)
+
+    seconds = time.perf_counter() - start
+    stats.add(host, wire_size, seconds)
+    rate = wire_size / seconds / 1024 / 1024 if seconds else 0.0
+    logger.info(f'Downloaded {url}: {size} bytes ({wire_size} transferred) in {seconds:.2f} s ({rate:.2f} MB/s), sha256 {sha256}')
+    return TransferResult(size=size, wire_size=wire_size, sha256=sha256, seconds=seconds)
@@ -441,7 +441,7 @@ function AnalyticalPage() {
 		}
 
 		// Init seq to struct mapping for each chain if not inited yet (this is just for query protein)
-		if (!querySeqToStrMappings.current) {
+		if (status !== DataStatus.Failed && !querySeqToStrMappings.current) {
 			const {
 				seqToStrMappings: seqToStrMappingsTmp,
 				userFriendlyErrorMessage: querySeqToStrMappingsFetchingErrorMessage
@@ -460,7 +460,9 @@ function AnalyticalPage() {
 			updateStatusMessages(dataSourceIndex, `${dataSourceExecutors.current[dataSourceIndex].displayName}: ${infoMessage}`, false);
 			return;
 		} else if (status === DataStatus.Failed) {
-			const errMsg = `Failed to fetch data from ${dataSourceExecutors.current[dataSourceIndex].displayName}, skipping.`;
+			const errMsg = infoMessage
+				? `${dataSourceExecutors.current[dataSourceIndex].displayName}: ${infoMessage}`
+				: `Failed to fetch data from ${dataSourceExecutors.current[dataSourceIndex].displayName}, skipping.`;
 			updateErrorMessages(dataSourceIndex, errMsg);
 		} else if (status === DataStatus.Completed) {
 			const {
@@ -81,6 +81,11 @@ export async function getDataSourceExecutorResultStatusAPI(
 	catch (error) {
 		if (error?.status === 404) {
 			console.warn(`Status for ${dataSourceName} and ${id} is missing. Maybe just not created yet?`);
+			const inputStatus = await getInputStatusAPI(id);
+			if (inputStatus?.status === DataStatus.Failed) {
+				// Input was rejected while being validated, data source executors will never run
+				return { status: DataStatus.Failed, infoMessage: inputStatus.errorMessage, userFriendlyErrorMessage: "" };
+			}
 		} else {
 			const errMsgs = getErrorMessages(error);
 			errMsgs.forEach(errMsg => console.error(errMsg));
@@ -90,6 +95,20 @@ export async function getDataSourceExecutorResultStatusAPI(
 	}
 }
 
+/**
+ * Returns the status of the input validation, which is done asynchronously for PDB and UniProt inputs,
+ * or null when it is not available (e.g. the input was validated when uploaded).
+ */
+async function getInputStatusAPI(id: string): Promise<DataStatusResponse | null> {
+	try {
+		const response = await axios.get<DataStatusResponse>(`${apiBaseUrl}/data/inputs/${id}/status.json`);
+		return response.data;
+	}
+	catch {
+		return null;
+	}
+}
+
 export async function getDataSourceExecutorResultAPI(
 	dataSourceName: string,
 	id: string,
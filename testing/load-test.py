@@ -0,0 +1,81 @@
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVER_URL = "http://localhost:9864"
+
+# Inputs which are already known to the server are cheap for the pipeline (the ID exists,
+# no tasks are recomputed), so the load test measures mostly the upload path itself.
+PDB_CODES = ["2src", "1fbl", "6xez", "1a0o", "4hhb"]
+UNIPROT_CODES = ["P12345", "P69905", "P68871"]
+SEQUENCE = "MGSSHHHHHHSSGLVPRGSHMASMTGGQQMGRGS"
+
+def _payload(input_type: str, i: int) -> dict:
+    match input_type:
+        case "pdb":
+            return {"inputMethod": "0", "pdbCode": PDB_CODES[i % len(PDB_CODES)], "chains": "", "useConservation": "true"}
+        case "uniprot":
+            return {"inputMethod": "2", "uniprotCode": UNIPROT_CODES[i % len(UNIPROT_CODES)], "useConservation": "true"}
+        case _:
+            return {"inputMethod": "3", "sequence": SEQUENCE, "useConservation": "true"}
+
+def _upload(session: requests.Session, url: str, payload: dict) -> tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        response = session.post(url, data=payload, timeout=(15, 120))
+        ok = response.status_code == 200
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def _percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def run_level(url: str, input_type: str, concurrency: int, total: int) -> dict:
+    """Sends `total` uploads with `concurrency` clients, returns throughput and latency statistics."""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: _upload(session, url, _payload(input_type, i)), range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(not ok for _, ok in results),
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p95": _percentile(latencies, 0.95) if latencies else float("nan"),
+        "p99": _percentile(latencies, 0.99) if latencies else float("nan"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of /upload-data with increasing number of concurrent clients.")
+    parser.add_argument("--url", default=SERVER_URL, help=f"Plankweb URL (default {SERVER_URL})")
+    parser.add_argument("--input", choices=["pdb", "uniprot", "sequence"], default="pdb", help="Type of uploaded inputs")
+    parser.add_argument("--concurrency", default="1,4,8,16,32,64", help="Comma separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Uploads per concurrency level")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate at which the service is considered saturated")
+    args = parser.parse_args()
+
+    url = f"{args.url.rstrip('/')}/upload-data"
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 [s]':>8} {'p95 [s]':>8} {'p99 [s]':>8}")
+
+    sustained = None
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        r = run_level(url, args.input, concurrency, max(args.requests, concurrency))
+        print(f"{r['concurrency']:>8} {r['requests']:>9} {r['errors']:>7} {r['throughput']:>8.1f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}")
+        if r["errors"] / r["requests"] > args.max_error_rate:
+            break
+        sustained = concurrency
+
+    print(f"Sustained concurrent uploads: {sustained if sustained is not None else 'none'}")
+
+if __name__ == "__main__":
+    main()